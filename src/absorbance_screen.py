@@ -1,17 +1,182 @@
+import re
+from functools import partial
+import numpy as np
 from kivy.base import Builder
 from kivy.uix.screenmanager import Screen
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.label import Label
 from kivy.clock import mainthread
-from kivy.properties import ObjectProperty
+from kivy.app import App
+from kivy.properties import ObjectProperty, ListProperty, DictProperty
+from lib_spectro.absorbance import AbsorbanceBatch
+from kinetics_screen import PopupWavelengthKinetics
+from popups import PopupOperation
 
 
 class AbsorbanceScreen(Screen):
     main_app = ObjectProperty()
 
 
+class BoxAbsorbance(BoxLayout):
+    # wavelengths of the measures (nm)
+    wavelengths = ListProperty([500])
+    batch = ObjectProperty(None, allownone=True)
+    # results table labels: (sample index, column) -> Label
+    cells = DictProperty()
+
+    def ask_wl(self):
+        p = PopupWavelengthKinetics(wavelength=self.wavelengths[0], wavelengths=list(self.wavelengths),
+                                    ok_clbk=self.wavelengths_selected)
+        p.open()
+
+    def wavelengths_selected(self, wavelengths):
+        if wavelengths:
+            self.wavelengths = wavelengths
+
+    def on_wavelengths(self, instance, wavelengths):
+        # new series: blank has to be measured again
+        self.batch = None
+        self.ids['boxabs_calibration_lbl'].text = ""
+
+    def get_batch(self, main_app):
+        """return the series of the selected wavelengths, the results table is cleared for a new one"""
+        if self.batch is None:
+            self.batch = AbsorbanceBatch(main_app.spectro, self.wavelengths)
+            self.batch.result_clbk = partial(self.result_done, self.batch)
+            grid = self.ids['results_grid']
+            grid.clear_widgets()
+            self.cells = {}
+            grid.cols = 2 + 2 * len(self.batch.wavelengths)
+            headers = ["Échantillon", "C étalon"]
+            for wl in self.batch.wavelengths:
+                headers += ["A {:d} nm".format(wl), "C {:d} nm".format(wl)]
+            for header in headers:
+                grid.add_widget(Label(text=header, bold=True, size_hint_y=None, height='30dp'))
+        return self.batch
+
+    def perform_blank(self, main_app):
+        if not main_app.spectro.connected:
+            main_app.show_message("Absorbance", "Spectromètre non connecté")
+            return
+        main_app.popup_operation = PopupOperation()
+        main_app.popup_operation.open()
+        main_app.popup_operation.update("Mesure du blanc", "En cours...")
+        self.get_batch(main_app).measure_blank(clbk=self.blank_done)
+
+    @mainthread
+    def blank_done(self, blanks):
+        App.get_running_app().popup_operation.dismiss()
+
+    def perform_sample(self, main_app):
+        """queue the measures of the sample, the next one can be queued right away"""
+        if not main_app.spectro.connected:
+            main_app.show_message("Absorbance", "Spectromètre non connecté")
+            return
+        label_input, concentration_input = self.ids['sample_label_input'], self.ids['sample_concentration_input']
+        batch = self.get_batch(main_app)
+        label = label_input.text.strip() or "Ech {:d}".format(len(batch) + 1)
+        try:
+            concentration = float(concentration_input.text.replace(',', '.')) if concentration_input.text else None
+        except ValueError:
+            main_app.show_message("Absorbance", "Concentration invalide")
+            return
+        index = batch.measure_sample(label, concentration)
+        self.add_row(index, label, concentration)
+        # next sample label: same name with the next number
+        match = re.match(r"(.*?)(\d+)$", label)
+        label_input.text = "{:s}{:d}".format(match.group(1), int(match.group(2)) + 1) if match else ""
+        concentration_input.text = ""
+
+    def add_row(self, index, label, concentration):
+        grid = self.ids['results_grid']
+        texts = [label, "" if concentration is None else "{:g}".format(concentration)]
+        texts += ["..."] * (grid.cols - 2)
+        for column, text in enumerate(texts):
+            cell = Label(text=text, size_hint_y=None, height='30dp')
+            self.cells[(index, column)] = cell
+            grid.add_widget(cell)
+
+    @mainthread
+    def result_done(self, batch, index, idx, absorbance):
+        """a result of the series (main thread)"""
+        if batch is not self.batch:
+            # the wavelengths changed since the sample was queued
+            return
+        self.cells[(index, 2 + 2 * idx)].text = "erreur" if absorbance is None else "{:.4f}".format(absorbance)
+        if not np.isnan(self.batch.known[index]):
+            # a standard changes the calibration of all the samples
+            self.update_calibration()
+        else:
+            self.update_concentrations()
+        absorbances = self.batch.absorbances[index]
+        if absorbance is not None and not np.isnan(absorbances).any():
+            App.get_running_app().record_acquisition('absorbance', self.batch.wavelengths[0],
+                                                     self.batch.wavelengths[-1], ("wavelength", "absorbance"),
+                                                     zip(self.batch.wavelengths, absorbances),
+                                                     label=self.batch.labels[index])
+
+    def update_calibration(self):
+        texts = []
+        for wl, fit in zip(self.batch.wavelengths, self.batch.fits()):
+            if fit is not None:
+                texts.append("{:d} nm: A = ({:.4g} ± {:.2g}) C + {:.4f} (r² {:.4f})".format(
+                    wl, fit.slope, fit.slope_ci, fit.intercept, fit.r2))
+        self.ids['boxabs_calibration_lbl'].text = ", ".join(texts)
+        self.update_concentrations()
+
+    def update_concentrations(self):
+        """concentrations of all the samples, computed at once"""
+        concentrations = self.batch.concentrations()
+        for (index, idx), value in np.ndenumerate(concentrations):
+            self.cells[(index, 3 + 2 * idx)].text = "" if np.isnan(value) else "{:.4g}".format(value)
+
+
 Builder.load_string("""
 <AbsorbanceScreen>:
     BoxLayout:
         orientation: "vertical"
-        Label:
-            text: "abs"
+        padding: 30
+        BoxAbsorbance:
+
+<BoxAbsorbance>
+    orientation: 'vertical'
+    Label:
+        id: boxabs_title_lbl
+        text: 'Absorbance'
+        size_hint_y: None
+        height: dp(30)
+    BoxLayout:
+        size_hint_y: None
+        height: dp(100)
+        Button:
+            text: "longueur d'ondes"
+            on_release: root.ask_wl()
+        Button:
+            text: "Blanc"
+            on_release: root.perform_blank(app)
+        BoxLayout:
+            orientation: 'vertical'
+            TextInput:
+                id: sample_label_input
+                hint_text: "échantillon"
+                multiline: False
+            TextInput:
+                id: sample_concentration_input
+                hint_text: "concentration (étalon)"
+                multiline: False
+                input_filter: 'float'
+        Button:
+            text: "Mesure"
+            on_release: root.perform_sample(app)
+    Label:
+        id: boxabs_calibration_lbl
+        text: ""
+        size_hint_y: None
+        height: dp(30)
+    ScrollView:
+        GridLayout:
+            id: results_grid
+            cols: 4
+            size_hint_y: None
+            height: self.minimum_height
 """)
@@ -1,42 +1,51 @@
 from kivy.base import Builder
 from kivy.uix.screenmanager import Screen
-from kivy.clock import Clock, mainthread
-from kivy.base import platform
+from kivy.clock import mainthread
 from kivy.logger import Logger
-from kivy.properties import ObjectProperty
-
-if platform in ['windows', 'linux']:
-    from serial.tools import list_ports
-
-    def get_serial_ports_list():
-        ports = list_ports.comports()
-        return [item.device for item in ports]
-
-elif platform == 'android':
-    from usb4a import usb
-
-    def get_serial_ports_list():
-        usb_device_list = usb.get_usb_device_list()
-        return [device.getDeviceName() for device in usb_device_list]
+from kivy.properties import ObjectProperty, DictProperty
+from lib_spectro.ports_watcher import SerialPortWatcher
 
 
 class DeviceScreen(Screen):
     main_app = ObjectProperty()
 
+    # port name -> PortInfo for the ports currently plugged
+    ports_info = DictProperty()
+    # port name -> DeviceInfo for the ports where a spectrometer was found
+    devices_found = DictProperty()
+    ports_watcher = ObjectProperty(None, allownone=True)
+
     # ---- Serial ports & com
     def ports_update_state(self, on=False):
-        if on:
-            Logger.info("Serial: Turning on port update")
-            self.update_serial_ports()
-            self.ports_update_event = Clock.schedule_interval(lambda dt: self.update_serial_ports(), 1.0)
-        else:
+        """watch the serial ports (and probe them) only while not connected"""
+        if on and not self.main_app.spectro.connected:
+            if self.ports_watcher is None:
+                Logger.info("Serial: Turning on port update")
+                self.ports_watcher = SerialPortWatcher(self.serial_ports_changed)
+                self.ports_watcher.start()
+        elif self.ports_watcher is not None:
             Logger.info("Serial: Turning off port update")
-            self.ports_update_event.cancel()
+            self.ports_watcher.stop()
+            self.ports_watcher = None
+
+    @mainthread
+    def serial_ports_changed(self, ports):
+        if self.ports_watcher is None:
+            # scheduled before the watcher was stopped
+            return
+        self.ports_info = ports
+        self.update_serial_ports_ui(sorted(ports))
+        if not self.main_app.spectro.connected:
+            # never probe a port in use: the probe would answer in place of the driver
+            self.main_app.discovery.discover(ports, self.devices_discovered, exclude=set(self.main_app.drivers()))
 
-    def update_serial_ports(self):
-        ports = get_serial_ports_list()
-        Logger.info("Serial ports: found {:s}".format(str(ports)))
-        self.update_serial_ports_ui(ports)
+    @mainthread
+    def devices_discovered(self, found):
+        self.devices_found = found
+        wid = self.ids["serial_port"]
+        # select the spectrometer if there is only one and the user did not choose another one
+        if len(found) == 1 and wid.text not in found:
+            wid.text = list(found)[0]
 
     def update_serial_ports_ui(self, ports_list):
         wid = self.ids["serial_port"]
@@ -58,15 +67,26 @@ class DeviceScreen(Screen):
     def connect(self, button, state):
         if self.main_app.serial_port is not None:
             if state == "down":
+                discovery = self.main_app.discovery
+                discovery.cancel()
+                if discovery.busy:
+                    # a probe may have the port open
+                    self.main_app.show_message("Connexion", "Recherche des spectromètres en cours, réessayer")
+                    button.state = "normal"
+                    return
                 Logger.info("Serial port: Connecting to {:s}".format(self.main_app.serial_port))
                 ret = self.main_app.spectro.connect(self.main_app.serial_port)
                 self.set_ui_connect_state(True)
                 if ret:
                     Logger.info("Device: Starting...")
+                    # the instrument may have been restarted since its last baseline
+                    self.main_app.baselines.invalidate(self.main_app.spectro.port)
+                    self.main_app.devices.add(self.main_app.spectro.port, self.main_app.spectro.backend)
                     self.main_app.spectro.start_device(clbk=self.connect_callback)
                 else:
                     self.set_ui_connect_state(False)
             else:
+                self.main_app.devices.remove(self.main_app.serial_port)
                 self.main_app.spectro.disconnect()
                 self.set_ui_connect_state(False)
                 Logger.info("Serial port: Disconnecting...")
@@ -84,13 +104,37 @@ class DeviceScreen(Screen):
             self.main_app.root.ids['connect_label'].backgound_color = (1, 0, 0, 1)
             self.main_app.root.ids['connect_label'].text = "Non Connecté"
 
+    def connection_changed(self, state):
+        """called by the driver when the connection breaks ('lost') and is restored ('reconnected') or not ('failed')
+        the port is the one of the driver, the selected port may have changed when the main thread handles it"""
+        self._connection_changed(self.main_app.spectro.port, state)
+
+    @mainthread
+    def _connection_changed(self, port, state):
+        if state == 'lost':
+            self.main_app.show_message("Connexion perdue", "Reconnexion en cours...", 3.)
+            self.main_app.baselines.invalidate(port)
+        elif state == 'reconnected':
+            self.main_app.show_message("Connexion", "Spectromètre reconnecté")
+        else:
+            self.main_app.show_message("Connection Error", "Can't reconnect to device (really plugged ?)", 5.)
+            self.main_app.devices.remove(port)
+            self.main_app.spectro.disconnect()
+            # watch the ports again once disconnected
+            self.set_ui_connect_state(False)
+
     @mainthread
     def connect_callback(self, ret_val):
         Logger.info("Device: returned {!r}".format(ret_val))
         if ret_val is None or not ret_val:
             self.main_app.show_message("Connection Error", "Can't connect to device (really plugged ?)", 5.)
-            self.set_ui_connect_state(False)
+            port_info = self.ports_info.get(self.main_app.serial_port)
+            if port_info is not None and port_info.serial_number:
+                self.main_app.discovery.forget(port_info.serial_number)
+            self.main_app.devices.remove(self.main_app.serial_port)
             self.main_app.spectro.disconnect()
+            # watch the ports again once disconnected
+            self.set_ui_connect_state(False)
         else:
             self.set_ui_connect_state(True)
 
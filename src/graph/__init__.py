@@ -41,6 +41,8 @@ The current availables plots are:
     * `MeshStemPlot`
     * `MeshLinePlot`
     * `SmoothLinePlot` - require Kivy 1.8.1
+    * `LODLinePlot` - long series, require numpy
+    * `MultiSeriesPlot` - many curves in a few draw calls
 
 .. note::
 
@@ -50,7 +52,8 @@ The current availables plots are:
 
 '''
 
-__all__ = ('Graph', 'Plot', 'MeshLinePlot', 'MeshStemPlot', 'LinePlot', 'SmoothLinePlot', 'ContourPlot')
+__all__ = ('Graph', 'Plot', 'MeshLinePlot', 'MeshStemPlot', 'LinePlot', 'SmoothLinePlot', 'LODLinePlot',
+           'MultiSeriesPlot', 'MinMaxPyramid', 'PointIndex', 'ContourPlot', 'set_render_probe')
 __version__ = '0.4-dev'
 
 from kivy.uix.widget import Widget
@@ -60,14 +63,16 @@ from kivy.properties import NumericProperty, BooleanProperty,\
     BoundedNumericProperty, StringProperty, ListProperty, ObjectProperty,\
     DictProperty, AliasProperty
 from kivy.clock import Clock
-from kivy.graphics import Mesh, Color, Rectangle
+from kivy.graphics import Mesh, Color, Rectangle, PushMatrix, PopMatrix, Translate, Scale
 from kivy.graphics import Fbo
 from kivy.graphics.texture import Texture
 from kivy.event import EventDispatcher
 from kivy.lang import Builder
 from kivy.logger import Logger
 from kivy import metrics
-from math import log10, floor, ceil
+from math import log10, log2, floor, ceil, sqrt
+from bisect import bisect_left
+from functools import wraps
 from decimal import Decimal
 try:
     import numpy as np
@@ -75,6 +80,41 @@ except ImportError as e:
     np = None
 
 
+# object timing the graph operations, see set_render_probe
+_probe = None
+
+
+def set_render_probe(probe):
+    '''Set the object timing the graph operations, None to disable it.
+
+    probe.begin(name, detail) is called before and probe.end() after
+    Graph._redraw_all ('graph.redraw_all'), Graph._redraw_size
+    ('graph.redraw_size'), Graph._clear_buffer ('graph.clear_buffer'), the
+    creation and layout of the labels ('graph.labels') and each draw of a plot
+    ('plot.draw', detail being the class and id of the plot). Calls are
+    nested: a plot may be drawn during a graph redraw.
+    '''
+    global _probe
+    _probe = probe
+
+
+def probed(name):
+    '''Decorator timing a method with the render probe, if there is one.'''
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            probe = _probe
+            if probe is None:
+                return method(*args, **kwargs)
+            probe.begin(name, None)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                probe.end()
+        return wrapper
+    return decorator
+
+
 def identity(x):
     return x
 
@@ -194,6 +234,12 @@ class Graph(Widget):
         self._plot_area = StencilView()
         self.add_widget(self._plot_area)
 
+        with self._plot_area.canvas.after:
+            self._cursor_color = Color(*self.cursor_color)
+            self._cursor_mesh = Mesh(mode='lines')
+        self._cursor_pos = None
+        self._trigger_cursor = Clock.create_trigger(self._update_cursor)
+
         t = self._trigger = Clock.create_trigger(self._redraw_all)
         ts = self._trigger_size = Clock.create_trigger(self._redraw_size)
         tc = self._trigger_color = Clock.create_trigger(self._update_colors)
@@ -204,7 +250,8 @@ class Graph(Widget):
                   xlabel=t, x_grid_label=t, ymin=t, ymax=t, ylog=t,
                   y_ticks_major=t, y_ticks_minor=t, ylabel=t, y_grid_label=t,
                   font_size=t, label_options=t, x_ticks_angle=t)
-        self.bind(tick_color=tc, background_color=tc, border_color=tc)
+        self.bind(tick_color=tc, background_color=tc, border_color=tc,
+                  cursor_color=tc)
         self._trigger()
 
     def add_widget(self, widget):
@@ -315,6 +362,7 @@ class Graph(Widget):
             points_minor = []
         return points_major, points_minor
 
+    @probed('graph.labels')
     def _update_labels(self):
         xlabel = self._xlabel
         ylabel = self._ylabel
@@ -544,7 +592,9 @@ class Graph(Widget):
         self._mesh_ticks_color.rgba = tuple(self.tick_color)
         self._background_color.rgba = tuple(self.background_color)
         self._mesh_rect_color.rgba = tuple(self.border_color)
+        self._cursor_color.rgba = tuple(self.cursor_color)
 
+    @probed('graph.redraw_all')
     def _redraw_all(self, *args):
         # add/remove all the required labels
         xpoints_major, xpoints_minor = self._redraw_x(*args)
@@ -557,6 +607,7 @@ class Graph(Widget):
         mesh.indices = [k for k in range(n_points * 2)]
         self._redraw_size()
 
+    @probed('graph.labels')
     def _redraw_x(self, *args):
         font_size = self.font_size
         if self.xlabel:
@@ -601,6 +652,7 @@ class Graph(Widget):
             self.add_widget(grids[k])
         return xpoints_major, xpoints_minor
 
+    @probed('graph.labels')
     def _redraw_y(self, *args):
         font_size = self.font_size
         if self.ylabel:
@@ -642,6 +694,7 @@ class Graph(Widget):
             self.add_widget(grids[k])
         return ypoints_major, ypoints_minor
 
+    @probed('graph.redraw_size')
     def _redraw_size(self, *args):
         # size a 4-tuple describing the bounding box in which we can draw
         # graphs, it's (x0, y0, x1, y1), which correspond with the bottom left
@@ -662,7 +715,9 @@ class Graph(Widget):
         self._background_rect.size = self.size
         self._update_ticks(size)
         self._update_plots(size)
+        self._trigger_cursor()
 
+    @probed('graph.clear_buffer')
     def _clear_buffer(self, *largs):
         fbo = self._fbo
         fbo.bind()
@@ -753,6 +808,72 @@ class Graph(Widget):
             conv_y = norm_y * (self.ymax - self.ymin) + self.ymin
         return [conv_x, conv_y]
 
+    def nearest_point(self, x, y):
+        '''Return (plot, index, (x, y)) of the data point of all the plots
+        nearest to the given coordinates, or None if the plots are empty.
+
+        :Parameters:
+            `x, y`:
+                The coordinates, in the same coordinates as the graph's pos
+                (e.g. a touch pos received by the graph).
+        '''
+        best = None
+        for plot in self.plots:
+            found = plot.nearest(x, y)
+            if found is not None and (best is None or found[0] < best[0]):
+                best = (found[0], plot, found[1], found[2])
+        return None if best is None else best[1:]
+
+    def on_touch_down(self, touch):
+        if self.show_cursor and self._plot_area.collide_point(*touch.pos):
+            self._cursor_pos = touch.pos
+            self._trigger_cursor()
+        return super(Graph, self).on_touch_down(touch)
+
+    def on_touch_move(self, touch):
+        if self.show_cursor and self._plot_area.collide_point(*touch.pos):
+            self._cursor_pos = touch.pos
+            self._trigger_cursor()
+        return super(Graph, self).on_touch_move(touch)
+
+    def on_show_cursor(self, instance, value):
+        from kivy.core.window import Window
+        if value:
+            Window.bind(mouse_pos=self._on_mouse_pos)
+        else:
+            Window.unbind(mouse_pos=self._on_mouse_pos)
+            self._cursor_pos = None
+            self._trigger_cursor()
+
+    def _on_mouse_pos(self, window, pos):
+        if self.get_root_window() is None:
+            # not displayed
+            return
+        pos = self.to_widget(*pos)
+        if self._plot_area.collide_point(*pos):
+            self._cursor_pos = pos
+            self._trigger_cursor()
+
+    def _update_cursor(self, *largs):
+        # once per frame at most: snap the crosshair to the nearest point
+        found = None
+        if self._cursor_pos is not None:
+            found = self.nearest_point(*self._cursor_pos)
+        mesh = self._cursor_mesh
+        if found is None:
+            mesh.vertices = []
+            mesh.indices = []
+            self.cursor = None
+            return
+        plot, index, point = found
+        px, py = plot.x_px()(point[0]), plot.y_px()(point[1])
+        x0, y0 = self._plot_area.pos
+        x1, y1 = x0 + self._plot_area.width, y0 + self._plot_area.height
+        mesh.vertices = [px, y0, 0, 0, px, y1, 0, 0,
+                         x0, py, 0, 0, x1, py, 0, 0]
+        mesh.indices = [0, 1, 2, 3]
+        self.cursor = found
+
     xmin = NumericProperty(0.)
     '''The x-axis minimum value.
 
@@ -966,6 +1087,168 @@ class Graph(Widget):
     displayed, excluding labels etc. It is relative to the graph's pos.
     '''
 
+    show_cursor = BooleanProperty(False)
+    '''Whether touching the plot area (or hovering it with the mouse) shows a
+    crosshair snapped to the nearest data point, see :data:`cursor`.
+
+    :data:`show_cursor` is a :class:`~kivy.properties.BooleanProperty`,
+    defaults to False.
+    '''
+
+    cursor = ObjectProperty(None, allownone=True)
+    '''(plot, index, (x, y)) of the data point under the crosshair, None when
+    there is none. Updated at most once per frame.
+
+    :data:`cursor` is a :class:`~kivy.properties.ObjectProperty`, defaults to
+    None.
+    '''
+
+    cursor_color = ListProperty([1, 1, 1, .5])
+    '''Color of the crosshair.
+    '''
+
+
+class PointIndex(object):
+    '''Nearest point queries on a growing series of points.
+
+    While the x values are sorted (line data), the nearest point in x is found
+    by bisection. Otherwise (scatter data) the points are hashed in a grid of
+    cells holding about two points each, and the cells are visited by rings
+    around the query until no closer point can be found. Appending points
+    keeps the index up to date, the grid is rebuilt when the number of points
+    has grown fourfold.
+    '''
+
+    def __init__(self):
+        self.xs = []
+        self.ys = []
+        self.is_sorted = True
+        self._grid = None
+        self._grid_n = 0
+        self._cell = (1., 1.)
+        # lowest and highest cell indexes in x and y
+        self._bounds = None
+
+    def __len__(self):
+        return len(self.xs)
+
+    def extend(self, points):
+        xs, ys = self.xs, self.ys
+        start = len(xs)
+        for x, y in points:
+            xs.append(x)
+            ys.append(y)
+        if self.is_sorted:
+            for i in range(max(start, 1), len(xs)):
+                if xs[i] < xs[i - 1]:
+                    self.is_sorted = False
+                    break
+        if self._grid is not None:
+            if len(xs) > 4 * self._grid_n:
+                self._grid = None
+            else:
+                self._hash(start)
+
+    def _build_grid(self):
+        xs, ys = self.xs, self.ys
+        self._grid_n = len(xs)
+        side = float(max(int(sqrt(len(xs) / 2.)), 1))
+        self._cell = ((max(xs) - min(xs)) / side or 1.,
+                      (max(ys) - min(ys)) / side or 1.)
+        self._grid = {}
+        self._bounds = None
+        self._hash(0)
+
+    def _hash(self, start):
+        xs, ys, grid = self.xs, self.ys, self._grid
+        cx, cy = self._cell
+        bounds = self._bounds
+        for k in range(start, len(xs)):
+            x, y = xs[k], ys[k]
+            if x != x or y != y:
+                # nan
+                continue
+            i, j = int(floor(x / cx)), int(floor(y / cy))
+            grid.setdefault((i, j), []).append(k)
+            if bounds is None:
+                bounds = [i, i, j, j]
+            else:
+                bounds[0], bounds[1] = min(bounds[0], i), max(bounds[1], i)
+                bounds[2], bounds[3] = min(bounds[2], j), max(bounds[3], j)
+        self._bounds = bounds
+
+    def _ring(self, ci, cj, r):
+        # cells at Chebyshev distance r of (ci, cj) within the bounds
+        i0, i1, j0, j1 = self._bounds
+        if not r:
+            return [(ci, cj)]
+        cells = []
+        lo, hi = max(ci - r, i0), min(ci + r, i1)
+        for j in (cj - r, cj + r):
+            if j0 <= j <= j1:
+                cells.extend((i, j) for i in range(lo, hi + 1))
+        lo, hi = max(cj - r + 1, j0), min(cj + r - 1, j1)
+        for i in (ci - r, ci + r):
+            if i0 <= i <= i1:
+                cells.extend((i, j) for j in range(lo, hi + 1))
+        return cells
+
+    def nearest(self, x, y, scalex=1., scaley=1.):
+        '''Return the index of the point nearest to (x, y), None if there
+        are no points. Distances are measured with x scaled by scalex and y by
+        scaley (pixels per unit), the point found is within a pixel of the
+        nearest one. For sorted x only the x distance counts.
+        '''
+        xs, ys = self.xs, self.ys
+        if not xs:
+            return None
+        if self.is_sorted:
+            i = bisect_left(xs, x)
+            if i == len(xs) or (i and x - xs[i - 1] <= xs[i] - x):
+                i -= 1
+            return i
+        if self._grid is None:
+            self._build_grid()
+        if self._bounds is None:
+            return None
+        cx, cy = self._cell
+        i0, i1, j0, j1 = self._bounds
+        # rings around the cell of the query, moved inside the bounds
+        ci = min(max(int(floor(x / cx)), i0), i1)
+        cj = min(max(int(floor(y / cy)), j0), j1)
+
+        def distance(ilo, ihi, jlo, jhi):
+            # squared distance from the query to a block of cells
+            if ilo > ihi or jlo > jhi:
+                return float('inf')
+            dx = max(ilo * cx - x, 0., x - (ihi + 1) * cx) * scalex
+            dy = max(jlo * cy - y, 0., y - (jhi + 1) * cy) * scaley
+            return dx * dx + dy * dy
+
+        grid = self._grid
+        best, best_d = None, float('inf')
+        r = 0
+        while True:
+            for cell in self._ring(ci, cj, r):
+                for k in grid.get(cell, ()):
+                    dx = (xs[k] - x) * scalex
+                    dy = (ys[k] - y) * scaley
+                    d = dx * dx + dy * dy
+                    if d < best_d:
+                        best, best_d = k, d
+            # closest cell not visited yet: left, right, below and above the
+            # square of the rings visited
+            lo_i, hi_i = max(ci - r, i0), min(ci + r, i1)
+            closest = min(distance(i0, ci - r - 1, j0, j1),
+                          distance(ci + r + 1, i1, j0, j1),
+                          distance(lo_i, hi_i, j0, cj - r - 1),
+                          distance(lo_i, hi_i, cj + r + 1, j1))
+            # within a pixel of the nearest possible point is close enough
+            if best_d <= closest or sqrt(best_d) <= sqrt(closest) + 1.:
+                break
+            r += 1
+        return best
+
 
 class Plot(EventDispatcher):
     '''Plot class, see module documentation for more information.
@@ -1009,9 +1292,18 @@ class Plot(EventDispatcher):
 
     def __init__(self, **kwargs):
         super(Plot, self).__init__(**kwargs)
-        self.ask_draw = Clock.create_trigger(self.draw)
+        self.ask_draw = Clock.create_trigger(self._probed_draw)
         self.bind(params=self.ask_draw, points=self.ask_draw)
+        # (points, length) at the last change, see _points_changed
+        self._points_seen = (self.points, len(self.points))
+        self.bind(points=self._points_changed)
         self._drawings = self.create_drawings()
+        # cache of the projected points, see flatten_points
+        self._flat_px = []
+        self._flat_px_state = None
+        # index of the points for nearest queries, see nearest
+        self._point_index = None
+        self._point_index_state = None
 
     def funcx(self):
         """Return a function that convert or not the X value according to plot
@@ -1120,6 +1412,17 @@ class Plot(EventDispatcher):
         '''
         self.dispatch('on_clear_plot')
 
+    def _probed_draw(self, *largs):
+        probe = _probe
+        if probe is None:
+            return self.draw(*largs)
+        probe.begin('plot.draw', '{:s} {:x}'.format(type(self).__name__,
+                                                     id(self)))
+        try:
+            self.draw(*largs)
+        finally:
+            probe.end()
+
     def iterate_points(self):
         '''Iterate on all the points adjusted to the graph settings
         '''
@@ -1128,6 +1431,97 @@ class Plot(EventDispatcher):
         for x, y in self.points:
             yield x_px(x), y_px(y)
 
+    def flatten_points(self):
+        '''Return the flat list [x0, y0, x1, y1, ...] of the points adjusted to
+        the graph settings.
+
+        The projection is cached: if points were only appended since the last
+        call and the graph settings did not change, only the new points are
+        projected. Any other change of points projects them all again (see
+        :meth:`_points_changed`). The caller still gets the whole list: a
+        :class:`~kivy.graphics.Line` rebuilds all its vertices when set.
+        '''
+        points = self.points
+        params = self.params
+        flat = self._flat_px
+        n_done = len(flat) // 2
+        state = self._flat_px_state
+        if state is None or state[0] is not points or state[1] != params:
+            flat = self._flat_px = []
+            n_done = 0
+        if len(points) > n_done:
+            x_px = self.x_px()
+            y_px = self.y_px()
+            for x, y in points[n_done:]:
+                flat += [x_px(x), y_px(y)]
+        self._flat_px_state = (points, dict(params))
+        return flat
+
+    def axis_transform(self):
+        '''Return (funcx, funcy, x0, y0, ratiox, ratioy): pixel x is
+        (funcx(x) - x0) * ratiox + size[0], and the same for y.
+        '''
+        funcx = self.funcx()
+        funcy = self.funcy()
+        params = self.params
+        size = params["size"]
+        x0 = funcx(params["xmin"])
+        y0 = funcy(params["ymin"])
+        ratiox = (size[2] - size[0]) / float(funcx(params["xmax"]) - x0)
+        ratioy = (size[3] - size[1]) / float(funcy(params["ymax"]) - y0)
+        return funcx, funcy, x0, y0, ratiox, ratioy
+
+    def point_index(self):
+        '''Return the :class:`PointIndex` of the points in axis scale (log10
+        of the values of log axes). It is updated like :meth:`flatten_points`:
+        appended points are only added.
+        '''
+        points = self.points
+        params = self.params
+        index = self._point_index
+        state = self._point_index_state
+        if state is None or state[0] is not points or \
+                state[1] != (params['xlog'], params['ylog']):
+            index = self._point_index = PointIndex()
+        if len(points) > len(index):
+            funcx = self.funcx()
+            funcy = self.funcy()
+            index.extend((funcx(x), funcy(y)) for x, y in
+                         points[len(index):])
+        self._point_index_state = (points, (params['xlog'], params['ylog']))
+        return index
+
+    def nearest(self, x, y):
+        '''Return (squared distance in pixels, index, (x, y)) of the point
+        nearest to the pixel (x, y), None if the plot has no points. (x, y)
+        are in the coordinates of :meth:`x_px` and :meth:`y_px`.
+        '''
+        funcx, funcy, x0, y0, ratiox, ratioy = self.axis_transform()
+        size = self.params['size']
+        index = self.point_index()
+        i = index.nearest((x - size[0]) / ratiox + x0,
+                          (y - size[1]) / ratioy + y0, ratiox, ratioy)
+        if i is None:
+            return None
+        dx = (index.xs[i] - x0) * ratiox + size[0] - x
+        dy = (index.ys[i] - y0) * ratioy + size[1] - y
+        return dx * dx + dy * dy, i, tuple(self.points[i])
+
+    def _points_changed(self, *largs):
+        '''Drop the caches of the points (projection, index) unless points
+        were only appended: a change that doesn't make the list longer (e.g.
+        clear) is seen here, even if points grow again before the next draw.
+        Return True if the caches were dropped.
+        '''
+        points = self.points
+        seen, n_seen = self._points_seen
+        self._points_seen = (points, len(points))
+        if points is seen and len(points) > n_seen:
+            return False
+        self._flat_px_state = None
+        self._point_index_state = None
+        return True
+
     def on_clear_plot(self, *largs):
         pass
 
@@ -1153,15 +1547,101 @@ class MeshLinePlot(Plot):
     Defaults to 'line_strip'.
     '''
 
+    data_transform = BooleanProperty(False)
+    '''If True, the vertices are kept in axis scale (the data, log10 of the
+    data on a log axis) and the axis mapping is applied by a canvas
+    transform: a change of the axes bounds (pan, zoom) only updates the
+    transform, the vertices are uploaded again only when :data:`points` or
+    the axes scales change (only the new ones are computed if points were
+    only appended).
+
+    :data:`data_transform` is a :class:`~kivy.properties.BooleanProperty`,
+    defaults to False.
+    '''
+
+    def __init__(self, **kwargs):
+        # (points, number of points, (xlog, ylog)) of the vertices in axis scale
+        self._data_state = None
+        super(MeshLinePlot, self).__init__(**kwargs)
+        self.bind(data_transform=self.ask_draw)
+
     def create_drawings(self):
         self._color = Color(*self.color)
         self._mesh = Mesh(mode='line_strip')
+        self._translate = Translate(0, 0)
+        self._scale = Scale(1, 1, 1)
         self.bind(color=lambda instr, value: setattr(self._color, "rgba", value))
-        return [self._color, self._mesh]
+        return [PushMatrix(), self._translate, self._scale, self._color,
+                self._mesh, PopMatrix()]
+
+    def transform_active(self):
+        '''Whether the vertices are in axis scale, see
+        :data:`data_transform`.
+        '''
+        return self.data_transform
+
+    def data_transform_values(self):
+        '''Return ((translate x, translate y), (scale x, scale y)) mapping the
+        axis scale coordinates on the pixels.
+        '''
+        funcx, funcy, x0, y0, ratiox, ratioy = self.axis_transform()
+        size = self.params['size']
+        return ((size[0] - x0 * ratiox, size[1] - y0 * ratioy),
+                (ratiox, ratioy))
+
+    def transform_error(self, points=None):
+        '''Return the largest difference in pixels between the canvas
+        transform and :meth:`x_px`/:meth:`y_px` on points (defaults to
+        :data:`points`), to check :data:`data_transform`.
+        '''
+        (tx, ty), (sx, sy) = self.data_transform_values()
+        funcx = self.funcx()
+        funcy = self.funcy()
+        x_px = self.x_px()
+        y_px = self.y_px()
+        error = 0.
+        for x, y in self.points if points is None else points:
+            error = max(error, abs(funcx(x) * sx + tx - x_px(x)),
+                        abs(funcy(y) * sy + ty - y_px(y)))
+        return error
+
+    def _points_changed(self, *largs):
+        if super(MeshLinePlot, self)._points_changed(*largs):
+            self._data_state = None
 
     def draw(self, *args):
         super(MeshLinePlot, self).draw(*args)
-        self.plot_mesh()
+        if not self.transform_active():
+            self._data_state = None
+            self._translate.xy = (0, 0)
+            self._scale.xyz = (1, 1, 1)
+            self.plot_mesh()
+            return
+        (tx, ty), (sx, sy) = self.data_transform_values()
+        self._translate.xy = (tx, ty)
+        self._scale.xyz = (sx, sy, 1)
+        points = self.points
+        params = self.params
+        scales = (params['xlog'], params['ylog'])
+        state = self._data_state
+        start = 0 if state is None or state[2] != scales else state[1]
+        if start < len(points) or not points:
+            self.plot_mesh_data(start)
+        self._data_state = (points, len(points), scales)
+
+    def plot_mesh_data(self, start=0):
+        '''Set the vertices of the points from start in axis scale (the
+        previous ones are kept), see :data:`data_transform`.
+        '''
+        points = self.points
+        funcx = self.funcx()
+        funcy = self.funcy()
+        mesh, vert, _ = self.set_mesh_size(len(points))
+        for k in range(start, len(points)):
+            x, y = points[k]
+            vert[k * 4] = funcx(x)
+            vert[k * 4 + 1] = funcy(y)
+        mesh.vertices = vert
 
     def plot_mesh(self):
         points = [p for p in self.iterate_points()]
@@ -1202,6 +1682,19 @@ class MeshStemPlot(MeshLinePlot):
             vert[k * 8 + 5] = y
         mesh.vertices = vert
 
+    def plot_mesh_data(self, start=0):
+        points = self.points
+        funcx = self.funcx()
+        funcy = self.funcy()
+        y0 = funcy(0)
+        mesh, vert, _ = self.set_mesh_size(len(points) * 2)
+        for k in range(start, len(points)):
+            x, y = points[k]
+            vert[k * 8] = vert[k * 8 + 4] = funcx(x)
+            vert[k * 8 + 1] = y0
+            vert[k * 8 + 5] = funcy(y)
+        mesh.vertices = vert
+
 
 class LinePlot(Plot):
     """LinePlot draws using a standard Line object.
@@ -1225,11 +1718,7 @@ class LinePlot(Plot):
 
     def draw(self, *args):
         super(LinePlot, self).draw(*args)
-        # flatten the list
-        points = []
-        for x, y in self.iterate_points():
-            points += [x, y]
-        self._gline.points = points
+        self._gline.points = self.flatten_points()
 
     def on_line_width(self, *largs):
         if hasattr(self, "_gline"):
@@ -1294,12 +1783,382 @@ class SmoothLinePlot(Plot):
 
     def draw(self, *args):
         super(SmoothLinePlot, self).draw(*args)
-        # flatten the list
-        points = []
-        for x, y in self.iterate_points():
-            points += [x, y]
-        self._gline.points = points
+        self._gline.points = self.flatten_points()
+
+
+
+class MultiSeriesPlot(Plot):
+    '''Plot of many curves (e.g. overlaid spectra) in a few draw calls.
+
+    All the curves are packed in the vertex buffers of a single
+    :class:`~kivy.graphics.Mesh` per 65535 vertices, with the color in each
+    vertex, and drawn as separate segments ('lines' mode) so that consecutive
+    curves are not joined. The vertices hold the data coordinates: the
+    projection on the graph is done by the shader, so zooming or panning only
+    updates two uniforms. Hiding a curve only rebuilds the indices of its
+    buffer.
 
+    Curves are added with :meth:`add_series` instead of :data:`points`. Lines
+    are one pixel wide.
+    '''
+
+    # indices of a Mesh are unsigned shorts
+    MAX_VERTICES = 65535
+
+    MULTI_VS = '''
+    $HEADER$
+    attribute vec4 vColor;
+    uniform vec2 data_scale;
+    uniform vec2 data_offset;
+
+    void main(void) {
+        frag_color = vColor * vec4(1., 1., 1., opacity);
+        tex_coord0 = vec2(0., 0.);
+        vec2 pos = vPosition * data_scale + data_offset;
+        gl_Position = projection_mat * modelview_mat * vec4(pos, 0., 1.);
+    }
+    '''
+
+    MULTI_FS = '''
+    $HEADER$
+
+    void main(void) {
+        gl_FragColor = frag_color;
+    }
+    '''
+
+    def __init__(self, **kwargs):
+        # series id -> [points, color, visible, parts], each part being
+        # (chunk, first vertex, number of vertices)
+        self._series = {}
+        # chunks: [mesh, vertices, [(series id, segments indices), ...]]
+        self._chunks = []
+        self._next_id = 0
+        # (xlog, ylog) of the vertices
+        self._scale = None
+        # (series id, xlog, ylog) -> PointIndex, see nearest
+        self._indexes = {}
+        super(MultiSeriesPlot, self).__init__(**kwargs)
+
+    def create_drawings(self):
+        from kivy.graphics import RenderContext
+        self._grc = RenderContext(
+            vs=MultiSeriesPlot.MULTI_VS, fs=MultiSeriesPlot.MULTI_FS,
+            use_parent_modelview=True, use_parent_projection=True)
+        return [self._grc]
+
+    def add_series(self, points, color=None, visible=True):
+        '''Add a curve of (x, y) points (defaults to :data:`color`) and
+        return its id.
+        '''
+        sid = self._next_id
+        self._next_id += 1
+        self._series[sid] = [list(points), list(color or self.color),
+                             visible, []]
+        if self._scale is not None:
+            self._pack(sid)
+        self.ask_draw()
+        return sid
+
+    def remove_series(self, sid):
+        '''Remove a curve. All the buffers are packed again.'''
+        del self._series[sid]
+        for key in [key for key in self._indexes if key[0] == sid]:
+            del self._indexes[key]
+        self._scale = None
+        self.ask_draw()
+
+    def clear(self):
+        self._series = {}
+        self._indexes = {}
+        self._scale = None
+        self.ask_draw()
+
+    def series(self):
+        '''Return the ids of the curves.'''
+        return list(self._series)
+
+    def set_visible(self, sid, visible):
+        '''Show or hide a curve, its vertices are kept.'''
+        series = self._series[sid]
+        if series[2] != visible:
+            series[2] = visible
+            for chunk in set(part[0] for part in series[3]):
+                self._update_indices(chunk)
+
+    def set_color(self, sid, color):
+        series = self._series[sid]
+        series[1] = list(color)
+        for chunk, first, count in series[3]:
+            mesh, vertices = self._chunks[chunk][:2]
+            for k in range(first, first + count):
+                vertices[6 * k + 2:6 * k + 6] = series[1]
+            mesh.vertices = vertices
+
+    def _pack(self, sid):
+        # append the vertices of a series to the last buffers, a series longer
+        # than a buffer is split in parts sharing their end vertex
+        points, color, visible, parts = self._series[sid]
+        funcx, funcy = self.funcx(), self.funcy()
+        n = len(points)
+        start = 0
+        while start < n - 1:
+            count = min(n - start, self.MAX_VERTICES)
+            chunks = self._chunks
+            if not chunks or \
+                    len(chunks[-1][1]) // 6 + count > self.MAX_VERTICES:
+                with self._grc:
+                    mesh = Mesh(fmt=[(b'vPosition', 2, 'float'),
+                                     (b'vColor', 4, 'float')], mode='lines')
+                chunks.append([mesh, [], []])
+            chunk = len(chunks) - 1
+            mesh, vertices, chunk_parts = chunks[chunk]
+            first = len(vertices) // 6
+            for x, y in points[start:start + count]:
+                vertices.extend((funcx(x), funcy(y)))
+                vertices.extend(color)
+            segments = [0] * (2 * count - 2)
+            segments[0::2] = range(first, first + count - 1)
+            segments[1::2] = range(first + 1, first + count)
+            chunk_parts.append((sid, segments))
+            parts.append((chunk, first, count))
+            mesh.vertices = vertices
+            self._update_indices(chunk)
+            start += count - 1
+
+    def _repack(self):
+        for mesh, _, _ in self._chunks:
+            self._grc.remove(mesh)
+        self._chunks = []
+        for sid, series in self._series.items():
+            series[3] = []
+            self._pack(sid)
+
+    def _update_indices(self, chunk):
+        mesh, _, parts = self._chunks[chunk]
+        indices = []
+        for sid, segments in parts:
+            if self._series[sid][2]:
+                indices.extend(segments)
+        mesh.indices = indices
+
+    def draw(self, *args):
+        super(MultiSeriesPlot, self).draw(*args)
+        params = self.params
+        scale = (params['xlog'], params['ylog'])
+        if scale != self._scale:
+            self._scale = scale
+            self._repack()
+        funcx, funcy, x0, y0, ratiox, ratioy = self.axis_transform()
+        size = params['size']
+        self._grc['data_scale'] = [float(ratiox), float(ratioy)]
+        self._grc['data_offset'] = [float(size[0] - x0 * ratiox),
+                                    float(size[1] - y0 * ratioy)]
+
+    def nearest(self, x, y):
+        '''Same as :meth:`Plot.nearest` over the visible curves, the index
+        being (series id, index of the point).
+        '''
+        funcx, funcy, x0, y0, ratiox, ratioy = self.axis_transform()
+        size = self.params['size']
+        data_x = (x - size[0]) / ratiox + x0
+        data_y = (y - size[1]) / ratioy + y0
+        best = None
+        for sid, (points, _, visible, _) in self._series.items():
+            if not visible or not points:
+                continue
+            index = self._series_index(sid)
+            i = index.nearest(data_x, data_y, ratiox, ratioy)
+            if i is None:
+                continue
+            dx = (index.xs[i] - x0) * ratiox + size[0] - x
+            dy = (index.ys[i] - y0) * ratioy + size[1] - y
+            d = dx * dx + dy * dy
+            if best is None or d < best[0]:
+                best = (d, (sid, i), tuple(points[i]))
+        return best
+
+    def _series_index(self, sid):
+        # PointIndex of a series in axis scale, cached with the scale
+        cache = self._indexes
+        key = (sid, self.params['xlog'], self.params['ylog'])
+        index = cache.get(key)
+        if index is None:
+            for old in [k for k in cache if k[0] == sid]:
+                del cache[old]
+            funcx, funcy = self.funcx(), self.funcy()
+            index = cache[key] = PointIndex()
+            index.extend((funcx(px), funcy(py))
+                         for px, py in self._series[sid][0])
+        return index
+
+
+class MinMaxPyramid(object):
+    '''Level of detail pyramid of a series of (x, y) points with sorted x.
+
+    Level k splits the points in blocks of 2 ** k points and keeps the index of
+    the lowest and of the highest point of each block (level 0 being the points
+    themselves). Appending points only updates the last blocks of each level.
+    :meth:`query` returns, for any x range, the min and max points of the
+    blocks of the coarsest level that still has a block per pixel: drawing
+    them gives the same envelope as drawing all the points, with a number of
+    points proportional to the width in pixels.
+
+    Requires numpy.
+    '''
+
+    def __init__(self, capacity=1024):
+        self.n = 0
+        self.x = np.empty(capacity)
+        self.y = np.empty(capacity)
+        # levels[k - 1] = (imin, imax) arrays of the blocks of level k
+        self.levels = []
+
+    def __len__(self):
+        return self.n
+
+    def clear(self):
+        self.n = 0
+        self.levels = []
+
+    @staticmethod
+    def _grow(array, size):
+        if size <= len(array):
+            return array
+        grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def append(self, x, y):
+        '''Append points, x must be sorted and not lower than the last x.'''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        n0, n1 = self.n, self.n + len(x)
+        if n1 == n0:
+            return
+        self.x = self._grow(self.x, n1)
+        self.y = self._grow(self.y, n1)
+        self.x[n0:n1] = x
+        self.y[n0:n1] = y
+        self.n = n1
+        values = self.y
+        child_min = child_max = None
+        k = 1
+        # a level is needed while the level below has more than one block
+        while (n1 - 1) >> (k - 1):
+            blocks = ((n1 - 1) >> k) + 1
+            child_blocks = ((n1 - 1) >> (k - 1)) + 1
+            if k > len(self.levels):
+                self.levels.append((np.empty(blocks, dtype=np.intp),
+                                    np.empty(blocks, dtype=np.intp)))
+                first = 0
+            else:
+                first = n0 >> k
+            imin, imax = (self._grow(level, blocks)
+                          for level in self.levels[k - 1])
+            self.levels[k - 1] = (imin, imax)
+            left = np.arange(2 * first, 2 * blocks, 2)
+            right = np.minimum(left + 1, child_blocks - 1)
+            if child_min is None:
+                lmin = lmax = left
+                rmin = rmax = right
+            else:
+                lmin, rmin = child_min[left], child_min[right]
+                lmax, rmax = child_max[left], child_max[right]
+            imin[first:blocks] = np.where(values[rmin] < values[lmin],
+                                          rmin, lmin)
+            imax[first:blocks] = np.where(values[rmax] > values[lmax],
+                                          rmax, lmax)
+            child_min, child_max = imin, imax
+            k += 1
+
+    def query(self, xmin, xmax, width):
+        '''Return (x, y) arrays of the points to draw for the x range
+        [xmin, xmax] on width pixels. The points just outside the range are
+        included so that lines reach the borders.'''
+        n = self.n
+        if not n:
+            return self.x[:0], self.y[:0]
+        x = self.x[:n]
+        first = max(int(np.searchsorted(x, xmin, 'left')) - 1, 0)
+        last = min(int(np.searchsorted(x, xmax, 'right')) + 1, n)
+        count = last - first
+        width = max(int(width), 1)
+        if count <= 2 * width:
+            return x[first:last], self.y[first:last]
+        k = min(int(ceil(log2(count / float(width)))), len(self.levels))
+        imin, imax = self.levels[k - 1]
+        block_first, block_last = first >> k, ((last - 1) >> k) + 1
+        imin, imax = imin[block_first:block_last], imax[block_first:block_last]
+        # keep the order of the points in each block
+        index = np.empty(2 * len(imin), dtype=np.intp)
+        index[0::2] = np.minimum(imin, imax)
+        index[1::2] = np.maximum(imin, imax)
+        return x[index], self.y[index]
+
+
+class LODLinePlot(SmoothLinePlot):
+    '''Line plot of long series drawn from a :class:`MinMaxPyramid`.
+
+    Points are added with :meth:`append` (x sorted) instead of
+    :data:`points`. Each draw only projects the min/max points of the visible
+    blocks, about two per pixel of the plot width, whatever the number of
+    points and the zoom. Requires numpy.
+    '''
+
+    def __init__(self, **kwargs):
+        self.pyramid = MinMaxPyramid()
+        super(LODLinePlot, self).__init__(**kwargs)
+
+    def append(self, x, y):
+        '''Add points (x sorted) and redraw on next frame.'''
+        self.pyramid.append(x, y)
+        self.ask_draw()
+
+    def clear(self):
+        self.pyramid.clear()
+        self.ask_draw()
+
+    def nearest(self, x, y):
+        pyramid = self.pyramid
+        if not pyramid.n:
+            return None
+        funcx, funcy, x0, y0, ratiox, ratioy = self.axis_transform()
+        size = self.params['size']
+        xs, ys = pyramid.x[:pyramid.n], pyramid.y[:pyramid.n]
+        data_x = (x - size[0]) / ratiox + x0
+        if self.params['xlog']:
+            data_x = 10 ** data_x
+        i = int(np.searchsorted(xs, data_x))
+        if i == len(xs) or (i and data_x - xs[i - 1] <= xs[i] - data_x):
+            i -= 1
+        point = float(xs[i]), float(ys[i])
+        dx = (funcx(point[0]) - x0) * ratiox + size[0] - x
+        dy = (funcy(point[1]) - y0) * ratioy + size[1] - y
+        return dx * dx + dy * dy, i, point
+
+    def visible_points(self):
+        '''Return the (x, y) arrays drawn for the current graph settings.'''
+        params = self.params
+        size = params['size']
+        return self.pyramid.query(params['xmin'], params['xmax'],
+                                  size[2] - size[0])
+
+    def draw(self, *args):
+        Plot.draw(self, *args)
+        x, y = self.visible_points()
+        params = self.params
+        size = params['size']
+        funcx = np.log10 if params['xlog'] else identity
+        funcy = np.log10 if params['ylog'] else identity
+        xmin, xmax = funcx(params['xmin']), funcx(params['xmax'])
+        ymin, ymax = funcy(params['ymin']), funcy(params['ymax'])
+        flat = np.empty(2 * len(x))
+        flat[0::2] = (funcx(x) - xmin) * ((size[2] - size[0]) /
+                                          float(xmax - xmin)) + size[0]
+        flat[1::2] = (funcy(y) - ymin) * ((size[3] - size[1]) /
+                                          float(ymax - ymin)) + size[1]
+        self._gline.points = flat.tolist()
 
 class ContourPlot(Plot):
     """
@@ -1488,6 +2347,10 @@ class HBar(MeshLinePlot):
     '''HBar draw horizontal bar on all the Y points provided
     '''
 
+    def transform_active(self):
+        # the bars span the current view, they are drawn in pixels
+        return False
+
     def plot_mesh(self, *args):
         points = self.points
         mesh, vert, ind = self.set_mesh_size(len(points) * 2)
@@ -1510,6 +2373,10 @@ class VBar(MeshLinePlot):
     '''VBar draw vertical bar on all the X points provided
     '''
 
+    def transform_active(self):
+        # the bars span the current view, they are drawn in pixels
+        return False
+
     def plot_mesh(self, *args):
         points = self.points
         mesh, vert, ind = self.set_mesh_size(len(points) * 2)
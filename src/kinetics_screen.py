@@ -1,10 +1,21 @@
+from functools import partial
 from kivy.base import Builder
 from kivy.uix.screenmanager import Screen
 from kivy.clock import mainthread
 from kivy.properties import ObjectProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
-from kivy.properties import NumericProperty
+from kivy.properties import NumericProperty, ListProperty, StringProperty
+from kivy.app import App
+from graph import LODLinePlot
+from lib_spectro.delivery import ResultChannel
+from lib_spectro.kinetics import MultiWavelengthKinetics
+from lib_spectro.fitting import KineticsFit
+from lib_spectro.utilities import AutoScale
+from popups import PopupOperation
+
+# colors of the channels plots
+Channel_Colors = [[0.22, 0.79, 1, 1], [1, 0.53, 0.11, 1], [0.6, 0.9, 0.3, 1], [1, 1, 0.11, 1], [0.9, 0.4, 0.9, 1]]
 
 
 class KineticsScreen(Screen):
@@ -12,15 +23,132 @@ class KineticsScreen(Screen):
 
 
 class BoxKinetics(BoxLayout):
+    # wavelengths of the channels (nm)
+    wavelengths = ListProperty([500])
+    kinetics = ObjectProperty(None, allownone=True)
+    plots = ListProperty()
+    # time and absorbance axes following the samples of all the channels
+    autoscale = ListProperty()
+    # readout of the point under the graph crosshair, and fitted rate constants
+    cursor_text = StringProperty()
+    fit_text = StringProperty()
+
     def ask_wl(self):
-        p = PopupWavelengthKinetics()
+        if self.kinetics is not None and self.kinetics.active:
+            App.get_running_app().show_message("Cinétique", "Mesure en cours")
+            return
+        p = PopupWavelengthKinetics(wavelength=self.wavelengths[0], wavelengths=list(self.wavelengths),
+                                    ok_clbk=self.wavelengths_selected)
         p.open()
 
+    def wavelengths_selected(self, wavelengths):
+        if wavelengths:
+            self.wavelengths = wavelengths
+
+    def on_wavelengths(self, instance, wavelengths):
+        # blank has to be measured again
+        self.kinetics = None
+
+    def get_kinetics(self, main_app):
+        """return the kinetics engine for the selected wavelengths"""
+        if self.kinetics is None:
+            self.kinetics = MultiWavelengthKinetics(main_app.spectro, self.wavelengths)
+            # the run reports on its own engine, even if the wavelengths change before the UI gets it
+            self.kinetics.done_clbk = partial(self.kinetics_done, self.kinetics)
+        return self.kinetics
+
+    def perform_blank(self, main_app):
+        if not main_app.spectro.connected:
+            main_app.show_message("Cinétique", "Spectromètre non connecté")
+            return
+        main_app.popup_operation = PopupOperation()
+        main_app.popup_operation.open()
+        main_app.popup_operation.update("Mesure du blanc", "En cours...")
+        self.get_kinetics(main_app).measure_blank(clbk=self.blank_done)
+
+    @mainthread
+    def blank_done(self, blanks):
+        App.get_running_app().popup_operation.dismiss()
+
+    def perform_kinetics(self, main_app):
+        """start or stop the run"""
+        kinetics = self.kinetics
+        if kinetics is not None and kinetics.running:
+            kinetics.stop()
+            return
+        if kinetics is not None and kinetics.active:
+            main_app.show_message("Cinétique", "Arrêt en cours")
+            return
+        if not main_app.spectro.connected:
+            main_app.show_message("Cinétique", "Spectromètre non connecté")
+            return
+        kinetics = self.get_kinetics(main_app)
+        graph = self.ids['graph_widget']
+        for plot in self.plots:
+            graph.remove_plot(plot)
+        self.plots = []
+        for idx, channel in enumerate(kinetics.channels):
+            plot = LODLinePlot(color=Channel_Colors[idx % len(Channel_Colors)])
+            graph.add_plot(plot)
+            self.plots.append(plot)
+            channel.progress_clbk = ResultChannel(on_data=partial(self.kinetics_data, plot))
+        graph.xmin, graph.xmax = 0, 20
+        # the time axis grows by half of the run duration at a time
+        self.autoscale = [AutoScale(graph, 'x', headroom=0.5, fixed_min=0), AutoScale(graph, 'y')]
+        self.ids['measure_btn'].text = "Stop"
+        kinetics.start()
+
+    def kinetics_data(self, plot, start, times, values):
+        plot.append(times, values)
+        xscale, yscale = self.autoscale
+        xscale.add(times)
+        yscale.add(values)
+        self.fit_text = self.rates_text()
+
+    def cursor_changed(self, cursor):
+        if cursor is None or self.kinetics is None or cursor[0] not in self.plots:
+            self.cursor_text = ""
+            return
+        plot, index, (t, value) = cursor
+        channel = self.kinetics.channels[self.plots.index(plot)]
+        self.cursor_text = "{:.1f} s, {:d} nm : A = {:.4f}".format(t, channel.wavelength, value)
+
+    def rates_text(self):
+        """best fitting order and rate constant of each channel"""
+        units = {'zero': "A/s", 'first': "/s", 'second': "/(A.s)"}
+        texts = []
+        for channel in self.kinetics.channels:
+            best = channel.fit.best()
+            if best is not None:
+                model, rate = best
+                texts.append("{:d} nm: ordre {:d}, k = {:.3g} ± {:.2g} {:s} (r² {:.4f})".format(
+                    channel.wavelength, KineticsFit.models.index(model), rate.k, rate.ci, units[model], rate.r2))
+        return ", ".join(texts)
+
+    @mainthread
+    def kinetics_done(self, kinetics):
+        self.ids['measure_btn'].text = "Mesure"
+        rates = ", ".join("{:d} nm: {:.2f}/s".format(c.wavelength, c.rate()) for c in kinetics.channels)
+        if kinetics is self.kinetics:
+            self.fit_text = " | ".join(text for text in (self.rates_text(), rates) if text)
+        rows = []
+        for channel in kinetics.channels:
+            times, values = channel.buffer.get()
+            rows.extend((t, channel.wavelength, value) for t, value in zip(times, values))
+        if rows:
+            wavelengths = [c.wavelength for c in kinetics.channels]
+            App.get_running_app().record_acquisition('kinetics', min(wavelengths), max(wavelengths),
+                                                     ("time", "wavelength", "absorbance"), sorted(rows))
+
 
 # ------ Popup window for wavelength bounds in spectrum part
 class PopupWavelengthKinetics(Popup):
     """wavelengths selection for spectrum"""
     wavelength = NumericProperty(defaultvalue=300)
+    # wavelengths of a multi-wavelength kinetics, edited by the popup
+    wavelengths = ListProperty()
+    # called with the wavelengths when the user validates (never empty)
+    ok_clbk = ObjectProperty(None, allownone=True)
 
     def when_opened(self):
         """what to do to initialize view"""
@@ -34,10 +162,23 @@ class PopupWavelengthKinetics(Popup):
     def on_ok(self):
         """if user validates, set to internal values and close popup"""
         self.wavelength = self.ids['wl_sldr'].value
+        if not self.wavelengths:
+            self.wavelengths = [int(self.wavelength)]
+        if self.ok_clbk is not None:
+            self.ok_clbk(list(self.wavelengths))
         self.dismiss()
 
+    def on_add(self):
+        """add the selected wavelength to the channels"""
+        wl = int(self.ids['wl_sldr'].value)
+        if wl not in self.wavelengths:
+            self.wavelengths = sorted(self.wavelengths + [wl])
+
+    def on_clear(self):
+        self.wavelengths = []
+
     def on_cancel(self):
-        """if user invalidates, just close"""
+        """if user invalidates, just close (the wavelengths of the screen are unchanged)"""
         self.dismiss()
 
 
@@ -47,6 +188,7 @@ Builder.load_string("""
         orientation: "vertical"
         padding: 30
         BoxKinetics:
+            id: box_kinetics
 
 <BoxKinetics>
     id: box_kinetics
@@ -64,8 +206,11 @@ Builder.load_string("""
             on_release: root.ask_wl()
         Button:
             text: "Blanc"
+            on_release: root.perform_blank(app)
         Button:
+            id: measure_btn
             text: "Mesure"
+            on_release: root.perform_kinetics(app)
         Spinner:
             id: spectrum_export_spinner
             text: 'Exporter'
@@ -73,11 +218,13 @@ Builder.load_string("""
             on_text: app.save_spectrum(self.text)
     Label:
         id: boxkinetics_coordinates_lbl
-        text: "0,0"
+        text: " | ".join(text for text in (root.cursor_text, root.fit_text) if text)
         size_hint_y: None
         height: dp(30)
     Graph:
         id: graph_widget
+        show_cursor: True
+        on_cursor: root.cursor_changed(self.cursor)
         xlabel: "temps(s)"
         ylabel: "Absorbance"
         x_ticks_minor: 1
@@ -94,7 +241,7 @@ Builder.load_string("""
         xmax: 20
         
 <PopupWavelengthKinetics>
-    size_hint: 0.8, 0.3
+    size_hint: 0.8, 0.4
     title: "Sélection de la longueur d\'onde"
     auto_dismiss: False
     on_open: root.when_opened()
@@ -109,12 +256,20 @@ Builder.load_string("""
                 id: wl_sldr
                 orientation: 'horizontal'
                 step: 1
+            Label:
+                text: "canaux : " + ", ".join("%d nm" % wl for wl in root.wavelengths)
         BoxLayout:
             padding: dp(10)
             spacing: dp(10)
             size_hint_y: None
             height: dp(100)
             orientation: 'horizontal'
+            SpecButton:
+                text: 'Ajouter'
+                on_release: root.on_add()
+            SpecButton:
+                text: 'Effacer'
+                on_release: root.on_clear()
             SpecButton:
                 text: 'Annuler'
                 on_release: root.on_cancel()
@@ -0,0 +1,134 @@
+from functools import partial
+from threading import Lock
+import numpy as np
+from kivy.logger import Logger
+from lib_spectro.fitting import OnlineLinearFit
+
+
+def concentrations(absorbances, slopes, intercepts):
+    """concentrations : Beer-Lambert concentrations c = (A - intercept) / slope
+    absorbances: (samples, wavelengths) array, slopes and intercepts: one per wavelength (nan if not calibrated)"""
+    absorbances = np.asarray(absorbances, dtype=float)
+    slopes = np.asarray(slopes, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (absorbances - np.asarray(intercepts, dtype=float)) / np.where(slopes != 0, slopes, np.nan)
+
+
+class AbsorbanceBatch:
+    """AbsorbanceBatch : absorbance of a series of samples at several wavelengths
+
+    The blank is read once at every wavelength and subtracted from all the samples. All the commands of a
+    sample (set wavelength, read absorbance for each wavelength) are queued at once, and several samples
+    can be queued in a row: the command thread chains them without waiting for the UI. Wavelengths are
+    visited alternately ascending and descending from one sample to the next, so the grating does not
+    move back between two samples.
+    Samples with a known concentration are standards: each one updates the Beer-Lambert line (absorbance
+    vs concentration) of every wavelength.
+    A reading is discarded when the grating is not known to be at its wavelength (the setting failed)."""
+
+    def __init__(self, spectro, wavelengths, result_clbk=None):
+        """spectro: driver (S250Prim)
+        wavelengths: wavelengths of the measures (nm)
+        result_clbk: called from the command thread with (sample index, wavelength index, absorbance)
+            for each result (absorbance None on error)"""
+        self.spectro = spectro
+        self.wavelengths = sorted(set(int(wl) for wl in wavelengths))
+        self.result_clbk = result_clbk
+        self.blanks = np.full(len(self.wavelengths), np.nan)
+        self.labels = []
+        self.known = []
+        # absorbances (samples, wavelengths), rows are allocated by blocks
+        self._absorbances = np.full((16, len(self.wavelengths)), np.nan)
+        self.calibration = [OnlineLinearFit() for _ in self.wavelengths]
+        self._lock = Lock()
+        self._ascending = True
+        # wavelength of the last queued setting, and of the grating when the commands run (None if unknown)
+        self._current_wavelength = None
+        self._grating_wavelength = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def absorbances(self):
+        """absorbances : (samples, wavelengths) array, nan when not measured yet"""
+        with self._lock:
+            return self._absorbances[:len(self.labels)].copy()
+
+    def measure_blank(self, clbk=None):
+        """measure_blank : read the blank at every wavelength
+        clbk: called from the command thread with the blanks array when done"""
+        order = self._wavelength_order()
+        for idx in order:
+            self._set_wavelength(self.wavelengths[idx])
+            self.spectro.get_abs(clbk=partial(self._blank_measured, idx, clbk if idx == order[-1] else None))
+
+    def measure_sample(self, label, concentration=None):
+        """measure_sample : queue the measures of a sample and return its index
+        concentration: known concentration of a standard, None for an unknown sample"""
+        with self._lock:
+            index = len(self.labels)
+            if index == len(self._absorbances):
+                self._absorbances = np.concatenate((self._absorbances, np.full_like(self._absorbances, np.nan)))
+            self.labels.append(label)
+            self.known.append(np.nan if concentration is None else float(concentration))
+        for idx in self._wavelength_order():
+            self._set_wavelength(self.wavelengths[idx])
+            self.spectro.get_abs(clbk=partial(self._sample_measured, index, idx))
+        return index
+
+    def fits(self, confidence=0.95):
+        """fits : Beer-Lambert LinearFit (absorbance = slope * concentration + intercept) of each wavelength,
+        None for a wavelength with less than 3 standards"""
+        with self._lock:
+            return [fit.fit(confidence) for fit in self.calibration]
+
+    def concentrations(self):
+        """concentrations : (samples, wavelengths) concentrations of all the samples from the calibration lines"""
+        fits = self.fits()
+        slopes = np.array([np.nan if fit is None else fit.slope for fit in fits])
+        intercepts = np.array([np.nan if fit is None else fit.intercept for fit in fits])
+        return concentrations(self.absorbances, slopes, intercepts)
+
+    def _wavelength_order(self):
+        """indexes of the wavelengths for the next series of measures, starting at the grating position"""
+        order = list(range(len(self.wavelengths)))
+        if not self._ascending:
+            order.reverse()
+        self._ascending = not self._ascending
+        return order
+
+    def _set_wavelength(self, wavelength):
+        if wavelength != self._current_wavelength:
+            self._current_wavelength = wavelength
+            self.spectro.set_abs_wavelength(wavelength, clbk=partial(self._wavelength_set, wavelength))
+
+    def _wavelength_set(self, wavelength, ret):
+        # commands run in order: readings up to the next setting are taken at this position
+        if ret:
+            self._grating_wavelength = wavelength
+        else:
+            Logger.warning("Absorbance: wavelength {:d} nm not set".format(wavelength))
+            self._grating_wavelength = None
+            # force a new setting on next measure
+            self._current_wavelength = None
+
+    def _at_wavelength(self, idx):
+        return self._grating_wavelength == self.wavelengths[idx]
+
+    def _blank_measured(self, idx, clbk, value):
+        if value is not None and self._at_wavelength(idx):
+            self.blanks[idx] = value
+        if clbk is not None:
+            clbk(self.blanks.copy())
+
+    def _sample_measured(self, index, idx, value):
+        absorbance = None
+        if value is not None and self._at_wavelength(idx):
+            absorbance = value - (self.blanks[idx] if not np.isnan(self.blanks[idx]) else 0.)
+            with self._lock:
+                self._absorbances[index, idx] = absorbance
+                if not np.isnan(self.known[index]):
+                    self.calibration[idx].add(self.known[index], absorbance)
+        if self.result_clbk is not None:
+            self.result_clbk(index, idx, absorbance)
@@ -0,0 +1,91 @@
+from threading import Lock
+from time import monotonic
+from kivy.clock import Clock
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty, ObjectProperty
+
+
+class ActivityMonitor(EventDispatcher):
+    """ActivityMonitor : coalesce serial I/O activity into led updates and byte counters
+
+    data_in / data_out are called by the command thread for every transfer: they only update counters
+    under a lock and ask for one flush on the next frame. The flush (main thread) switches the leds on,
+    so there is at most one state change per led and per frame whatever the number of transfers."""
+    # led widgets switched on when data is received / sent
+    led_in = ObjectProperty(None, allownone=True)
+    led_out = ObjectProperty(None, allownone=True)
+    # total number of bytes received / sent (updated once per frame)
+    bytes_in = NumericProperty(0)
+    bytes_out = NumericProperty(0)
+    # throughput in bytes/s, averaged over rate_interval
+    bytes_in_rate = NumericProperty(0.)
+    bytes_out_rate = NumericProperty(0.)
+    # rate_interval : time between two throughput computations (s)
+    rate_interval = NumericProperty(1.)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = Lock()
+        self._count_in = 0
+        self._count_out = 0
+        self._pending_in = False
+        self._pending_out = False
+        self._flush_scheduled = False
+        self._trigger_flush = Clock.create_trigger(self._flush)
+        self._rate_time = monotonic()
+        self._rate_count_in = 0
+        self._rate_count_out = 0
+        self._rate_event = Clock.schedule_interval(self._update_rates, self.rate_interval)
+
+    def data_in(self, n=1):
+        """data_in : n bytes were received (may be called from any thread)"""
+        with self._lock:
+            self._count_in += n
+            self._pending_in = True
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if schedule:
+            self._trigger_flush()
+
+    def data_out(self, n=1):
+        """data_out : n bytes were sent (may be called from any thread)"""
+        with self._lock:
+            self._count_out += n
+            self._pending_out = True
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if schedule:
+            self._trigger_flush()
+
+    def snapshot(self):
+        """snapshot : return counters and rates as a dict (may be called from any thread)"""
+        with self._lock:
+            count_in, count_out = self._count_in, self._count_out
+        return {'bytes_in': count_in, 'bytes_out': count_out,
+                'bytes_in_rate': self.bytes_in_rate, 'bytes_out_rate': self.bytes_out_rate}
+
+    def on_rate_interval(self, instance, value):
+        self._rate_event.cancel()
+        self._rate_event = Clock.schedule_interval(self._update_rates, value)
+
+    def _flush(self, dt):
+        with self._lock:
+            pending_in, pending_out = self._pending_in, self._pending_out
+            self._pending_in = self._pending_out = False
+            self._flush_scheduled = False
+            self.bytes_in, self.bytes_out = self._count_in, self._count_out
+        if pending_in and self.led_in is not None:
+            self.led_in.state = 'on'
+        if pending_out and self.led_out is not None:
+            self.led_out.state = 'on'
+
+    def _update_rates(self, dt):
+        now = monotonic()
+        with self._lock:
+            count_in, count_out = self._count_in, self._count_out
+        elapsed = now - self._rate_time
+        if elapsed > 0:
+            self.bytes_in_rate = (count_in - self._rate_count_in) / elapsed
+            self.bytes_out_rate = (count_out - self._rate_count_out) / elapsed
+        self._rate_time = now
+        self._rate_count_in, self._rate_count_out = count_in, count_out
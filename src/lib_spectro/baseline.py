@@ -0,0 +1,97 @@
+from threading import Lock
+from time import time
+import numpy as np
+
+
+class BaselineEntry:
+    """BaselineEntry : a hardware baseline made on an instrument
+    wavelengths, values: scan of the blank right after the baseline (residual, subtracted from spectra) or None"""
+
+    def __init__(self, instrument, wllo, wlhi, speed, res, timestamp, wavelengths=None, values=None):
+        self.instrument = instrument
+        self.wllo = wllo
+        self.wlhi = wlhi
+        self.speed = speed
+        self.res = res
+        self.timestamp = timestamp
+        self.wavelengths = None
+        self.values = None
+        if wavelengths is not None:
+            self.set_residual(wavelengths, values)
+
+    def set_residual(self, wavelengths, values):
+        """set_residual : store the scan of the blank"""
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+
+    def covers(self, wllo, wlhi, speed, res):
+        return self.wllo <= wllo and wlhi <= self.wlhi and self.speed == speed and self.res == res
+
+    def residual(self, wavelengths):
+        """residual : blank residual interpolated on wavelengths (zeros if there is no residual scan)"""
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        if self.values is None:
+            return np.zeros_like(wavelengths)
+        return np.interp(wavelengths, self.wavelengths, self.values)
+
+    def correct(self, wavelengths, values, wllo=None, wlhi=None):
+        """correct : subtract the residual from values (1D, or 2D with one spectrum per row) and keep the
+        points in [wllo, wlhi] - return (wavelengths, values) numpy arrays"""
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        values = np.asarray(values, dtype=float)
+        mask = np.ones(wavelengths.shape, dtype=bool)
+        if wllo is not None:
+            mask &= wavelengths >= wllo
+        if wlhi is not None:
+            mask &= wavelengths <= wlhi
+        wavelengths = wavelengths[mask]
+        return wavelengths, values[..., mask] - self.residual(wavelengths)
+
+
+class BaselineLibrary:
+    """BaselineLibrary : baselines of the instruments, reused when a spectrum range is inside a baseline range
+
+    The spectrometer scans the range of its last hardware baseline (Cmd_BaseLine), so only the last baseline
+    of each instrument can be used. It is reused for any range it covers with the same speed and resolution,
+    as long as it is not expired: the scan is then cropped and corrected on the host side. Older baselines
+    are kept as history (at most max_entries)."""
+
+    def __init__(self, max_age=3600., max_entries=256):
+        """max_age: baselines older than max_age (s) are not reused - None to disable expiry"""
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.entries = []
+        self.current = {}
+        self._lock = Lock()
+
+    def add(self, instrument, wllo, wlhi, speed=8, res=3, timestamp=None):
+        """add : record a hardware baseline just made on instrument, it replaces the previous one"""
+        entry = BaselineEntry(instrument, wllo, wlhi, speed, res, time() if timestamp is None else timestamp)
+        with self._lock:
+            self.entries.append(entry)
+            del self.entries[:-self.max_entries]
+            self.current[instrument] = entry
+        return entry
+
+    def find(self, instrument, wllo, wlhi, speed=8, res=3, now=None):
+        """find : return the baseline of instrument usable for [wllo, wlhi] at speed and res, or None"""
+        with self._lock:
+            entry = self.current.get(instrument)
+        if entry is None or self.is_expired(entry, now) or not entry.covers(wllo, wlhi, speed, res):
+            return None
+        return entry
+
+    def is_expired(self, entry, now=None):
+        if self.max_age is None:
+            return False
+        return (time() if now is None else now) - entry.timestamp > self.max_age
+
+    def invalidate(self, instrument):
+        """invalidate : the instrument lost its baseline (e.g. restarted)"""
+        with self._lock:
+            self.current.pop(instrument, None)
+
+    def history(self, instrument=None):
+        """history : baselines made (on instrument if not None), oldest first"""
+        with self._lock:
+            return [e for e in self.entries if instrument is None or e.instrument == instrument]
@@ -0,0 +1,136 @@
+import sqlite3
+from collections import namedtuple
+from threading import Lock
+from time import time
+
+# one indexed acquisition - data are in the file at path
+Acquisition = namedtuple('Acquisition', ['id', 'timestamp', 'instrument', 'model', 'firmware', 'mode',
+                                         'wl_lo', 'wl_hi', 'label', 'path'])
+
+
+class AcquisitionCatalog:
+    """AcquisitionCatalog : index of every acquisition in a SQLite database
+
+    Only metadata are stored (time, instrument, model, firmware, mode, wavelength range, sample label and
+    file location), raw data stay in their files. Indexes cover the usual queries (by sample, mode or
+    instrument over a time span, by wavelength range) so they don't scan the table."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS acquisitions (
+        id INTEGER PRIMARY KEY,
+        timestamp REAL NOT NULL,
+        instrument TEXT,
+        model TEXT,
+        firmware INTEGER,
+        mode TEXT NOT NULL,
+        wl_lo REAL,
+        wl_hi REAL,
+        label TEXT NOT NULL DEFAULT '',
+        path TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS acquisitions_time ON acquisitions (timestamp);
+    CREATE INDEX IF NOT EXISTS acquisitions_label ON acquisitions (label, timestamp);
+    CREATE INDEX IF NOT EXISTS acquisitions_mode ON acquisitions (mode, timestamp);
+    CREATE INDEX IF NOT EXISTS acquisitions_model ON acquisitions (model, timestamp);
+    CREATE INDEX IF NOT EXISTS acquisitions_range ON acquisitions (mode, wl_lo, wl_hi);
+    """
+    INSERT = ("INSERT INTO acquisitions (timestamp, instrument, model, firmware, mode, wl_lo, wl_hi, label, path)"
+              " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(self.SCHEMA)
+            # approximate statistics are enough for the planner and keep ANALYZE fast
+            self.conn.execute("PRAGMA analysis_limit=1000")
+            self.count = self.conn.execute("SELECT COUNT(*) FROM acquisitions").fetchone()[0]
+        self._analyzed_count = self.count
+        self.optimize()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def optimize(self):
+        """optimize : update index statistics (without them SQLite may pick a poor index for a query)"""
+        with self._lock, self.conn:
+            self.conn.execute("ANALYZE")
+            self._analyzed_count = self.count
+
+    def add(self, mode, path, wl_lo=None, wl_hi=None, label='', model=None, firmware=None, instrument=None,
+            timestamp=None):
+        """add : index an acquisition saved in path and return its id
+        mode: 'spectrum', 'absorbance', 'kinetics'..."""
+        with self._lock, self.conn:
+            cursor = self.conn.execute(self.INSERT, (time() if timestamp is None else timestamp, instrument, model,
+                                                     firmware, mode, wl_lo, wl_hi, label, path))
+            self.count += 1
+            last_id = cursor.lastrowid
+        self._grown()
+        return last_id
+
+    def add_many(self, records):
+        """add_many : index (timestamp, instrument, model, firmware, mode, wl_lo, wl_hi, label, path) records
+        in one transaction and return the id of the last one (None if there is none)"""
+        with self._lock, self.conn:
+            cursor = self.conn.executemany(self.INSERT, records)
+            if cursor.rowcount <= 0:
+                return None
+            self.count += cursor.rowcount
+            # lastrowid is not set by executemany
+            last_id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        self._grown()
+        return last_id
+
+    def _grown(self):
+        # statistics are refreshed when the catalog has grown by a quarter
+        if self.count > 5 * max(self._analyzed_count, 256) // 4:
+            self.optimize()
+
+    def remove(self, acquisition_id):
+        with self._lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM acquisitions WHERE id = ?", (acquisition_id,))
+            self.count -= cursor.rowcount
+
+    def query(self, label=None, mode=None, model=None, instrument=None, wl_lo=None, wl_hi=None, overlap=False,
+              since=None, until=None, limit=None):
+        """query : return acquisitions (newest first) matching every given criterion
+        wl_lo, wl_hi: acquisitions covering [wl_lo, wl_hi] - or only overlapping it if overlap is True
+        since, until: time span (s since epoch)
+        e.g. query(label="X", mode="spectrum", wl_lo=500, wl_hi=600, since=time() - 30 * 86400)"""
+        clauses = []
+        args = []
+        for column, value in (('label', label), ('mode', mode), ('model', model), ('instrument', instrument)):
+            if value is not None:
+                clauses.append(column + " = ?")
+                args.append(value)
+        if wl_lo is not None:
+            clauses.append("wl_hi >= ?" if overlap else "wl_lo <= ?")
+            args.append(wl_lo)
+        if wl_hi is not None:
+            clauses.append("wl_lo <= ?" if overlap else "wl_hi >= ?")
+            args.append(wl_hi)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("timestamp <= ?")
+            args.append(until)
+        sql = "SELECT id, timestamp, instrument, model, firmware, mode, wl_lo, wl_hi, label, path FROM acquisitions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            return [Acquisition(*row) for row in self.conn.execute(sql, args)]
+
+    def labels(self):
+        """labels : sample labels in the catalog"""
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT label FROM acquisitions ORDER BY label")]
@@ -0,0 +1,584 @@
+import asyncio
+import json
+from collections import OrderedDict
+from functools import partial
+from ipaddress import ip_address
+from itertools import count
+from threading import Lock, Thread
+from time import time
+from urllib.parse import urlsplit, parse_qs
+from kivy.logger import Logger
+from lib_spectro.kinetics import MultiWavelengthKinetics
+from lib_spectro.s250Prim_async import S250Prim, NotConnectedError
+
+Reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 415: 'Unsupported Media Type',
+           500: 'Internal Server Error'}
+Finished_States = ('done', 'failed', 'cancelled')
+
+
+class ApiError(Exception):
+    """ApiError : error answered to the client with an HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _wavelengths(params):
+    """list of int wavelengths (nm) of params['wavelengths'] (a number or a list), checked against the device"""
+    wavelengths = params.get('wavelengths')
+    if isinstance(wavelengths, (int, float)):
+        wavelengths = [wavelengths]
+    limits = S250Prim.waveLengthLimits
+    if (not isinstance(wavelengths, list) or not wavelengths or
+            not all(isinstance(wl, (int, float)) and limits['start'] <= wl <= limits['end'] for wl in wavelengths)):
+        raise ApiError(400, "wavelengths: list of wavelengths between {:d} and {:d} nm expected".format(
+            limits['start'], limits['end']))
+    return [int(wl) for wl in wavelengths]
+
+
+def _number(params, key, default=None, minimum=0.):
+    value = params.get(key, default)
+    if value is None and default is None:
+        raise ApiError(400, "{:s}: number expected".format(key))
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < minimum:
+        raise ApiError(400, "{:s}: number >= {:g} expected".format(key, minimum))
+    return value
+
+
+def parse_job(params):
+    """parse_job : check the parameters of a submitted job, return (kind, normalized parameters, port)
+        baseline:   start, end (nm), speed (1 to 8, default 8)
+        spectrum:   no parameter, range of the last baseline
+        absorbance: wavelengths, ports (optional: devices read at the same time, instead of port)
+        kinetics:   wavelengths, duration (s), interval (s, default 0), blank (default false)
+    port: device of the job, default device if missing"""
+    kind = params.get('kind')
+    port = params.get('port')
+    if port is not None and not isinstance(port, str):
+        raise ApiError(400, "port: string expected")
+    if kind == 'baseline':
+        limits = S250Prim.waveLengthLimits
+        start = int(_number(params, 'start', minimum=limits['start']))
+        end = int(_number(params, 'end', minimum=start + 1))
+        speed = params.get('speed', limits['speed'][-1])
+        if end > limits['end'] or speed not in limits['speed']:
+            raise ApiError(400, "end: max {:d} nm, speed: 1 to 8".format(limits['end']))
+        return kind, {'start': start, 'end': end, 'speed': speed}, port
+    if kind == 'spectrum':
+        return kind, {}, port
+    if kind == 'absorbance':
+        ports = params.get('ports')
+        if ports is None:
+            return kind, {'wavelengths': _wavelengths(params)}, port
+        if (port is not None or not isinstance(ports, list) or not ports or
+                not all(isinstance(p, str) for p in ports)):
+            raise ApiError(400, "ports: list of ports expected (without port)")
+        return kind, {'wavelengths': _wavelengths(params), 'ports': sorted(set(ports))}, None
+    if kind == 'kinetics':
+        # a duration is required: the run must end without a client
+        return kind, {'wavelengths': sorted(set(_wavelengths(params))),
+                      'duration': _number(params, 'duration', minimum=1.),
+                      'interval': _number(params, 'interval', 0.), 'blank': bool(params.get('blank', False))}, port
+    raise ApiError(400, "kind: baseline, spectrum, absorbance or kinetics expected")
+
+
+class Job:
+    """Job : an acquisition submitted to the ControlServer
+
+    A job only lives in the event loop: the driver callbacks post their results with loop.call_soon_threadsafe.
+    All the events are kept until the job is forgotten, so a client subscribing late (or reconnecting with
+    ?from=) gets the whole acquisition. Clients waiting for events are woken once per batch of posted events."""
+
+    def __init__(self, job_id, kind, params, port, loop):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.port = port
+        self.state = 'queued'
+        self.progress = 0
+        self.events = []
+        self.result = None
+        self.error = None
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+        # stop a running job (kinetics), None if it can't be cancelled once started
+        self.stop = None
+        self.cancel_requested = False
+        self.done = loop.create_future()
+        self._loop = loop
+        self._waiters = []
+
+    @property
+    def is_finished(self):
+        return self.state in Finished_States
+
+    def summary(self, result=False):
+        summary = {'id': self.id, 'kind': self.kind, 'params': self.params, 'port': self.port, 'state': self.state,
+                   'progress': self.progress, 'events': len(self.events), 'error': self.error,
+                   'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+        if result:
+            summary['result'] = self.result
+        return summary
+
+    def begin(self, port):
+        self.state = 'running'
+        self.port = port
+        self.started = time()
+        self.add_events([{'event': 'state', 'state': self.state, 'port': port}])
+
+    def add_events(self, events):
+        if self.is_finished:
+            # late callback of a job that failed while queuing its commands
+            return
+        self.events += events
+        percent = events[-1].get('percent')
+        if percent is not None:
+            self.progress = percent
+        self._wake()
+
+    def finish(self, result=None, error=None):
+        if self.is_finished:
+            return
+        self.state = 'cancelled' if self.cancel_requested else 'failed' if error is not None else 'done'
+        self.result = result
+        self.error = error
+        self.finished = time()
+        if self.state == 'done':
+            self.progress = 100
+        self._wake()
+        self.done.set_result(self.state)
+
+    async def wait(self):
+        """wait : until new events are posted or the job is finished"""
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        await waiter
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+
+
+class ControlServer:
+    """ControlServer : HTTP/JSON API to run acquisitions without the UI (LIMS), on the loopback only
+
+        GET    /status               devices and queue of jobs
+        POST   /devices/connect      connect and start the device {"port": ...} (see DeviceManager.connect)
+        POST   /devices/disconnect   disconnect a device connected with the API {"port": ...}
+        POST   /jobs                 submit a job (see parse_job), answers its summary with its id (202)
+        GET    /jobs                 summaries of the jobs
+        GET    /jobs/<id>            summary and result of a job (polling)
+        GET    /jobs/<id>/events     chunked stream of the events of a job, one JSON object per line, from the
+                                     first one (or ?from=index) until the final {"event": state, "result": ...}
+        DELETE /jobs/<id>            cancel a queued job or stop a running kinetics
+
+    The server runs an asyncio loop in its own thread: any number of clients can stream the same job, they
+    are woken by the driver callbacks and never poll. Jobs run one after the other, in order, so the commands
+    of two jobs never interleave on the device (e.g. the wavelength of a kinetics). The UI still sends its
+    own commands: don't use it during an API acquisition.
+    Results are the raw values of the instrument: blanks and baselines residuals are left to the client.
+    A web page open in a local browser can reach the loopback too: requests must name the server in their
+    Host header (a page of another site, even resolved to 127.0.0.1, can't) and POST and DELETE must have
+    a Content-Type: application/json body, which a page can't send to another origin without a preflight
+    request (never accepted here)."""
+
+    def __init__(self, get_driver, drivers, devices=None, port=8765, host='127.0.0.1', max_jobs=1000,
+                 max_body=65536):
+        """get_driver: function returning the driver of a port, the default one for None (None if unknown)
+        drivers: function returning {port: driver} of the connected devices
+        devices: DeviceManager connecting the devices and synchronizing the acquisitions on several of them
+        max_jobs: finished jobs are forgotten, oldest first, beyond max_jobs"""
+        if host != 'localhost' and not ip_address(host).is_loopback:
+            raise ValueError("control API is only served on the loopback interface, not {:s}".format(host))
+        self.get_driver = get_driver
+        self.drivers = drivers
+        self.devices = devices
+        self.host = host
+        self.port = port
+        self.max_jobs = max_jobs
+        self.max_body = max_body
+        self.jobs = OrderedDict()
+        self._ids = count(1)
+        self._runners = {'baseline': self._run_baseline, 'spectrum': self._run_spectrum,
+                         'absorbance': self._run_absorbance, 'kinetics': self._run_kinetics}
+        self._loop = None
+        self._server = None
+        self._queue = None
+        self._thread = None
+
+    # ---- server
+    def start(self):
+        """start : bind the port and serve in a daemon thread - return False if the port can't be bound"""
+        loop = asyncio.new_event_loop()
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            loop.close()
+            Logger.warning("Control: can't listen on {:s}:{:d} ({!r})".format(self.host, self.port, e))
+            return False
+        self._loop = loop
+        # port 0: the system chooses a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._queue = asyncio.Queue()
+        loop.create_task(self._worker())
+        self._thread = Thread(target=loop.run_forever, name="Control_Server", daemon=True)
+        self._thread.start()
+        Logger.info("Control: serving on http://{:s}:{:d}".format(self.host, self.port))
+        return True
+
+    def stop(self):
+        """stop : close the server and the connections, a running kinetics is stopped"""
+        loop = self._loop
+        if loop is None:
+            return
+        self._loop = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        # the loop is stopped: the jobs can be read from this thread
+        for job in self.jobs.values():
+            if job.state == 'running' and job.stop is not None:
+                job.stop()
+        self._server.close()
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+        self._server = None
+        self._thread = None
+
+    def _post(self, loop, func, *args):
+        """call func(*args) in the event loop, from a driver callback (command thread)"""
+        try:
+            loop.call_soon_threadsafe(func, *args)
+        except RuntimeError:
+            # server stopped
+            pass
+
+    # ---- jobs
+    def submit(self, params):
+        """submit : queue a job (event loop only)"""
+        kind, params, port = parse_job(params)
+        job = Job(next(self._ids), kind, params, port, asyncio.get_running_loop())
+        self.jobs[job.id] = job
+        if len(self.jobs) > self.max_jobs:
+            for old in [old for old in self.jobs.values() if old.is_finished][:len(self.jobs) - self.max_jobs]:
+                del self.jobs[old.id]
+        self._queue.put_nowait(job)
+        return job
+
+    def cancel(self, job):
+        if job.is_finished:
+            raise ApiError(409, "job {:d} is {:s}".format(job.id, job.state))
+        job.cancel_requested = True
+        if job.state == 'queued':
+            job.finish()
+        elif job.stop is not None:
+            job.stop()
+        else:
+            job.cancel_requested = False
+            raise ApiError(409, "a running {:s} can't be cancelled".format(job.kind))
+
+    async def _worker(self):
+        """run the jobs one after the other"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.is_finished:
+                # cancelled while queued
+                continue
+            ports = job.params.get('ports')
+            drivers = [self.get_driver(port) for port in ports or [job.port]]
+            try:
+                if any(driver is None or not driver.connected for driver in drivers):
+                    raise NotConnectedError
+                driver = drivers[0]
+                job.begin(ports or driver.port)
+                self._runners[job.kind](driver, job, partial(self._post, loop))
+            except NotConnectedError:
+                job.finish(error="spectrometer not connected")
+            except ApiError as e:
+                job.finish(error=str(e))
+            except Exception as e:
+                Logger.warning("Control: job {:d} failed ({!r})".format(job.id, e))
+                job.finish(error=repr(e))
+            await job.done
+
+    # runners: queue the commands of a job, the callbacks (command thread) post the events and the end of the job
+    def _run_baseline(self, driver, job, post):
+        params = job.params
+
+        def done(ret):
+            post(job.finish, dict(params) if ret else None, None if ret else "baseline failed")
+        driver.make_spectrum_baseline(params['start'], params['end'], params['speed'], clbk=done)
+
+    def _run_spectrum(self, driver, job, post):
+        if driver.scan_range is None:
+            raise ApiError(409, "no baseline: submit a baseline job first")
+
+        def progress(point):
+            percent, wl, value = point
+            post(job.add_events, [{'event': 'point', 'percent': percent, 'wavelength': wl, 'value': value}])
+
+        def done(result):
+            if result is None:
+                post(job.finish, None, "spectrum interrupted")
+            else:
+                post(job.finish, {'wavelengths': list(result[0]), 'values': list(result[1])})
+        driver.get_spectrum(clbk=done, progress_clbk=progress)
+
+    def _run_absorbance(self, driver, job, post):
+        if job.params.get('ports'):
+            return self._run_synchronized_absorbance(job, post)
+        wavelengths = job.params['wavelengths']
+        values = []
+        # wavelength set successfully for the next reading
+        wavelength_set = [False]
+
+        def set_done(ret):
+            wavelength_set[0] = bool(ret)
+
+        def measured(idx, value):
+            if not wavelength_set[0]:
+                value = None
+            values.append(value)
+            post(job.add_events, [{'event': 'absorbance', 'percent': round(len(values) / len(wavelengths) * 100),
+                                   'wavelength': wavelengths[idx], 'value': value}])
+            if len(values) == len(wavelengths):
+                if all(value is None for value in values):
+                    post(job.finish, None, "no absorbance read")
+                else:
+                    post(job.finish, {'wavelengths': wavelengths, 'absorbances': values})
+        for idx, wl in enumerate(wavelengths):
+            driver.set_abs_wavelength(wl, clbk=set_done)
+            driver.get_abs(clbk=partial(measured, idx))
+
+    def _run_synchronized_absorbance(self, job, post):
+        """absorbance on several devices: each wavelength is read by all the devices at the same time"""
+        ports, wavelengths = job.params['ports'], job.params['wavelengths']
+        if self.devices is None or any(port not in self.devices for port in ports):
+            raise ApiError(409, "devices not managed: connect them with /devices/connect")
+        total = len(ports) * len(wavelengths)
+        values = {port: [] for port in ports}
+        wavelength_set = {}
+        # callbacks come from the command threads of all the devices
+        lock = Lock()
+
+        def set_done(port, ret):
+            wavelength_set[port] = bool(ret)
+
+        def measured(idx, port, value):
+            if not wavelength_set.get(port):
+                value = None
+            with lock:
+                values[port].append(value)
+                n = sum(len(port_values) for port_values in values.values())
+            post(job.add_events, [{'event': 'absorbance', 'percent': round(n / total * 100), 'port': port,
+                                   'wavelength': wavelengths[idx], 'value': value}])
+            if n == total:
+                if all(value is None for port_values in values.values() for value in port_values):
+                    post(job.finish, None, "no absorbance read")
+                else:
+                    post(job.finish, {'wavelengths': wavelengths, 'absorbances': values})
+        for idx, wl in enumerate(wavelengths):
+            self.devices.acquire('set_abs_wavelength', ports, clbk=set_done, wl=wl)
+            self.devices.acquire('get_abs', ports, synchronized=True, clbk=partial(measured, idx))
+
+    # ---- devices
+    async def connect_device(self, port):
+        """connect_device : connect and start a device, return True if it is ready"""
+        if self.devices is None:
+            raise ApiError(409, "no device manager")
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def started(port, ok):
+            self._post(loop, lambda: ready.done() or ready.set_result(ok))
+        # opening the port may block: not in the event loop
+        driver = await loop.run_in_executor(None, partial(self.devices.connect, port, clbk=started))
+        if driver is None:
+            raise ApiError(409, "can't open {:s}".format(port))
+        return await ready
+
+    async def disconnect_device(self, port):
+        if self.devices is None or port not in self.devices:
+            raise ApiError(404, "no device on {:s}".format(port))
+        if self.devices[port] is self.get_driver(None):
+            raise ApiError(409, "{:s} is the device of the UI".format(port))
+        await asyncio.get_running_loop().run_in_executor(None, self.devices.disconnect, port)
+
+    def _run_kinetics(self, driver, job, post):
+        params = job.params
+
+        def sample(wavelength, progress):
+            percent, t, absorbance = progress
+            post(job.add_events, [{'event': 'sample', 'percent': percent, 'wavelength': wavelength, 't': t,
+                                   'value': absorbance}])
+
+        def done():
+            channels = [{'wavelength': channel.wavelength, 'samples': len(channel.buffer), 'errors': channel.errors,
+                         'rate': channel.rate(), 'blank': channel.blank,
+                         'rates': {model: None if rate is None else rate._asdict()
+                                   for model, rate in channel.fit.rates().items()}}
+                        for channel in kinetics.channels]
+            post(job.finish, {'elapsed': kinetics.elapsed(), 'channels': channels})
+
+        def blank_done(blanks):
+            if job.cancel_requested:
+                post(job.finish)
+            else:
+                kinetics.start()
+        kinetics = MultiWavelengthKinetics(driver, params['wavelengths'], interval=params['interval'],
+                                           duration=params['duration'], done_clbk=done)
+        for channel in kinetics.channels:
+            channel.progress_clbk = partial(sample, channel.wavelength)
+        job.stop = kinetics.stop
+        if params['blank']:
+            kinetics.measure_blank(clbk=blank_done)
+        else:
+            kinetics.start()
+
+    # ---- HTTP
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, path, query, body = await self._read_request(reader)
+                await self._dispatch(method, path, query, body, writer)
+            except ApiError as e:
+                await self._send_json(writer, e.status, {'error': str(e)})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as e:
+                Logger.warning("Control: request failed ({!r})".format(e))
+                await self._send_json(writer, 500, {'error': repr(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # client gone
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """return (method, path, query dict, JSON body)"""
+        try:
+            method, target, version = (await reader.readline()).decode('latin-1').split()
+        except ValueError:
+            raise ApiError(400, "bad request line")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('host', '').lower() not in self.hosts():
+            raise ApiError(403, "Host: {:s} expected".format(self.hosts()[0]))
+        if method in ('POST', 'DELETE') and \
+                headers.get('content-type', '').partition(';')[0].strip().lower() != 'application/json':
+            raise ApiError(415, "Content-Type: application/json expected")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise ApiError(400, "bad Content-Length")
+        if length > self.max_body:
+            raise ApiError(413, "body larger than {:d} bytes".format(self.max_body))
+        body = {}
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                raise ApiError(400, "body: JSON expected")
+            if not isinstance(body, dict):
+                raise ApiError(400, "body: JSON object expected")
+        url = urlsplit(target)
+        return method, url.path.rstrip('/') or '/', parse_qs(url.query), body
+
+    def hosts(self):
+        """hosts : accepted values of the Host header (the server address, or localhost, and its port)"""
+        host = '[{:s}]'.format(self.host) if ':' in self.host else self.host
+        return [name + ':{:d}'.format(self.port) for name in (host, 'localhost')]
+
+    async def _dispatch(self, method, path, query, body, writer):
+        parts = path.strip('/').split('/')
+        if parts == ['status']:
+            self._allow(method, 'GET')
+            return await self._send_json(writer, 200, self.status())
+        if parts == ['jobs']:
+            self._allow(method, 'GET', 'POST')
+            if method == 'GET':
+                return await self._send_json(writer, 200, [job.summary() for job in self.jobs.values()])
+            return await self._send_json(writer, 202, self.submit(body).summary())
+        if parts[0] == 'devices' and len(parts) == 2 and parts[1] in ('connect', 'disconnect'):
+            self._allow(method, 'POST')
+            port = body.get('port')
+            if not isinstance(port, str):
+                raise ApiError(400, "port: string expected")
+            if parts[1] == 'connect':
+                return await self._send_json(writer, 200, {'port': port, 'ready': await self.connect_device(port)})
+            await self.disconnect_device(port)
+            return await self._send_json(writer, 200, {'port': port, 'ready': False})
+        if parts[0] == 'jobs' and 2 <= len(parts) <= 3:
+            job = self.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+            if job is None:
+                raise ApiError(404, "no job {:s}".format(parts[1]))
+            if len(parts) == 3 and parts[2] == 'events':
+                self._allow(method, 'GET')
+                start = query.get('from', ['0'])[0]
+                return await self._stream_events(writer, job, int(start) if start.isdigit() else 0)
+            if len(parts) == 2:
+                self._allow(method, 'GET', 'DELETE')
+                if method == 'DELETE':
+                    self.cancel(job)
+                return await self._send_json(writer, 200, job.summary(result=True))
+        raise ApiError(404, "no resource {:s}".format(path))
+
+    def status(self):
+        devices = {port: {'connected': driver.connected, 'queue_time': driver.estimate_queue_time()}
+                   for port, driver in self.drivers().items()}
+        running = [job.id for job in self.jobs.values() if job.state == 'running']
+        queued = [job.id for job in self.jobs.values() if job.state == 'queued']
+        return {'devices': devices, 'running': running[0] if running else None, 'queued': queued}
+
+    @staticmethod
+    def _allow(method, *methods):
+        if method not in methods:
+            raise ApiError(405, "{:s} expected".format(" or ".join(methods)))
+
+    @staticmethod
+    def _head(status, content_type, headers=()):
+        lines = ["HTTP/1.1 {:d} {:s}".format(status, Reasons[status]), "Content-Type: " + content_type,
+                 "Cache-Control: no-store", "Connection: close"]
+        return ("\r\n".join(lines + list(headers)) + "\r\n\r\n").encode('latin-1')
+
+    async def _send_json(self, writer, status, value):
+        body = json.dumps(value).encode('utf-8')
+        writer.write(self._head(status, 'application/json', ["Content-Length: {:d}".format(len(body))]) + body)
+        await writer.drain()
+
+    async def _stream_events(self, writer, job, start):
+        """chunked response: the events of job from start, one chunk per batch of events, then the end of job"""
+        writer.write(self._head(200, 'application/x-ndjson', ["Transfer-Encoding: chunked"]))
+        index = start
+        while True:
+            if index < len(job.events):
+                events = job.events[index:]
+                index += len(events)
+                self._write_chunk(writer, "".join(json.dumps(event) + "\n" for event in events))
+                # slow client: the loop serves the others while its buffer drains
+                await writer.drain()
+            elif job.is_finished:
+                break
+            else:
+                await job.wait()
+        self._write_chunk(writer, json.dumps({'event': job.state, 'result': job.result, 'error': job.error}) + "\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer, text):
+        data = text.encode('utf-8')
+        writer.write("{:x}\r\n".format(len(data)).encode('latin-1') + data + b"\r\n")
@@ -0,0 +1,98 @@
+from array import array
+from threading import Condition
+from kivy.clock import Clock
+
+# object timing the deliveries on the main thread (begin(name, detail) / end()), see set_probe
+_probe = None
+
+
+def set_probe(probe):
+    """set_probe : time every delivery of a ResultChannel as 'delivery' with probe, None to disable"""
+    global _probe
+    _probe = probe
+
+
+class ResultChannel:
+    """ResultChannel : batch partial results of a command and hand them to the main thread once per frame
+
+    The channel is given to the driver as progress_clbk: the command thread calls it with (percent, wl, value)
+    for every point. Points are appended to pending arrays and delivered on the main thread, at most once per frame:
+        on_data(start, wl, values): index of the first point of the slice and array('d') slices of wavelengths/values
+        on_progress(percent): latest progress only, intermediate values are dropped
+        on_done(result): final result of the command - use channel.done as the command callback so that it is
+            delivered after the last data slice
+    Data is never dropped: if more than max_pending points wait for delivery (slow main thread), the command
+    thread is held back for at most backpressure_timeout seconds."""
+
+    def __init__(self, on_data=None, on_progress=None, on_done=None, max_pending=4096, backpressure_timeout=0.5):
+        self.on_data = on_data
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.max_pending = max_pending
+        self.backpressure_timeout = backpressure_timeout
+        self._cond = Condition()
+        self._wl = array('d')
+        self._values = array('d')
+        self._start = 0
+        self._progress = None
+        self._finished = False
+        self._result = None
+        self._delivery_scheduled = False
+        self._trigger_delivery = Clock.create_trigger(self._deliver)
+
+    def __call__(self, progress):
+        """called by the command thread with (percent, wl, value) for each point"""
+        percent, wl, value = progress
+        with self._cond:
+            if len(self._values) >= self.max_pending:
+                self._cond.wait_for(lambda: len(self._values) < self.max_pending, self.backpressure_timeout)
+            self._wl.append(wl)
+            self._values.append(value)
+            self._progress = percent
+            schedule = self._schedule_delivery()
+        if schedule:
+            self._trigger_delivery()
+
+    def done(self, result):
+        """done : command callback - deliver result after the pending data"""
+        with self._cond:
+            self._finished = True
+            self._result = result
+            schedule = self._schedule_delivery()
+        if schedule:
+            self._trigger_delivery()
+
+    def _schedule_delivery(self):
+        """return True if the delivery trigger has to be called (lock must be held)"""
+        if self._delivery_scheduled:
+            return False
+        self._delivery_scheduled = True
+        return True
+
+    def _deliver(self, dt):
+        probe = _probe
+        if probe is None:
+            return self._deliver_pending()
+        probe.begin('delivery', None)
+        try:
+            self._deliver_pending()
+        finally:
+            probe.end()
+
+    def _deliver_pending(self):
+        with self._cond:
+            wl, values = self._wl, self._values
+            self._wl, self._values = array('d'), array('d')
+            start = self._start
+            self._start += len(values)
+            progress, self._progress = self._progress, None
+            finished, result = self._finished, self._result
+            self._finished, self._result = False, None
+            self._delivery_scheduled = False
+            self._cond.notify_all()
+        if values and self.on_data is not None:
+            self.on_data(start, wl, values)
+        if progress is not None and self.on_progress is not None:
+            self.on_progress(progress)
+        if finished and self.on_done is not None:
+            self.on_done(result)
@@ -0,0 +1,136 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import partial
+from threading import Barrier, BrokenBarrierError, Lock
+from time import time
+from kivy.logger import Logger
+from lib_spectro.s250Prim_async import S250Prim
+
+# one result of an acquisition: timestamp (s since epoch), port of the device, driver method and returned value
+TimelineRecord = namedtuple('TimelineRecord', ['timestamp', 'port', 'method', 'value'])
+
+
+class DeviceManager:
+    """DeviceManager : several S250/Prim spectrometers connected at once
+
+    Each device has its own driver, serial connection and command thread, so acquisitions run in parallel.
+    Results of acquire() are merged in a single timeline sorted by time, the oldest ones are dropped beyond
+    max_timeline records. The device screen registers its device
+    with add(), the other ones are connected through the control API (see lib_spectro.control_api)."""
+    # sync_timeout : max time (s) a device waits for the others in a synchronized acquisition
+    sync_timeout = 10.
+    # max_timeline : number of records kept in the timeline
+    max_timeline = 10000
+
+    def __init__(self, activity_out_clbk=None, activity_in_clbk=None):
+        self.activity_out_clbk = activity_out_clbk
+        self.activity_in_clbk = activity_in_clbk
+        self.devices = {}
+        self.timeline = []
+        self._timeline_times = []
+        self._timeline_lock = Lock()
+
+    def __contains__(self, port):
+        return port in self.devices
+
+    def __getitem__(self, port):
+        return self.devices[port]
+
+    def connect(self, port, clbk=None):
+        """connect : connect a new device on port, start it (Cmd_Init) and return its driver (None if the port
+        can't be opened)
+        clbk: function called with (port, ready) - from the command thread once the device answered Cmd_Init,
+            right away if the device was already connected. A device that fails to start is disconnected."""
+        if port in self.devices:
+            device = self.devices[port]
+            if clbk is not None:
+                clbk(port, device.connected)
+            return device
+        device = S250Prim(activity_out_clbk=self.activity_out_clbk, activity_in_clbk=self.activity_in_clbk)
+        if not device.connect(port):
+            Logger.warning("Devices: can't connect to {:s}".format(port))
+            return None
+        Logger.info("Devices: {:s} connected".format(port))
+        self.devices[port] = device
+        device.start_device(clbk=partial(self._started, port, device, clbk))
+        return device
+
+    def add(self, port, device):
+        """add : register a driver that is already connected on port"""
+        self.devices[port] = device
+
+    def remove(self, port):
+        """remove : forget device on port without disconnecting it and return its driver"""
+        return self.devices.pop(port, None)
+
+    def disconnect(self, port):
+        """disconnect : disconnect and forget device on port"""
+        device = self.devices.pop(port, None)
+        if device is not None and device.connected:
+            device.disconnect()
+            Logger.info("Devices: {:s} disconnected".format(port))
+
+    def disconnect_all(self):
+        for port in list(self.devices):
+            self.disconnect(port)
+
+    def acquire(self, method, ports=None, synchronized=False, clbk=None, **kwargs):
+        """ acquire : call a driver method (e.g. 'get_abs', 'get_spectrum') on several devices in parallel
+        method: name of the driver method, kwargs are given to it
+        ports: devices to use (all devices if None)
+        synchronized: if True, command threads wait for each other so the commands are sent together
+        clbk: function called from each command thread with clbk(port, retval)
+        Every result is also added to the timeline"""
+        ports = list(self.devices) if ports is None else list(ports)
+        barrier = None
+        if synchronized and len(ports) > 1:
+            barrier = Barrier(len(ports), timeout=self.sync_timeout)
+        for port in ports:
+            device = self.devices[port]
+            if barrier is not None:
+                device.run_in_thread(partial(self._wait_sync, barrier, port))
+            getattr(device, method)(clbk=partial(self._record, port, method, clbk), **kwargs)
+
+    def timeline_between(self, start=None, end=None):
+        """timeline_between : return timeline records with start <= timestamp <= end"""
+        with self._timeline_lock:
+            lo = 0 if start is None else bisect_left(self._timeline_times, start)
+            hi = len(self._timeline_times) if end is None else bisect_right(self._timeline_times, end)
+            return self.timeline[lo:hi]
+
+    def clear_timeline(self):
+        with self._timeline_lock:
+            del self.timeline[:]
+            del self._timeline_times[:]
+
+    def _started(self, port, device, clbk, ret):
+        ready = ret is True
+        if not ready:
+            Logger.warning("Devices: {:s} did not start ({!r})".format(port, ret))
+            if self.devices.get(port) is device:
+                del self.devices[port]
+            device.disconnect()
+        if clbk is not None:
+            clbk(port, ready)
+
+    def _wait_sync(self, barrier, port):
+        try:
+            barrier.wait()
+        except BrokenBarrierError:
+            Logger.warning("Devices: {:s} could not be synchronized, running alone".format(port))
+
+    def _record(self, port, method, clbk, value):
+        record = TimelineRecord(time(), port, method, value)
+        with self._timeline_lock:
+            # command threads finish almost in order: insertion is at (or near) the end
+            idx = bisect_right(self._timeline_times, record.timestamp)
+            self._timeline_times.insert(idx, record.timestamp)
+            self.timeline.insert(idx, record)
+            # drop a block of old records at once, not one on every insert
+            excess = len(self.timeline) - self.max_timeline
+            if excess > 0:
+                excess += self.max_timeline // 10
+                del self.timeline[:excess]
+                del self._timeline_times[:excess]
+        if clbk is not None:
+            clbk(port, value)
@@ -0,0 +1,171 @@
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from time import time
+from kivy.logger import Logger
+from lib_spectro.s250Prim_async import S250Prim
+
+# identification of a spectrometer found on a port
+DeviceInfo = namedtuple('DeviceInfo', ['port', 'model', 'rawmodel', 'firmware', 'serial_number'])
+
+
+def probe_port(port, timeout=0.5):
+    """probe_port : ask Cmd_Init, Cmd_GetType and Cmd_Firmware on port, each one with a short timeout
+    return (model, rawmodel, firmware) or None if there is no spectrometer on port"""
+    device = S250Prim()
+    if not device.connect(port):
+        return None
+    answers = {}
+    done = Event()
+
+    def init_clbk(ret):
+        # runs in the command thread: go on only if the spectrometer answered
+        if ret is True:
+            device.get_model_name(clbk=type_clbk, timeout=timeout)
+            device.get_firmware_version(clbk=firmware_clbk, timeout=timeout)
+        else:
+            done.set()
+
+    def type_clbk(ret):
+        answers['type'] = ret
+
+    def firmware_clbk(ret):
+        answers['firmware'] = ret
+        done.set()
+
+    try:
+        device.start_device(clbk=init_clbk, timeout=timeout)
+        done.wait(3 * timeout + 1.)
+    finally:
+        device.disconnect()
+    if answers.get('type') is None:
+        return None
+    model, rawmodel = answers['type']
+    return model, rawmodel, answers.get('firmware')
+
+
+class DeviceDiscovery:
+    """DeviceDiscovery : find spectrometers among serial ports
+
+    Ports are probed concurrently, so scanning several ports takes the time of one probe. Identification
+    of devices with a USB serial number is kept in a json cache: a known instrument is found again
+    without probing, whatever the port it is plugged in.
+    Only one discovery runs at a time: probing a port opens it, two probes of the same port would mix
+    their answers."""
+
+    def __init__(self, cache_path=None, probe_timeout=0.5, max_workers=8):
+        self.cache_path = cache_path
+        self.probe_timeout = probe_timeout
+        self.max_workers = max_workers
+        self._cache_lock = Lock()
+        self.cache = self.load_cache()
+        self._discover_lock = Lock()
+        self._running = False
+        # last discovery requested while one was running
+        self._pending = None
+
+    def load_cache(self):
+        """load_cache : return serial number -> identification dict from cache file"""
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            Logger.warning("Discovery: can't read device cache ({!r})".format(e))
+            return {}
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        with self._cache_lock:
+            data = dict(self.cache)
+        try:
+            with open(self.cache_path, 'w') as f:
+                json.dump(data, f, indent=1)
+        except OSError as e:
+            Logger.warning("Discovery: can't write device cache ({!r})".format(e))
+
+    def known(self, port_info):
+        """known : return the cached DeviceInfo of the device on port (PortInfo) or None"""
+        serial_number = port_info.serial_number
+        with self._cache_lock:
+            entry = self.cache.get(serial_number) if serial_number else None
+        if entry is None:
+            return None
+        return DeviceInfo(port_info.device, entry['model'], bytes.fromhex(entry['rawmodel']),
+                          entry['firmware'], serial_number)
+
+    def forget(self, serial_number):
+        """forget : remove a device from the cache (e.g. when it did not answer on connection)"""
+        with self._cache_lock:
+            removed = self.cache.pop(serial_number, None)
+        if removed is not None:
+            self.save_cache()
+
+    @property
+    def busy(self):
+        """busy : True while a discovery is running (ports may be open)"""
+        return self._running
+
+    def discover(self, ports_info, clbk, exclude=()):
+        """discover : identify spectrometers in a background thread
+        ports_info: dict port name -> PortInfo (see lib_spectro.ports_watcher)
+        clbk: called from the discovery thread with a dict port name -> DeviceInfo
+        exclude: ports that must not be opened (e.g. already connected), only found from the cache
+        A discovery requested while one is running starts when it ends (only the last request is kept).
+        return True if the discovery started now"""
+        request = dict(ports_info), clbk, set(exclude)
+        with self._discover_lock:
+            if self._running:
+                self._pending = request
+                return False
+            self._running = True
+        thread = Thread(target=self._run, args=request, daemon=True)
+        thread.name = "Discovery_Thread"
+        thread.start()
+        return True
+
+    def cancel(self):
+        """cancel : drop the discovery waiting for the current one (e.g. a port is being connected)"""
+        with self._discover_lock:
+            self._pending = None
+
+    def _run(self, *request):
+        while request is not None:
+            try:
+                self._discover(*request)
+            finally:
+                with self._discover_lock:
+                    request, self._pending = self._pending, None
+                    if request is None:
+                        self._running = False
+
+    def _discover(self, ports_info, clbk, exclude):
+        found = {}
+        to_probe = []
+        for port, info in ports_info.items():
+            device_info = self.known(info)
+            if device_info is not None:
+                found[port] = device_info
+            elif port not in exclude:
+                to_probe.append(info)
+        if to_probe:
+            Logger.info("Discovery: probing {:s}".format(str([info.device for info in to_probe])))
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_probe))) as executor:
+                results = executor.map(lambda info: probe_port(info.device, self.probe_timeout), to_probe)
+                for info, result in zip(to_probe, results):
+                    if result is None:
+                        continue
+                    model, rawmodel, firmware = result
+                    found[info.device] = DeviceInfo(info.device, model, rawmodel, firmware, info.serial_number)
+                    if info.serial_number:
+                        with self._cache_lock:
+                            self.cache[info.serial_number] = {'model': model, 'rawmodel': rawmodel.hex(),
+                                                              'firmware': firmware, 'port': info.device,
+                                                              'last_seen': time()}
+            self.save_cache()
+        Logger.info("Discovery: found {:s}".format(str({port: d.model for port, d in found.items()})))
+        clbk(found)
@@ -0,0 +1,122 @@
+from collections import namedtuple
+from math import log, sqrt, tan, pi, copysign
+from statistics import NormalDist
+from threading import Lock
+
+# linear fit y = slope * x + intercept, *_ci: half width of the confidence interval
+LinearFit = namedtuple('LinearFit', ['slope', 'intercept', 'slope_ci', 'intercept_ci', 'r2', 'n'])
+# rate constant of a kinetics model and half width of its confidence interval
+Rate = namedtuple('Rate', ['k', 'ci', 'r2', 'n'])
+
+
+def t_quantile(p, dof):
+    """t_quantile : quantile p of the Student t distribution with dof degrees of freedom
+    exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion around the normal quantile above"""
+    if dof == 1:
+        return tan(pi * (p - 0.5))
+    if dof == 2:
+        return (2. * p - 1.) / sqrt(2. * p * (1. - p))
+    z = NormalDist().inv_cdf(p)
+    z2 = z * z
+    return (z + z * (z2 + 1.) / (4. * dof)
+            + z * ((5. * z2 + 16.) * z2 + 3.) / (96. * dof ** 2)
+            + z * (((3. * z2 + 19.) * z2 + 17.) * z2 - 15.) / (384. * dof ** 3)
+            + z * ((((79. * z2 + 776.) * z2 + 1482.) * z2 - 1920.) * z2 - 945.) / (92160. * dof ** 4))
+
+
+class OnlineLinearFit:
+    """OnlineLinearFit : least squares line updated in O(1) per point
+
+    Means and centered sums of squares/products are updated as in Welford's algorithm, so long runs
+    (large x, many points) don't lose precision as raw sums of x**2 would."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.
+        self.mean_y = 0.
+        self.sxx = 0.
+        self.syy = 0.
+        self.sxy = 0.
+
+    def add(self, x, y):
+        self.n += 1
+        dx = x - self.mean_x
+        self.mean_x += dx / self.n
+        dy = y - self.mean_y
+        self.mean_y += dy / self.n
+        self.sxx += dx * (x - self.mean_x)
+        self.syy += dy * (y - self.mean_y)
+        self.sxy += dx * (y - self.mean_y)
+
+    def slope(self):
+        return self.sxy / self.sxx if self.sxx > 0 else None
+
+    def fit(self, confidence=0.95):
+        """fit : LinearFit of the points, None until there are 3 points with different x"""
+        if self.n < 3 or self.sxx <= 0:
+            return None
+        slope = self.sxy / self.sxx
+        intercept = self.mean_y - slope * self.mean_x
+        residual = max(self.syy - slope * self.sxy, 0.)
+        variance = residual / (self.n - 2)
+        t = t_quantile(0.5 + confidence / 2., self.n - 2)
+        slope_ci = t * sqrt(variance / self.sxx)
+        intercept_ci = t * sqrt(variance * (1. / self.n + self.mean_x ** 2 / self.sxx))
+        r2 = 1. - residual / self.syy if self.syy > 0 else 1.
+        return LinearFit(slope, intercept, slope_ci, intercept_ci, r2, self.n)
+
+
+class KineticsFit:
+    """KineticsFit : live rate constants of an absorbance vs time run
+
+    Every model is a line fitted in O(1) per sample (see OnlineLinearFit):
+        'zero':    A = A0 -/+ k t                  k (A/s)
+        'first':   ln|A - a_inf| = ln|A0 - a_inf| - k t     k (1/s)
+        'second':  1/|A - a_inf| = 1/|A0 - a_inf| + k t    k (1/(A.s))
+        'initial': slope dA/dt over the first initial_window seconds (A/s)
+    a_inf is the absorbance at the end of the reaction (0 when the only absorbing species is consumed).
+    Rate constants are positive when the absorbance goes towards a_inf."""
+    models = ('zero', 'first', 'second', 'initial')
+
+    def __init__(self, a_inf=0., initial_window=60.):
+        self.a_inf = a_inf
+        self.initial_window = initial_window
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.fits = {model: OnlineLinearFit() for model in self.models}
+            self.t0 = None
+            self.direction = None
+
+    def add(self, t, absorbance):
+        with self._lock:
+            if self.t0 is None:
+                self.t0 = t
+                self.direction = copysign(1., self.a_inf - absorbance)
+            self.fits['zero'].add(t, absorbance)
+            if t - self.t0 <= self.initial_window:
+                self.fits['initial'].add(t, absorbance)
+            distance = abs(absorbance - self.a_inf)
+            if distance > 0:
+                self.fits['first'].add(t, log(distance))
+                self.fits['second'].add(t, 1. / distance)
+
+    def rates(self, confidence=0.95):
+        """rates : dict model -> Rate (None while a model has less than 3 samples)"""
+        with self._lock:
+            fits = {model: fit.fit(confidence) for model, fit in self.fits.items()}
+            direction = self.direction
+        scale = {'zero': direction, 'first': -1., 'second': 1., 'initial': 1.}
+        return {model: None if fit is None else Rate(scale[model] * fit.slope, fit.slope_ci, fit.r2, fit.n)
+                for model, fit in fits.items()}
+
+    def best(self, confidence=0.95):
+        """best : (model, Rate) of the order model (zero, first or second) that fits best, or None"""
+        rates = self.rates(confidence)
+        fitted = [(rate.r2, model) for model, rate in rates.items() if rate is not None and model != 'initial']
+        if not fitted:
+            return None
+        model = max(fitted)[1]
+        return model, rates[model]
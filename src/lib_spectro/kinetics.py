@@ -0,0 +1,262 @@
+from array import array
+from functools import partial
+from threading import Lock, Timer
+from time import monotonic
+from kivy.logger import Logger
+from lib_spectro.s250Prim_async import NotConnectedError
+from lib_spectro.fitting import KineticsFit
+
+
+class RingBuffer:
+    """RingBuffer : keep the last capacity (time, value) samples in preallocated arrays"""
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        # total number of samples added (older ones are overwritten)
+        self.count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, value):
+        with self._lock:
+            idx = self.count % self.capacity
+            self.times[idx] = t
+            self.values[idx] = value
+            self.count += 1
+
+    def get(self):
+        """get : return (times, values) arrays of the samples, oldest first"""
+        with self._lock:
+            if self.count <= self.capacity:
+                return self.times[:self.count], self.values[:self.count]
+            start = self.count % self.capacity
+            return (self.times[start:] + self.times[:start],
+                    self.values[start:] + self.values[:start])
+
+    def span(self):
+        """span : return (number of samples kept, time of the oldest, time of the newest) or None if empty"""
+        with self._lock:
+            if not self.count:
+                return None
+            first = 0 if self.count <= self.capacity else self.count % self.capacity
+            return min(self.count, self.capacity), self.times[first], self.times[(self.count - 1) % self.capacity]
+
+    def last(self):
+        """last : return the last (time, value) sample or None"""
+        with self._lock:
+            if not self.count:
+                return None
+            idx = (self.count - 1) % self.capacity
+            return self.times[idx], self.values[idx]
+
+
+class KineticsChannel:
+    """KineticsChannel : samples of one wavelength
+    progress_clbk: called from the command thread with (percent, t, absorbance) for each sample
+        (see lib_spectro.delivery.ResultChannel)"""
+
+    def __init__(self, wavelength, capacity=100000, progress_clbk=None):
+        self.wavelength = wavelength
+        self.buffer = RingBuffer(capacity)
+        self.progress_clbk = progress_clbk
+        # absorbance of the blank at this wavelength, subtracted from samples
+        self.blank = 0.
+        self.errors = 0
+        # live rate constants, updated with every sample
+        self.fit = KineticsFit()
+
+    def rate(self):
+        """rate : achieved sample rate (samples/s)"""
+        span = self.buffer.span()
+        if span is None:
+            return 0.
+        n, first, last = span
+        return (n - 1) / (last - first) if last > first else 0.
+
+
+class MultiWavelengthKinetics:
+    """MultiWavelengthKinetics : kinetics on several wavelengths with one spectrometer
+
+    Each cycle sets the wavelength and reads the absorbance of every channel. Channels are visited in
+    wavelength order, alternately ascending and descending: the grating never jumps back to the first
+    wavelength, and the end channels are read twice in a row without moving. The next command is queued
+    by the callback of the previous one, so the command thread never waits for the UI.
+    Every sample gets its own timestamp (s since start) and is stored in the ring buffer of its channel.
+    A failed sample is retried after error_delay s times the number of consecutive errors, the run stops
+    after max_errors consecutive errors. A run is active from start() until done_clbk is called: a new run
+    can't start before, and the callbacks of a previous run are recognized by their run number and ignored."""
+    # consecutive failed samples stopping the run
+    max_errors = 10
+    # delay (s) before retrying after a failed sample, multiplied by the number of consecutive errors
+    error_delay = 0.2
+
+    def __init__(self, spectro, wavelengths, capacity=100000, interval=0., duration=None, done_clbk=None):
+        """spectro: driver (S250Prim)
+        wavelengths: wavelengths of the channels (nm)
+        interval: minimum time between two samples of a channel (s), 0 for the highest rate
+        duration: length of the run (s), None to run until stop()
+        done_clbk: called from the command thread when the run is finished"""
+        self.spectro = spectro
+        self.channels = [KineticsChannel(wl, capacity) for wl in sorted(set(int(wl) for wl in wavelengths))]
+        self.interval = interval
+        self.duration = duration
+        self.done_clbk = done_clbk
+        self.running = False
+        # from start() until done_clbk is called
+        self.active = False
+        self.start_time = None
+        self._position = -1
+        self._direction = 1
+        self._current_wavelength = None
+        # number of the current run, given to the callbacks of its commands
+        self._run = 0
+        self._consecutive_errors = 0
+        # pending Timer of the next sample (interval or retry delay) and lock to take it
+        self._timer = None
+        self._timer_lock = Lock()
+
+    def channel(self, wavelength):
+        """channel : return the channel of wavelength"""
+        for channel in self.channels:
+            if channel.wavelength == wavelength:
+                return channel
+        raise KeyError(wavelength)
+
+    def measure_blank(self, clbk=None):
+        """measure_blank : read the absorbance of the blank on every channel, subtracted from the samples
+        clbk: called from the command thread with the list of blanks when done"""
+        last = len(self.channels) - 1
+        for idx, channel in enumerate(self.channels):
+            self._set_wavelength(channel.wavelength)
+            self.spectro.get_abs(clbk=partial(self._blank_measured, channel, clbk if idx == last else None))
+
+    def start(self):
+        """start : start the run (channels samples are cleared)
+        return False if the previous run is not finished yet (done_clbk not called)"""
+        if self.active:
+            return False
+        for channel in self.channels:
+            channel.buffer = RingBuffer(channel.buffer.capacity)
+            channel.fit.reset()
+            channel.errors = 0
+        self._position = -1
+        self._direction = 1
+        self._consecutive_errors = 0
+        self._run += 1
+        self.active = True
+        self.running = True
+        self.start_time = monotonic()
+        Logger.info("Kinetics: starting on {:s} nm".format(str([c.wavelength for c in self.channels])))
+        self._measure(self._run, self._next_channel())
+        return True
+
+    def stop(self):
+        """stop : stop after the sample in progress, or now if the run waits for its next sample"""
+        self.running = False
+        with self._timer_lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            # no command in progress: nothing else would end the run
+            timer.cancel()
+            self._finish()
+
+    def elapsed(self):
+        return 0. if self.start_time is None else monotonic() - self.start_time
+
+    def _next_channel(self):
+        n = len(self.channels)
+        if n == 1:
+            return 0
+        idx = self._position + self._direction
+        if idx < 0 or idx >= n:
+            # turn back on the end channel: it is read again without moving the grating
+            self._direction = -self._direction
+            idx = self._position
+        self._position = idx
+        return idx
+
+    def _set_wavelength(self, wavelength):
+        if wavelength != self._current_wavelength:
+            self._current_wavelength = wavelength
+            self.spectro.set_abs_wavelength(wavelength, clbk=self._wavelength_set)
+
+    def _wavelength_set(self, ret):
+        if not ret:
+            Logger.warning("Kinetics: wavelength not set")
+            # force a new setting on next sample
+            self._current_wavelength = None
+
+    def _measure(self, run, idx, wait=0.):
+        channel = self.channels[idx]
+        if self.interval:
+            last = channel.buffer.last()
+            if last is not None:
+                wait = max(wait, self.interval - (self.elapsed() - last[0]))
+        if wait > 0:
+            with self._timer_lock:
+                self._timer = Timer(wait, self._timer_fired, args=(run, idx))
+                self._timer.start()
+            return
+        self._queue_measure(run, idx)
+
+    def _timer_fired(self, run, idx):
+        with self._timer_lock:
+            if self._timer is None:
+                # cancelled by stop(), which ends the run
+                return
+            self._timer = None
+        self._queue_measure(run, idx)
+
+    def _queue_measure(self, run, idx):
+        channel = self.channels[idx]
+        try:
+            self._set_wavelength(channel.wavelength)
+            self.spectro.get_abs(clbk=partial(self._sample, run, idx))
+        except NotConnectedError:
+            self._sample(run, idx, None)
+
+    def _blank_measured(self, channel, clbk, value):
+        if value is not None:
+            channel.blank = value
+        if clbk is not None:
+            clbk([c.blank for c in self.channels])
+
+    def _sample(self, run, idx, value):
+        if run != self._run:
+            # late callback of a previous run
+            return
+        channel = self.channels[idx]
+        t = self.elapsed()
+        wait = 0.
+        if value is None or self._current_wavelength is None:
+            channel.errors += 1
+            self._consecutive_errors += 1
+            wait = self.error_delay * self._consecutive_errors
+            if self._consecutive_errors >= self.max_errors:
+                Logger.warning("Kinetics: {:d} errors in a row, stopping".format(self._consecutive_errors))
+                self.running = False
+        else:
+            self._consecutive_errors = 0
+            absorbance = value - channel.blank
+            channel.buffer.append(t, absorbance)
+            channel.fit.add(t, absorbance)
+            if channel.progress_clbk is not None:
+                percent = min(round(t / self.duration * 100), 100) if self.duration else 0
+                channel.progress_clbk((percent, t, absorbance))
+        if self.duration is not None and t >= self.duration:
+            self.running = False
+        if not self.running or not self.spectro.connected:
+            self._finish()
+            return
+        self._measure(run, self._next_channel(), wait)
+
+    def _finish(self):
+        self.running = False
+        Logger.info("Kinetics: run finished after {:.1f} s".format(self.elapsed()))
+        self.active = False
+        if self.done_clbk is not None:
+            self.done_clbk()
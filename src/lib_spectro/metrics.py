@@ -0,0 +1,91 @@
+from bisect import bisect_left
+
+# upper bounds (s) of the duration histograms buckets, the last bucket is unbounded
+Duration_Buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.,
+                    120., 300.)
+# stages of a command (see CommandThread): time in the queue, writing the message, waiting for the first byte
+# of the answer, reading the rest, decoding it and running the callbacks, and total time from the queue to the
+# end of the callback
+Stages = ('queue', 'send', 'think', 'receive', 'decode', 'callback', 'total')
+# counters of a command
+Counters = ('commands', 'bytes_out', 'bytes_in', 'timeouts', 'short_reads', 'transport_errors')
+
+
+class Histogram:
+    """Histogram : count of values in fixed buckets, with their sum and max (as Prometheus histograms)"""
+
+    def __init__(self, bounds=Duration_Buckets):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """quantile : estimate of the quantile q, interpolated in its bucket (None if empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for k, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[k - 1] if k else 0.
+                upper = self.bounds[k] if k < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+    def snapshot(self):
+        """snapshot : dict count, sum, max, mean, p50, p95, p99 and buckets [(upper bound, cumulative count)],
+        the last bound being inf"""
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                'buckets': buckets}
+
+
+class CommandMetrics:
+    """CommandMetrics : duration histograms of the stages and counters of each command of a driver
+
+    Updated by the command thread only, read from any thread with snapshot(). There is no lock: the command
+    thread never waits for a reader, and a snapshot taken during an update may be off by the sample being
+    added (e.g. count and sum of a histogram), which monitoring tolerates."""
+
+    def __init__(self):
+        self._commands = {}
+
+    def _get(self, command):
+        entry = self._commands.get(command)
+        if entry is None:
+            entry = self._commands[command] = ({stage: Histogram() for stage in Stages},
+                                               dict.fromkeys(Counters, 0))
+        return entry
+
+    def observe(self, command, stage, duration):
+        """observe : add a duration (s) of a stage of command"""
+        self._get(command)[0][stage].observe(duration)
+
+    def count(self, command, counter, n=1):
+        self._get(command)[1][counter] += n
+
+    def reset(self):
+        self._commands = {}
+
+    def snapshot(self):
+        """snapshot : {command: {'stages': {stage: Histogram.snapshot()}, 'counters': {counter: value}}}"""
+        # list() copies the items at once, the command thread may add a command meanwhile
+        return {command: {'stages': {stage: histogram.snapshot() for stage, histogram in list(stages.items())},
+                          'counters': dict(counters)}
+                for command, (stages, counters) in list(self._commands.items())}
@@ -0,0 +1,318 @@
+from collections import namedtuple
+import numpy as np
+
+# peaks found in spectra, each field is an array with one item per peak
+#   spectrum: row of the spectrum in values (0 for a single spectrum), index: index of the highest point
+#   wavelength: sub-nm position of the maximum (parabola through the 3 highest points), height: value there
+#   prominence: height above the highest of the two bases (lowest points before a higher point on each side)
+#   left, right, width: wavelengths where the peak crosses half its prominence (linear interpolation)
+#   centroid: centroid of the part of the peak above half prominence
+Peaks = namedtuple('Peaks', ['spectrum', 'index', 'wavelength', 'height', 'prominence', 'width', 'left', 'right',
+                             'centroid'])
+
+
+def no_peaks():
+    return Peaks(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), *(np.empty(0) for _ in range(7)))
+
+
+def concatenate_peaks(peaks_list):
+    """concatenate_peaks : merge Peaks, sorted by spectrum and index"""
+    peaks_list = [peaks for peaks in peaks_list if len(peaks.index)]
+    if not peaks_list:
+        return no_peaks()
+    merged = Peaks(*(np.concatenate(field) for field in zip(*peaks_list)))
+    order = np.lexsort((merged.index, merged.spectrum))
+    return Peaks(*(field[order] for field in merged))
+
+
+def local_maxima(values):
+    """local_maxima : (rows, cols) of the local maxima of 2D values along the last axis
+    A plateau counts as one maximum at its first point. A point is decided only when a lower or higher point
+    follows it, so the end points and a trailing plateau are never maxima.
+    return rows, cols and the index of the last decided point of each row (-1 if none)"""
+    diff = np.sign(np.diff(values, axis=-1))
+    m, n = values.shape
+    steps = np.arange(n - 1)
+    # first non zero slope at or after each point (0 if the row is flat until its end)
+    position = np.where(diff != 0, steps, n - 1)
+    position = np.minimum.accumulate(position[:, ::-1], axis=-1)[:, ::-1]
+    next_slope = np.take_along_axis(np.concatenate((diff, np.zeros((m, 1))), axis=-1), position, axis=-1)
+    rows, cols = np.nonzero((diff[:, :-1] > 0) & (next_slope[:, 1:] < 0))
+    last_decided = np.where(diff != 0, steps, -1).max(axis=-1)
+    return rows, cols + 1, last_decided
+
+
+def range_table(values, reduce):
+    """range_table : sparse table of 2D values along the last axis, levels[k][:, i] = reduce of
+    values[:, i:i + 2 ** k] (reduce is np.maximum or np.minimum)"""
+    levels = [values]
+    size = 1
+    while 2 * size <= values.shape[-1]:
+        previous = levels[-1]
+        levels.append(reduce(previous[:, :-size], previous[:, size:]))
+        size *= 2
+    return levels
+
+
+def nearest(table, rows, cols, threshold, left, below=False):
+    """nearest : for each (rows, cols) point, index of the nearest point on its left (or right) higher than
+    threshold - lower or equal if below - or -1 (the row length) if there is none
+    table: range_table of np.maximum, or of np.minimum if below
+    The search extends a range that has no such point by halving steps, so it takes log2(row length)
+    vectorized steps whatever the distance."""
+    n = table[0].shape[-1]
+    if len(cols) * n <= 4096:
+        # few points: comparing with the whole rows is cheaper
+        rows_values = table[0][rows]
+        hit = rows_values <= threshold[:, None] if below else rows_values > threshold[:, None]
+        if left:
+            hit &= np.arange(n) < cols[:, None]
+            return np.where(hit.any(axis=-1), n - 1 - np.argmax(hit[:, ::-1], axis=-1), -1)
+        hit &= np.arange(n) > cols[:, None]
+        return np.where(hit.any(axis=-1), np.argmax(hit, axis=-1), n)
+    pos = np.array(cols, dtype=np.intp) + (0 if left else 1)
+    for k in range(len(table) - 1, -1, -1):
+        size = 1 << k
+        if left:
+            start = pos - size
+            extend = start >= 0
+        else:
+            start = pos
+            extend = pos + size <= n
+        reduced = table[k][rows, np.where(extend, start, 0)]
+        extend &= reduced > threshold if below else reduced <= threshold
+        pos = np.where(extend, pos - size if left else pos + size, pos)
+    return pos - 1 if left else pos
+
+
+def range_min(values, rows, start, stop):
+    """range_min : minimum of values[rows, start:stop] for each item (ranges must not be empty)"""
+    if not len(rows):
+        return np.empty(0)
+    n = values.shape[-1]
+    flat = np.append(values.ravel(), np.inf)
+    bounds = np.empty(2 * len(rows), dtype=np.intp)
+    bounds[0::2] = rows * n + start
+    bounds[1::2] = rows * n + stop
+    return np.minimum.reduceat(flat, bounds)[0::2]
+
+
+def peak_properties(wavelengths, values, rows, cols, left_higher, right_higher, min_prominence=0., min_width=0.):
+    """peak_properties : Peaks of the maxima at (rows, cols) of 2D values
+    left_higher, right_higher: nearest higher points on each side (see nearest)"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    n = values.shape[-1]
+    heights = values[rows, cols]
+    bases = np.maximum(range_min(values, rows, left_higher + 1, cols + 1),
+                       range_min(values, rows, cols, right_higher))
+    prominences = heights - bases
+    keep = prominences >= min_prominence
+    rows, cols, heights, prominences = rows[keep], cols[keep], heights[keep], prominences[keep]
+    left_higher, right_higher = left_higher[keep], right_higher[keep]
+    if not len(cols):
+        return no_peaks()
+    # half prominence crossings, a point lower than the line exists on both sides before a higher point
+    line = heights - prominences / 2.
+    minima = range_table(values, np.minimum)
+    left = nearest(minima, rows, cols, line, left=True, below=True)
+    right = nearest(minima, rows, cols, line, left=False, below=True)
+    y_left, y_right = values[rows, left], values[rows, right]
+    left_pos = left + (line - y_left) / (values[rows, left + 1] - y_left)
+    right_pos = right - (line - y_right) / (values[rows, right - 1] - y_right)
+    points = np.arange(n)
+    left_wl = np.interp(left_pos, points, wavelengths)
+    right_wl = np.interp(right_pos, points, wavelengths)
+    widths = right_wl - left_wl
+    keep = widths >= min_width
+    if not keep.all():
+        rows, cols, heights, prominences, line = rows[keep], cols[keep], heights[keep], prominences[keep], line[keep]
+        left, right, left_wl, right_wl, widths = left[keep], right[keep], left_wl[keep], right_wl[keep], widths[keep]
+    # vertex of the parabola through the highest point and its neighbours
+    y_before, y_after = values[rows, cols - 1], values[rows, cols + 1]
+    curvature = y_before - 2. * heights + y_after
+    offset = np.where(curvature < 0, 0.5 * (y_before - y_after) / np.where(curvature < 0, curvature, -1.), 0.)
+    vertex = np.interp(cols + offset, points, wavelengths)
+    vertex_height = heights - 0.25 * (y_before - y_after) * offset
+    # centroid of the points above the half prominence line, from prefix sums
+    zero = np.zeros((len(values), 1))
+    sum_y = np.concatenate((zero, np.cumsum(values, axis=-1)), axis=-1)
+    sum_wy = np.concatenate((zero, np.cumsum(values * wavelengths, axis=-1)), axis=-1)
+    sum_wl = np.concatenate(([0.], np.cumsum(wavelengths)))
+    count = right - left - 1
+    weight = sum_y[rows, right] - sum_y[rows, left + 1] - line * count
+    moment = sum_wy[rows, right] - sum_wy[rows, left + 1] - line * (sum_wl[right] - sum_wl[left + 1])
+    centroid = moment / weight
+    return Peaks(rows, cols, vertex, vertex_height, prominences, widths, left_wl, right_wl, centroid)
+
+
+def find_peaks(wavelengths, values, min_prominence=0.01, min_width=0., min_height=None, block=256):
+    """find_peaks : peaks of a spectrum, or of every row of a 2D values (e.g. an archive resampled on a common
+    grid, see lib_spectro.processing.resample) in one pass
+    min_prominence: minimum prominence (absorbance), min_width: minimum width at half prominence (nm)
+    block: number of spectra processed together (memory use)"""
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    if values.shape[-1] < 3:
+        return no_peaks()
+    rows, cols, _ = local_maxima(values)
+    if min_height is not None:
+        keep = values[rows, cols] >= min_height
+        rows, cols = rows[keep], cols[keep]
+    found = []
+    for start in range(0, len(values), block):
+        lo, hi = np.searchsorted(rows, (start, start + block))
+        part = values[start:start + block]
+        part_rows, part_cols = rows[lo:hi] - start, cols[lo:hi]
+        heights = part[part_rows, part_cols]
+        maxima = range_table(part, np.maximum)
+        left_higher = nearest(maxima, part_rows, part_cols, heights, left=True)
+        right_higher = nearest(maxima, part_rows, part_cols, heights, left=False)
+        peaks = peak_properties(wavelengths, part, part_rows, part_cols, left_higher, right_higher,
+                                min_prominence, min_width)
+        found.append(peaks._replace(spectrum=peaks.spectrum + start))
+    return concatenate_peaks(found)
+
+
+def lambda_max(peaks):
+    """lambda_max : wavelength of the most prominent peak, None if there is no peak"""
+    if not len(peaks.index):
+        return None
+    return float(peaks.wavelength[np.argmax(peaks.prominence)])
+
+
+class PeakTracker:
+    """PeakTracker : peaks of a spectrum updated as chunks of a live scan arrive
+
+    Each chunk only looks for new maxima among its points. A maximum is dropped as soon as its left side shows
+    it can't reach min_prominence; the other ones stay open until a higher point is scanned on their right,
+    then their properties are final. peaks() gives the final peaks and the open ones measured as if the scan
+    ended now; once the scan is over, finish() gives the same peaks as find_peaks on the whole spectrum."""
+
+    def __init__(self, min_prominence=0.01, min_width=0., capacity=2048):
+        self.min_prominence = min_prominence
+        self.min_width = min_width
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self.wavelengths = np.empty(self.capacity)
+        self.values = np.empty((1, self.capacity))
+        self.n = 0
+        # points before checked are decided (maximum or not)
+        self._checked = 1
+        # points before ridge_end higher than all the next ones before ridge_end (decreasing values): the
+        # nearest higher point on the left of a later point is among them, or after ridge_end
+        self._ridge = np.empty(0, dtype=np.intp)
+        self._ridge_end = 0
+        # open maxima (index) and their nearest higher point on the left
+        self._open = np.empty(0, dtype=np.intp)
+        self._open_left = np.empty(0, dtype=np.intp)
+        self._final = []
+        self._peaks = None
+
+    def feed(self, wavelengths, values):
+        """feed : add a chunk of the scan"""
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        self._peaks = None
+        start, self.n = self.n, self.n + len(values)
+        if self.n > self.wavelengths.shape[0]:
+            size = max(2 * self.wavelengths.shape[0], self.n)
+            self.wavelengths = np.concatenate((self.wavelengths[:start], np.empty(size - start)))
+            self.values = np.concatenate((self.values[:, :start], np.empty((1, size - start))), axis=-1)
+        self.wavelengths[start:self.n] = wavelengths
+        self.values[0, start:self.n] = values
+        if self.n >= 3:
+            self._close(start)
+            self._find_maxima()
+
+    def peaks(self):
+        """peaks : final peaks and open ones measured up to the last point received"""
+        if self._peaks is None:
+            self._final = [concatenate_peaks(self._final)]
+            self._peaks = concatenate_peaks(self._final + [self._measure(self._open, self._open_left,
+                                                                         np.full(len(self._open), self.n))])
+        return self._peaks
+
+    def finish(self):
+        """finish : end of the scan, return the peaks"""
+        peaks = self.peaks()
+        self._final = [peaks]
+        self._open = self._open[:0]
+        self._open_left = self._open_left[:0]
+        return peaks
+
+    def lambda_max(self):
+        return lambda_max(self.peaks())
+
+    def _measure(self, cols, left_higher, right_higher):
+        """properties of maxima, on the part of the scan between their nearest higher points only"""
+        if not len(cols):
+            return no_peaks()
+        lo, hi = left_higher.min() + 1, right_higher.max()
+        peaks = peak_properties(self.wavelengths[lo:hi], self.values[:, lo:hi], np.zeros(len(cols), dtype=np.intp),
+                                cols - lo, left_higher - lo, right_higher - lo, self.min_prominence, self.min_width)
+        return peaks._replace(index=peaks.index + lo)
+
+    def _close(self, start):
+        """close the open maxima that have a higher point in the new points"""
+        if not len(self._open):
+            return
+        values = self.values[:, :self.n]
+        rows = np.zeros(len(self._open), dtype=np.intp)
+        heights = values[0, self._open]
+        # only the new points are compared, the previous ones are all lower
+        lo = max(start, 1)
+        maxima = range_table(values[:, lo:], np.maximum)
+        right_higher = nearest(maxima, rows, np.maximum(self._open - lo, -1), heights, left=False) + lo
+        closed = right_higher < self.n
+        if closed.any():
+            self._final.append(self._measure(self._open[closed], self._open_left[closed], right_higher[closed]))
+            self._open, self._open_left = self._open[~closed], self._open_left[~closed]
+
+    def _find_maxima(self):
+        """look for maxima among the points that are now decided
+        only the points after the ridge are searched, the ridge gives the higher points before them"""
+        lo = self._checked - 1
+        _, cols, last_decided = local_maxima(self.values[:, lo:self.n])
+        checked = max(self._checked, lo + last_decided[0] + 1)
+        if len(cols):
+            self._new_maxima(cols + lo)
+        self._extend_ridge(checked)
+        self._checked = checked
+
+    def _new_maxima(self, cols):
+        # maxima are after the ridge: searches run on the points from ridge_end
+        tail_start = self._ridge_end
+        tail = self.values[:, tail_start:self.n]
+        rows = np.zeros(len(cols), dtype=np.intp)
+        heights = tail[0, cols - tail_start]
+        maxima = range_table(tail, np.maximum)
+        left_higher = nearest(maxima, rows, cols - tail_start, heights, left=True)
+        # none in the tail: last point of the ridge higher than the maximum
+        ridge = self._ridge
+        count = np.searchsorted(-self.values[0, ridge], -heights, side='left')
+        left_higher = np.where(left_higher >= 0, left_higher + tail_start, np.append(-1, ridge)[count])
+        # the prominence can't be larger than the height above the left base
+        base = left_higher.min() + 1
+        keep = heights - range_min(self.values[:, base:self.n], rows, left_higher + 1 - base,
+                                   cols + 1 - base) >= self.min_prominence
+        cols, left_higher, rows, heights = cols[keep], left_higher[keep], rows[keep], heights[keep]
+        right_higher = nearest(maxima, rows, cols - tail_start, heights, left=False) + tail_start
+        closed = right_higher < self.n
+        if closed.any():
+            self._final.append(self._measure(cols[closed], left_higher[closed], right_higher[closed]))
+        self._open = np.concatenate((self._open, cols[~closed]))
+        self._open_left = np.concatenate((self._open_left, left_higher[~closed]))
+
+    def _extend_ridge(self, end):
+        """add the points up to end to the ridge"""
+        if end <= self._ridge_end:
+            return
+        new = self.values[0, self._ridge_end:end]
+        # highest of the next new points (-inf for the last one)
+        next_max = np.append(np.maximum.accumulate(new[::-1])[::-1][1:], -np.inf)
+        ridge = self._ridge[self.values[0, self._ridge] > new.max()]
+        self._ridge = np.concatenate((ridge, self._ridge_end + np.flatnonzero(new > next_max)))
+        self._ridge_end = end
@@ -0,0 +1,105 @@
+import os
+from collections import namedtuple
+from threading import Thread, Event, Lock
+from kivy.utils import platform
+from kivy.logger import Logger
+
+if platform == 'android':
+    from usb4a import usb
+else:
+    from serial.tools import list_ports
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+# metadata of a serial port (None when unknown)
+PortInfo = namedtuple('PortInfo', ['device', 'description', 'hwid', 'vid', 'pid', 'serial_number', 'manufacturer'])
+
+
+def scan_serial_ports():
+    """scan_serial_ports : return a dict port name -> PortInfo (slow: scans sysfs/registry or usb devices)"""
+    if platform == 'android':
+        ports = {}
+        for device in usb.get_usb_device_list():
+            name = device.getDeviceName()
+            ports[name] = PortInfo(name, device.getProductName(), None, device.getVendorId(),
+                                   device.getProductId(), None, device.getManufacturerName())
+        return ports
+    return {p.device: PortInfo(p.device, p.description, p.hwid, p.vid, p.pid, p.serial_number, p.manufacturer)
+            for p in list_ports.comports()}
+
+
+class SerialPortWatcher(Thread):
+    """SerialPortWatcher : watch serial ports from a background thread
+
+    Ports are scanned only when something changes: udev tty events when pyudev is available, otherwise
+    changes of /dev. Without /dev (windows, android) ports are scanned every poll_interval. In every case
+    clbk(ports) is called (from the watcher thread) only when the ports or their metadata changed,
+    ports being a dict port name -> PortInfo."""
+
+    def __init__(self, clbk, poll_interval=0.5):
+        super().__init__(daemon=True)
+        self.name = "Port_Watcher"
+        self.clbk = clbk
+        self.poll_interval = poll_interval
+        self.ports = {}
+        self._stop_event = Event()
+        # held while clbk is called, so that clbk is never called once stop() returned
+        self._clbk_lock = Lock()
+
+    def stop(self):
+        """stop : ask the thread to stop - returns without waiting for a scan in progress, whose result is dropped"""
+        self._stop_event.set()
+        with self._clbk_lock:
+            pass
+
+    def run(self):
+        Logger.info("Serial: starting port watcher")
+        self.rescan()
+        if pyudev is not None and platform == 'linux':
+            self._watch_udev()
+        elif os.path.isdir('/dev') and platform != 'android':
+            self._watch_dev()
+        else:
+            while not self._stop_event.wait(self.poll_interval):
+                self.rescan()
+        Logger.info("Serial: port watcher stopped")
+
+    def rescan(self):
+        """rescan : scan ports now and report if they changed"""
+        try:
+            ports = scan_serial_ports()
+        except Exception as e:
+            Logger.warning("Serial: port scan failed ({!r})".format(e))
+            return
+        with self._clbk_lock:
+            if ports != self.ports and not self._stop_event.is_set():
+                self.ports = ports
+                Logger.info("Serial ports: found {:s}".format(str(sorted(ports))))
+                self.clbk(ports)
+
+    def _watch_udev(self):
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by('tty')
+        monitor.start()
+        while not self._stop_event.is_set():
+            # poll timeout only bounds the time needed to notice stop()
+            if monitor.poll(timeout=self.poll_interval) is not None:
+                self.rescan()
+
+    def _watch_dev(self):
+        # the mtime of /dev changes whenever a device node is created or removed
+        last_mtime = self._dev_mtime()
+        while not self._stop_event.wait(self.poll_interval):
+            mtime = self._dev_mtime()
+            if mtime != last_mtime:
+                last_mtime = mtime
+                self.rescan()
+
+    @staticmethod
+    def _dev_mtime():
+        try:
+            return os.stat('/dev').st_mtime_ns
+        except OSError:
+            return None
@@ -0,0 +1,357 @@
+from math import factorial
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Spectra are (wavelengths, values): wavelengths is a 1D ascending array, values has the wavelengths on its last
+# axis, so a 2D array processes one spectrum per row at once. Smoothing and derivatives expect evenly spaced
+# wavelengths (as scanned by the spectrometer).
+
+
+def savgol_coefficients(window, order, deriv=0):
+    """savgol_coefficients : Savitzky-Golay matrix for a window of odd length
+    return a (window, window) array: row k gives the filtered value (or derivative, for a unit spacing) at
+    position k of the window - row window // 2 is the convolution kernel, other rows are used at the edges"""
+    half = window // 2
+    x = np.arange(-half, half + 1, dtype=float)
+    # least squares polynomial coefficients from the window values
+    fit = np.linalg.pinv(np.vander(x, order + 1, increasing=True))
+    powers = np.arange(deriv, order + 1)
+    scale = np.array([factorial(p) / factorial(p - deriv) for p in powers])
+    return (x[:, None] ** (powers - deriv) * scale) @ fit[deriv:]
+
+
+def _window_size(window, order, n):
+    """largest odd window <= window that fits n points and a polynomial of order"""
+    window = min(window, n if n % 2 else n - 1)
+    if window <= order:
+        raise ValueError("{:d} points are not enough for a polynomial of order {:d}".format(n, order))
+    return window
+
+
+def savgol_filter(values, window=11, order=2, deriv=0, delta=1.):
+    """savgol_filter : Savitzky-Golay smoothing (deriv=0) or derivative of values along the last axis
+    delta: wavelength step, derivatives are per wavelength unit
+    Edges are fitted on the first and last windows, so the result has the shape of values."""
+    values = np.asarray(values, dtype=float)
+    n = values.shape[-1]
+    window = _window_size(window, order, n)
+    half = window // 2
+    matrix = savgol_coefficients(window, order, deriv) / delta ** deriv
+    result = np.empty_like(values)
+    result[..., half:n - half] = sliding_window_view(values, window, axis=-1) @ matrix[half]
+    result[..., :half] = values[..., :window] @ matrix[:half].T
+    result[..., n - half:] = values[..., n - window:] @ matrix[half + 1:].T
+    return result
+
+
+def derivative(wavelengths, values, deriv=1, window=11, order=3):
+    """derivative : first or second derivative (per nm) of spectra, Savitzky-Golay smoothed"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    return savgol_filter(values, window, order, deriv, wavelengths[1] - wavelengths[0])
+
+
+def transmittance(values):
+    """transmittance : %T from absorbance"""
+    return 100. * np.power(10., -np.asarray(values, dtype=float))
+
+
+def absorbance(values):
+    """absorbance : absorbance from %T"""
+    return 2. - np.log10(np.asarray(values, dtype=float))
+
+
+def interpolation_weights(wavelengths, grid):
+    """interpolation_weights : indexes and weights interpolating points at wavelengths onto grid
+    return (index, weight, inside): value on grid = v[index] * (1 - weight) + v[index + 1] * weight"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    if len(wavelengths) < 2:
+        raise ValueError("at least 2 points are needed to resample")
+    index = np.clip(np.searchsorted(wavelengths, grid, side='right') - 1, 0, len(wavelengths) - 2)
+    weight = (grid - wavelengths[index]) / (wavelengths[index + 1] - wavelengths[index])
+    inside = (grid >= wavelengths[0]) & (grid <= wavelengths[-1])
+    return index, weight, inside
+
+
+def resample(wavelengths, values, grid):
+    """resample : linear interpolation of spectra onto the wavelengths of grid (nan outside the scanned range)"""
+    values = np.asarray(values, dtype=float)
+    index, weight, inside = interpolation_weights(wavelengths, grid)
+    result = values[..., index] * (1. - weight) + values[..., index + 1] * weight
+    result[..., ~inside] = np.nan
+    return result
+
+
+def baseline_mask(wavelengths, regions=None):
+    """baseline_mask : points of wavelengths inside regions ([(wllo, wlhi), ...], all points if None)"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    if regions is None:
+        return np.ones(wavelengths.shape, dtype=bool)
+    mask = np.zeros(wavelengths.shape, dtype=bool)
+    for wllo, wlhi in regions:
+        mask |= (wavelengths >= wllo) & (wavelengths <= wlhi)
+    return mask
+
+
+def polynomial_baseline(wavelengths, values, degree=1, regions=None):
+    """polynomial_baseline : polynomial fitted on the points of regions (where the sample does not absorb),
+    evaluated on every wavelength - all spectra of a 2D values are fitted with one least squares solve"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    values = np.asarray(values, dtype=float)
+    mask = baseline_mask(wavelengths, regions)
+    if np.count_nonzero(mask) <= degree:
+        raise ValueError("not enough points in baseline regions for degree {:d}".format(degree))
+    # centered and scaled wavelengths keep the Vandermonde matrix well conditioned
+    center = wavelengths.mean()
+    span = max(np.ptp(wavelengths) / 2., 1.)
+    vander = np.vander((wavelengths - center) / span, degree + 1)
+    coefficients = np.linalg.lstsq(vander[mask], values[..., mask].reshape(-1, np.count_nonzero(mask)).T,
+                                   rcond=None)[0]
+    return (vander @ coefficients).T.reshape(values.shape)
+
+
+def _empty(values):
+    """empty (wavelengths, values) with the leading shape of values"""
+    return np.empty(0), np.empty(np.shape(values)[:-1] + (0,))
+
+
+class Step:
+    """Step : one processing of spectra
+
+    A step processes whole spectra (__call__) or the chunks of a live scan: feed returns the points that can
+    be computed from the chunks received so far and flush the remaining ones once the scan is over.
+    Both return (wavelengths, values) numpy arrays."""
+
+    def __call__(self, wavelengths, values):
+        raise NotImplementedError
+
+    def reset(self):
+        """reset : forget the chunks of the previous scan"""
+
+    def feed(self, wavelengths, values):
+        return self(wavelengths, values)
+
+    def flush(self):
+        return None
+
+
+class Transmittance(Step):
+    """Transmittance : absorbance to %T"""
+
+    def __call__(self, wavelengths, values):
+        return np.asarray(wavelengths, dtype=float), transmittance(values)
+
+
+class SubtractReference(Step):
+    """SubtractReference : subtract a reference spectrum (e.g. blank scan) interpolated on the wavelengths"""
+
+    def __init__(self, wavelengths, values):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+
+    def __call__(self, wavelengths, values):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        return wavelengths, np.asarray(values, dtype=float) - np.interp(wavelengths, self.wavelengths, self.values)
+
+
+class PolynomialBaseline(Step):
+    """PolynomialBaseline : subtract a polynomial fitted on baseline regions
+    The fit needs the whole spectrum: when fed by chunks, the corrected spectrum is returned by flush."""
+
+    def __init__(self, degree=1, regions=None):
+        self.degree = degree
+        self.regions = regions
+        self.reset()
+
+    def __call__(self, wavelengths, values):
+        values = np.asarray(values, dtype=float)
+        return (np.asarray(wavelengths, dtype=float),
+                values - polynomial_baseline(wavelengths, values, self.degree, self.regions))
+
+    def reset(self):
+        self._chunks = []
+
+    def feed(self, wavelengths, values):
+        self._chunks.append((np.asarray(wavelengths, dtype=float), np.asarray(values, dtype=float)))
+        return _empty(values)
+
+    def flush(self):
+        if not self._chunks:
+            return None
+        chunks, self._chunks = self._chunks, []
+        return self(np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks], axis=-1))
+
+
+class SavitzkyGolay(Step):
+    """SavitzkyGolay : smoothing (deriv=0) or derivative (deriv=1, 2) per nm
+    When fed by chunks, a point is returned as soon as the window // 2 following points are received."""
+
+    def __init__(self, window=11, order=2, deriv=0):
+        if window % 2 == 0 or window <= order:
+            raise ValueError("window must be odd and larger than order")
+        self.window = window
+        self.order = order
+        self.deriv = deriv
+        self.matrix = savgol_coefficients(window, order, deriv)
+        self.reset()
+
+    def __call__(self, wavelengths, values):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        delta = wavelengths[1] - wavelengths[0] if len(wavelengths) > 1 else 1.
+        return wavelengths, savgol_filter(values, self.window, self.order, self.deriv, delta)
+
+    def reset(self):
+        self._wl = np.empty(0)
+        self._values = None
+        # stream index of the first buffered point and of the next point to compute
+        self._start = 0
+        self._next = 0
+
+    def feed(self, wavelengths, values):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if self._values is None:
+            self._values = values
+        else:
+            self._values = np.concatenate((self._values, values), axis=-1)
+        self._wl = np.concatenate((self._wl, wavelengths))
+        half = self.window // 2
+        end = self._start + len(self._wl)
+        if self._next == 0 and len(self._wl) < self.window:
+            return _empty(values)
+        scale = (self._wl[1] - self._wl[0]) ** self.deriv
+        out_wl, out_values = [], []
+        if self._next == 0:
+            out_wl.append(self._wl[:half])
+            out_values.append(self._values[..., :self.window] @ self.matrix[:half].T / scale)
+            self._next = half
+        if end - half > self._next:
+            lo = self._next - self._start
+            out_wl.append(self._wl[lo:end - half - self._start])
+            out_values.append(sliding_window_view(self._values[..., lo - half:], self.window, axis=-1)
+                              @ self.matrix[half] / scale)
+            self._next = end - half
+        # keep the last full window for the edge computed by flush
+        drop = self._next - half - 1 - self._start
+        if drop > 0:
+            self._wl = self._wl[drop:]
+            self._values = self._values[..., drop:]
+            self._start += drop
+        return np.concatenate(out_wl), np.concatenate(out_values, axis=-1)
+
+    def flush(self):
+        if self._values is None:
+            return None
+        if self._next == 0:
+            # scan shorter than the window
+            result = self(self._wl, self._values)
+        else:
+            half = self.window // 2
+            scale = (self._wl[1] - self._wl[0]) ** self.deriv
+            result = self._wl[-half:], self._values[..., -self.window:] @ self.matrix[half + 1:].T / scale
+        self.reset()
+        return result
+
+
+class Resample(Step):
+    """Resample : linear interpolation onto grid wavelengths (nan outside the scanned range)
+    When fed by chunks, grid points are returned as soon as the scan went past them."""
+
+    def __init__(self, grid):
+        self.grid = np.asarray(grid, dtype=float)
+        self.reset()
+
+    def __call__(self, wavelengths, values):
+        return self.grid, resample(wavelengths, values, self.grid)
+
+    def reset(self):
+        self._last = None
+        self._next = 0
+
+    def feed(self, wavelengths, values):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if self._last is not None:
+            # last point of the previous chunk brackets the first grid points of this one
+            wavelengths = np.concatenate((self._last[0], wavelengths))
+            values = np.concatenate((self._last[1], values), axis=-1)
+        if len(wavelengths) == 0:
+            return _empty(values)
+        self._last = wavelengths[-1:], values[..., -1:]
+        stop = np.searchsorted(self.grid, wavelengths[-1], side='right')
+        grid = self.grid[self._next:stop]
+        self._next = stop
+        if len(wavelengths) < 2:
+            result = np.full(values.shape[:-1] + grid.shape, np.nan)
+            result[..., grid == wavelengths[0]] = values[..., :1]
+            return grid, result
+        return grid, resample(wavelengths, values, grid)
+
+    def flush(self):
+        grid = self.grid[self._next:]
+        shape = self._last[1].shape[:-1] if self._last is not None else ()
+        self.reset()
+        return grid, np.full(shape + grid.shape, np.nan)
+
+
+class Pipeline(Step):
+    """Pipeline : chain of steps, e.g. Pipeline(SavitzkyGolay(15, 3), Transmittance())
+
+    Whole spectra: wavelengths, values = pipeline(wl, values) - values may hold many spectra (one per row),
+    each step then runs once on the whole array.
+    Live scan: pipeline.stream(on_data) returns an on_data callback for lib_spectro.delivery.ResultChannel;
+    each delivered slice goes through the steps and the processed points are passed to on_data."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    def __call__(self, wavelengths, values):
+        for step in self.steps:
+            wavelengths, values = step(wavelengths, values)
+        return wavelengths, values
+
+    def reset(self):
+        for step in self.steps:
+            step.reset()
+
+    def feed(self, wavelengths, values):
+        for step in self.steps:
+            wavelengths, values = step.feed(wavelengths, values)
+        return wavelengths, values
+
+    def flush(self):
+        result = None
+        for idx, step in enumerate(self.steps):
+            if result is not None and len(result[0]):
+                result = step.feed(*result)
+                tail = step.flush()
+                if tail is not None and len(tail[0]):
+                    result = (np.concatenate((result[0], tail[0])),
+                              np.concatenate((result[1], tail[1]), axis=-1))
+            else:
+                result = step.flush()
+        return result
+
+    def stream(self, on_data, on_done=None):
+        """stream : return (on_data, on_done) callbacks processing the slices of a ResultChannel
+        on_data(start, wavelengths, values) is called with the processed points
+        on_done(result) is called after the last processed points"""
+        self.reset()
+        state = {'start': 0}
+
+        def emit(wavelengths, values):
+            if len(wavelengths):
+                on_data(state['start'], wavelengths, values)
+                state['start'] += len(wavelengths)
+
+        def stream_data(start, wavelengths, values):
+            emit(*self.feed(np.frombuffer(wavelengths), np.frombuffer(values)))
+
+        def stream_done(result):
+            tail = self.flush()
+            if tail is not None:
+                emit(*tail)
+            if on_done is not None:
+                on_done(result)
+
+        return stream_data, stream_done
@@ -0,0 +1,132 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import ip_address
+from threading import Thread
+from kivy.logger import Logger
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{:s}="{:s}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                               .replace('\n', '\\n'))
+                          for key, value in labels.items()) + "}"
+
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_metrics(families):
+    """format_metrics : Prometheus text format (version 0.0.4) of a list of metric families
+    family: (name, type, help, samples) - samples: list of (name suffix, labels dict, value)
+    Sample names are the family name, with _bucket, _sum or _count suffix for a histogram: counter families
+    are named with their _total suffix."""
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append("# HELP {:s} {:s}".format(name, help_text.replace('\\', '\\\\').replace('\n', '\\n')))
+        lines.append("# TYPE {:s} {:s}".format(name, kind))
+        for suffix, labels, value in samples:
+            lines.append("{:s}{:s}{:s} {:s}".format(name, suffix, format_labels(labels), format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def histogram_samples(labels, snapshot):
+    """histogram_samples : samples of a histogram family from a lib_spectro.metrics.Histogram snapshot"""
+    samples = [('_bucket', dict(labels, le=format_value(bound)), count) for bound, count in snapshot['buckets']]
+    samples.append(('_sum', labels, snapshot['sum']))
+    samples.append(('_count', labels, snapshot['count']))
+    return samples
+
+
+def driver_families(drivers):
+    """driver_families : metric families of the connected drivers
+    drivers: dict port -> driver (S250Prim)"""
+    up, counters, stages, scans = [], {}, [], []
+    for port, driver in drivers.items():
+        up.append(('', {'port': port}, 1 if driver.connected else 0))
+        for command, metrics in driver.metrics().items():
+            labels = {'port': port, 'command': command}
+            for counter, value in metrics['counters'].items():
+                counters.setdefault(counter, []).append(('', labels, value))
+            for stage, histogram in metrics['stages'].items():
+                stages += histogram_samples(dict(labels, stage=stage), histogram)
+            if command == 'get_spectrum':
+                scans += histogram_samples({'port': port}, metrics['stages']['total'])
+    return [
+        ('spectro_up', 'gauge', "1 if the spectrometer is connected", up),
+        ('spectro_commands_total', 'counter', "commands processed (rate() gives commands/s)",
+         counters.get('commands', [])),
+        ('spectro_timeouts_total', 'counter', "commands without answer (timeout rate: "
+         "rate(spectro_timeouts_total) / rate(spectro_commands_total))", counters.get('timeouts', [])),
+        ('spectro_short_reads_total', 'counter', "incomplete answers", counters.get('short_reads', [])),
+        ('spectro_transport_errors_total', 'counter', "serial errors", counters.get('transport_errors', [])),
+        ('spectro_sent_bytes_total', 'counter', "bytes sent", counters.get('bytes_out', [])),
+        ('spectro_received_bytes_total', 'counter', "bytes received", counters.get('bytes_in', [])),
+        ('spectro_command_stage_seconds', 'histogram', "duration of the stages of the commands", stages),
+        ('spectro_scan_duration_seconds', 'histogram', "duration of the spectra, from queue to result", scans),
+    ]
+
+
+class MetricsServer:
+    """MetricsServer : HTTP endpoint serving GET /metrics in Prometheus text format, on the loopback only
+
+    collect() is called from the server thread for each scrape and returns the metric families (see
+    format_metrics), it must only read the state of the application."""
+
+    def __init__(self, collect, port=9464, host='127.0.0.1'):
+        if host != 'localhost' and not ip_address(host).is_loopback:
+            raise ValueError("metrics are only served on the loopback interface, not {:s}".format(host))
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """start : bind the port and serve in a daemon thread - return False if the port can't be bound"""
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = format_metrics(collect()).encode('utf-8')
+                except Exception as e:
+                    Logger.warning("Metrics: can't collect metrics ({!r})".format(e))
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                Logger.debug("Metrics: " + format % args)
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            Logger.warning("Metrics: can't listen on {:s}:{:d} ({!r})".format(self.host, self.port, e))
+            return False
+        self._server.daemon_threads = True
+        # port 0: the system chooses a free port
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever, name="Metrics_Server", daemon=True)
+        self._thread.start()
+        Logger.info("Metrics: serving on http://{:s}:{:d}/metrics".format(self.host, self.port))
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
@@ -0,0 +1,143 @@
+from collections import deque, namedtuple
+from time import perf_counter
+from kivy.clock import Clock
+from kivy.uix.label import Label
+from kivy.base import Builder
+
+# a frame: time of its start, duration between two buffer flips (s) and self time of each operation (s)
+Frame = namedtuple('Frame', ['start', 'duration', 'times'])
+
+
+class FrameProfiler:
+    """FrameProfiler : per frame breakdown of the time spent in the graphs and in the delivery of results
+
+    Instrumented code calls begin(name, detail) and end() around an operation (see graph.set_render_probe and
+    lib_spectro.delivery.set_probe). Times are self times: a plot drawn during a graph redraw is only counted
+    in 'plot.draw', so the operations of a frame add up. Operations with a detail (the plots) are also summed
+    per detail to find the slowest ones. Frames are delimited by the flips of the window buffer, a frame
+    longer than 1.5 frame budget dropped the frames it overlapped.
+    Everything runs on the main thread, there is no lock."""
+
+    def __init__(self, maxfps=60, history=600):
+        self.frame_budget = 1. / maxfps
+        self.frames = deque(maxlen=history)
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.frames.clear()
+        self.dropped = 0
+        # (name, detail) -> [calls, total self time, max self time]
+        self.details = {}
+        self._times = {}
+        # [name, detail, start, time of the nested operations]
+        self._stack = []
+        self._frame_start = None
+
+    def enable(self):
+        from kivy.core.window import Window
+        if not self.enabled:
+            self.enabled = True
+            self._frame_start = None
+            Window.bind(on_flip=self._flip)
+
+    def disable(self):
+        from kivy.core.window import Window
+        if self.enabled:
+            self.enabled = False
+            Window.unbind(on_flip=self._flip)
+
+    def begin(self, name, detail=None):
+        self._stack.append([name, detail, perf_counter(), 0.])
+
+    def end(self):
+        name, detail, start, nested = self._stack.pop()
+        elapsed = perf_counter() - start
+        if self._stack:
+            self._stack[-1][3] += elapsed
+        own = elapsed - nested
+        self._times[name] = self._times.get(name, 0.) + own
+        if detail is not None:
+            stats = self.details.get((name, detail))
+            if stats is None:
+                self.details[(name, detail)] = [1, own, own]
+            else:
+                stats[0] += 1
+                stats[1] += own
+                stats[2] = max(stats[2], own)
+
+    def _flip(self, window):
+        now = perf_counter()
+        if self._frame_start is not None:
+            duration = now - self._frame_start
+            self.frames.append(Frame(self._frame_start, duration, self._times))
+            if duration > 1.5 * self.frame_budget:
+                self.dropped += int(round(duration / self.frame_budget)) - 1
+        self._times = {}
+        self._frame_start = now
+
+    def report(self, slowest=5):
+        """report : summary of the recorded frames (times in ms)
+        fps, frames, dropped, frame_mean, frame_max,
+        breakdown: mean self time per frame of each operation, slowest first
+        slowest_plots: (plot, draws, mean, max) of the slowest plots by total time
+        can be called from another thread (e.g. metrics server)"""
+        frames = list(self.frames)
+        report = {'frames': len(frames), 'dropped': self.dropped, 'fps': 0., 'frame_mean': 0., 'frame_max': 0.,
+                  'breakdown': [], 'slowest_plots': []}
+        if frames:
+            total = sum(frame.duration for frame in frames)
+            report['fps'] = len(frames) / total if total > 0 else 0.
+            report['frame_mean'] = 1000. * total / len(frames)
+            report['frame_max'] = 1000. * max(frame.duration for frame in frames)
+            times = {}
+            for frame in frames:
+                for name, value in frame.times.items():
+                    times[name] = times.get(name, 0.) + value
+            report['breakdown'] = sorted(((name, 1000. * value / len(frames)) for name, value in times.items()),
+                                         key=lambda item: -item[1])
+        plots = sorted(((detail, calls, total, worst) for (name, detail), (calls, total, worst)
+                        in list(self.details.items()) if name == 'plot.draw'), key=lambda item: -item[2])
+        report['slowest_plots'] = [(detail, calls, 1000. * total / calls, 1000. * worst)
+                                   for detail, calls, total, worst in plots[:slowest]]
+        return report
+
+    def text(self):
+        """text : report as lines of text"""
+        report = self.report()
+        lines = ["{:.1f} fps, frame {:.1f} ms (max {:.1f}), {:d} dropped / {:d}".format(
+            report['fps'], report['frame_mean'], report['frame_max'], report['dropped'], report['frames'])]
+        lines += ["{:s}: {:.2f} ms".format(name, value) for name, value in report['breakdown']]
+        lines += ["{:s}: {:d} x {:.2f} ms (max {:.2f})".format(*plot) for plot in report['slowest_plots']]
+        return "\n".join(lines)
+
+
+class PerformanceOverlay(Label):
+    """PerformanceOverlay : text of a FrameProfiler drawn over the window, refreshed every interval seconds"""
+
+    def __init__(self, profiler, interval=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.profiler = profiler
+        self._event = Clock.schedule_interval(self.refresh, interval)
+
+    def refresh(self, *args):
+        self.text = self.profiler.text()
+
+    def stop(self):
+        self._event.cancel()
+
+
+Builder.load_string("""
+<PerformanceOverlay>:
+    size_hint: None, None
+    size: self.texture_size
+    padding: dp(8), dp(8)
+    font_size: '12sp'
+    halign: 'left'
+    canvas.before:
+        Color:
+            rgba: 0, 0, 0, 0.6
+        Rectangle:
+            pos: self.pos
+            size: self.size
+""")
@@ -8,10 +8,13 @@
 
 # Backend Code ####################################
 import struct
-from threading import Thread
+from time import monotonic
+from threading import Thread, Event, current_thread
 from queue import Queue, Empty
 from kivy.utils import platform
 from kivy.logger import Logger
+from lib_spectro.timing import TimingModel
+from lib_spectro.metrics import CommandMetrics
 
 if platform in ['windows', 'linux']:
     import serial
@@ -45,45 +48,141 @@ Cmd_GetSpectrum = b'\x35'
 Cmd_GetType = b'\x51'
 Cmd_Stop = b'\xE7'
 
+# Commands that can be sent again after a reconnection - not Cmd_GetSpectrum: the reconnection restarts the
+# spectrometer (Cmd_Init), which loses its baseline and so the range of the spectrum. An interrupted spectrum
+# can't resume either: a new baseline needs the blank in place of the sample, it fails (clbk gets None)
+Idempotent_Commands = {Cmd_Init, Cmd_Firmware, Cmd_Autotest, Cmd_SetAbsWavelength, Cmd_GetZeroAbs, Cmd_GetAbs,
+                       Cmd_BaseLine, Cmd_GetType}
+
+# Device latency priors (s) of the timing model, before any measurement - wavelength moves add the travel time
+# of the grating (see TimingModel.move_time_prior)
+Latency_Priors = {Cmd_Init: 0.5, Cmd_Firmware: 0.1, Cmd_GetType: 0.1, Cmd_Autotest: 10., Cmd_SetAbsWavelength: 0.3,
+                  Cmd_GetZeroAbs: 2., Cmd_GetAbs: 2., Cmd_GetAbsData: 0.3, Cmd_BaseLine: 2., Cmd_GetSpectrum: 2.,
+                  Cmd_Stop: 0.1}
+
+# names of the commands in the metrics
+Command_Names = {Cmd_Init: 'init', Cmd_Firmware: 'firmware', Cmd_Autotest: 'autotest',
+                 Cmd_SetAbsWavelength: 'set_abs_wavelength', Cmd_GetZeroAbs: 'get_zero_abs', Cmd_GetAbs: 'get_abs',
+                 Cmd_GetAbsData: 'get_abs_data', Cmd_BaseLine: 'baseline', Cmd_GetSpectrum: 'get_spectrum',
+                 Cmd_GetType: 'get_type', Cmd_Stop: 'stop'}
+# metrics of the points of a spectrum (think: time waiting for each point)
+Spectrum_Point_Name = 'spectrum_point'
+
 # Spectrometer types
 Secoman_Models = {b'T\x00': 'S250 I+/E+', b'T\x01': 'S250 T+', b'P\x02': 'Prim Advanced', b'P\x01': 'Prim Lignt'}
 
-# prefix, command, n_data, callback, timeout, callback_progress
+# prefix, command, payload, n_data, callback, timeout, callback_progress, time when queued (monotonic)
+
+# put in the command queue to stop the command thread
+Thread_Stop = object()
+
 
 class NotConnectedError(Exception):
     pass
 
 
+def fail_pending_commands(cmd_queue: Queue):
+    """fail_pending_commands : remove every command from the queue and call its callback with None"""
+    while True:
+        try:
+            cmd_details = cmd_queue.get_nowait()
+        except Empty:
+            return
+        if cmd_details is Thread_Stop or callable(cmd_details):
+            continue
+        Logger.info("S250: dropping command {!r}".format(cmd_details[1]))
+        callback = cmd_details[4]
+        if callback is not None:
+            callback(None)
+
+
 class CommandThread(Thread):
+    """CommandThread : process the commands of one connection - a new thread is created for each connection"""
     def __init__(self, spectro, cmd_queue: Queue):
-        super().__init__()
+        super().__init__(daemon=True)
         self.name = "Command_Thread"
         self.spectro = spectro
         self.command_queue = cmd_queue
-        self.stop = False
+        # set when the thread has to stop: long commands (spectrum) are interrupted
+        self.stop_event = Event()
+        # time (s) spent in the queries and in the callbacks of the current command, for the metrics
+        self.io_time = 0.
+        self.callback_time = 0.
 
     def run(self):
         Logger.info("S250: Starting command thread")
-        while not self.stop:
-            try:
-                cmd_details = self.command_queue.get(block=True, timeout=1)
-                Logger.info("S250 Thread: getting command {!r}".format(str(cmd_details)))
+        while True:
+            cmd_details = self.command_queue.get()
+            if cmd_details is Thread_Stop:
+                break
+            Logger.info("S250 Thread: getting command {!r}".format(str(cmd_details)))
+            if callable(cmd_details):
+                cmd_details()
+            else:
                 self.process_command(cmd_details)
-            except Empty:
-                Logger.debug("S250 Thread: timeout !")
+        fail_pending_commands(self.command_queue)
         Logger.info("S250: Thread about to stop")
 
     def process_command(self, command_details):
+        """process_command : execute a command and call its callback with the result
+        after a transport failure, the connection is restored and the command replayed if it is idempotent"""
         return_value = None
-        if not self.spectro.connected:
+        prefix, command, payload, n_data, callback, timeout, callback_progress, queued = command_details
+        metrics = self.spectro.command_metrics
+        name = Command_Names.get(command, command.hex())
+        metrics.observe(name, 'queue', monotonic() - queued)
+        metrics.count(name, 'commands')
+        if not self.spectro.connected or self.stop_event.is_set():
+            if callback is not None:
+                callback(None)
             return
-        prefix, command, payload, n_data, callback, timeout, callback_progress = command_details
+        # time spent in progress callbacks
+        self.callback_time = 0.
+        while True:
+            try:
+                return_value = self.execute_command(command_details)
+                break
+            except struct.error:
+                Logger.warning("S250 Thread: truncated answer to {!r}".format(command))
+                return_value = None
+                break
+            except NotConnectedError:
+                # disconnected while the command was running
+                return_value = None
+                break
+            except (SerialException, OSError) as e:
+                Logger.warning("S250 Thread: transport error on {!r} ({!r})".format(command, e))
+                metrics.count(name, 'transport_errors')
+                return_value = None
+                if not self.spectro.reconnect(self.stop_event) or command not in Idempotent_Commands:
+                    break
+                Logger.info("S250 Thread: replaying {!r}".format(command))
+        if callback is not None:
+            start = monotonic()
+            callback(return_value)
+            self.callback_time += monotonic() - start
+        metrics.observe(name, 'callback', self.callback_time)
+        metrics.observe(name, 'total', monotonic() - queued)
+
+    def execute_command(self, command_details):
+        """execute_command : send a command and decode its answer - may raise SerialException"""
+        return_value = None
+        prefix, command, payload, n_data, callback, timeout, callback_progress, queued = command_details
+        timing = self.spectro.timing
+        metrics = self.spectro.command_metrics
+        points, speed = self.spectro.scan_points(command, payload)
+        travel = self.spectro.travel(command, payload)
         self.spectro.conn.flush()
-        self.spectro.send(prefix + command + payload)
-        data = self.spectro.receive(n_data, timeout)
+        # a late answer to a previous command would be read as the answer to this one
+        self.spectro.discard_input()
+        data = self.query(command, prefix + command + payload, n_data, timeout, points, speed, travel)
         if len(data) != n_data:
             return_value = None
         else:
+            # decode time: everything but the nested queries, the points of a spectrum and progress callbacks
+            decode_start = monotonic()
+            self.io_time = 0.
+            callback_time = self.callback_time
             cmd_sent = command
             # start and check init spectrometer
             if cmd_sent == Cmd_Init:
@@ -103,46 +202,107 @@ class CommandThread(Thread):
             # set wavelength for absorbance and kinetics
             elif cmd_sent == Cmd_SetAbsWavelength:
                 return_value = data == Ans_SetAbsWavelength_Ok
+                if return_value:
+                    self.spectro.abs_wavelength_payload = payload
             # get zero of absorbance value
             elif cmd_sent == Cmd_GetZeroAbs:
                 if data == Ans_GetZeroAbs_Ok:
-                    self.spectro.send(Cmd_GetAbsData)
-                    abs = self.spectro.receive(3, 2.0)
+                    abs = self.query(Cmd_GetAbsData, Cmd_GetAbsData, 3)
                     return_value = struct.unpack(">Bh", abs)[1] / 10_000.0
             # get absorbance value
             elif cmd_sent == Cmd_GetAbs:
                 if data == Ans_GetAbs_Ok:
-                    self.spectro.send(Cmd_GetAbsData)
-                    abs = self.spectro.receive(3, 2.0)
+                    abs = self.query(Cmd_GetAbsData, Cmd_GetAbsData, 3)
                     return_value = struct.unpack(">Bh", abs)[1] / 10_000.0
             # perform spectrum baseline
             elif cmd_sent == Cmd_BaseLine:
                 return_value = data == Ans_Baseline_Ok
+                if return_value:
+                    self.spectro.scan_range = struct.unpack(">HHBBxx", payload)
             # get spectrum data
             elif cmd_sent == Cmd_GetSpectrum:
                 wlStart, N = struct.unpack(">xxHHx", data)
-                spectrum_data = []
-                spectrum_wl = []
+                spectrum_wl, spectrum_data = [], []
+                point_timeout = timeout if timeout is not None else timing.point_timeout(speed)
+                last_time = monotonic()
                 for i in range(N):
-                    data = self.spectro.receive(2, self.timeout)
+                    point_start = monotonic()
+                    data = self.spectro.receive(2, point_timeout)
+                    now = monotonic()
+                    self.io_time += now - point_start
+                    metrics.count(Spectrum_Point_Name, 'bytes_in', len(data))
+                    if len(data) != 2:
+                        metrics.count(Spectrum_Point_Name, 'short_reads')
+                        if not data:
+                            metrics.count(Spectrum_Point_Name, 'timeouts')
+                        if not self.stop_event.is_set():
+                            timing.point_timed_out(speed)
+                    if len(data) != 2 or self.stop_event.is_set():
+                        Logger.warning("S250 Thread: spectrum interrupted at point {:d}/{:d}".format(i, N))
+                        break
+                    metrics.observe(Spectrum_Point_Name, 'think', now - point_start)
+                    metrics.count(Spectrum_Point_Name, 'commands')
+                    timing.record_point(speed, now - last_time)
+                    last_time = now
                     val = struct.unpack(">h", data)[0] / 10000.
                     wl = wlStart + i
                     spectrum_data.append(val)
                     spectrum_wl.append(wl)
-                    if self.callback_progress is not None:
-                        self.callback_progress((round(i/N*100), wl, val))
-                return_value = spectrum_wl, spectrum_data
+                    if callback_progress is not None:
+                        callback_progress((round((i + 1) / N * 100), wl, val))
+                        self.callback_time += monotonic() - now
+                else:
+                    return_value = spectrum_wl, spectrum_data
             # get type and model of spectrometer
             elif cmd_sent == Cmd_GetType:
                 data = struct.unpack("2s", data)
                 rawmodel = data[0]
-                stringmodel = "Secomam " + Secoman_Models.get(rawmodel, default="")
+                stringmodel = "Secomam " + Secoman_Models.get(rawmodel, "")
                 return_value = stringmodel, rawmodel
             # everything else (like stop)
             else:
                 return_value = None
-        if callback is not None:
-            callback(return_value)
+            metrics.observe(Command_Names.get(command, command.hex()), 'decode',
+                            monotonic() - decode_start - self.io_time - (self.callback_time - callback_time))
+        return return_value
+
+    def query(self, command, message, n_data, timeout=None, points=0, speed=None, travel=0):
+        """query : send message and receive n_data bytes - the timeout comes from the timing model if None
+        the duration is recorded in the timing model when the answer is complete
+        the first byte is read alone to measure the device think time apart from the transfer"""
+        timing = self.spectro.timing
+        metrics = self.spectro.command_metrics
+        name = Command_Names.get(command, command.hex())
+        if timeout is None:
+            timeout = timing.timeout(command, len(message), n_data, points, speed, travel)
+        start = monotonic()
+        self.spectro.send(message)
+        sent = first = monotonic()
+        data = b''
+        if n_data:
+            data = self.spectro.receive(1, timeout)
+            first = monotonic()
+            if data and n_data > 1:
+                data += self.spectro.receive(n_data - 1, max(timeout - (first - start), timing.min_timeout))
+        end = monotonic()
+        self.io_time += end - start
+        metrics.observe(name, 'send', sent - start)
+        metrics.count(name, 'bytes_out', len(message))
+        metrics.count(name, 'bytes_in', len(data))
+        if data:
+            metrics.observe(name, 'think', first - sent)
+            metrics.observe(name, 'receive', end - first)
+        if len(data) != n_data:
+            metrics.count(name, 'short_reads')
+            if not data:
+                metrics.count(name, 'timeouts')
+            # the device may have slowed down: wait longer next time
+            timing.timed_out(command)
+            # the rest of the answer may still come: drop what arrived
+            self.spectro.discard_input()
+        else:
+            timing.record(command, end - start, len(message), n_data, points, speed, travel)
+        return data
 
 
 class S250Prim:
@@ -150,28 +310,46 @@ class S250Prim:
     serialComParameters = {'baudrate': 4800, 'bytesize': 8, 'parity': 'N',
                            'stopbits': 1}
     device_capabilities = {'serialcomparameters': serialComParameters, 'device': waveLengthLimits}
-
-    def __init__(self, activity_out_clbk=None, activity_in_clbk=None):
+    # reconnection after a transport failure: delays (s) between attempts and timeout of Cmd_Init
+    auto_reconnect = True
+    reconnect_delays = (0.2, 0.5, 1., 2., 4., 8.)
+    reconnect_init_timeout = 2.
+
+    def __init__(self, activity_out_clbk=None, activity_in_clbk=None, connection_clbk=None):
+        """activity_out_clbk, activity_in_clbk: functions called from the command thread with the number of
+        bytes sent/received - they must be cheap (see lib_spectro.activity.ActivityMonitor)
+        connection_clbk: function called from the command thread with 'lost', 'reconnected' or 'failed'
+        when the connection breaks and is restored (or not)"""
         self.connected = False
+        self.port = None
+        # payload of the last successful Cmd_SetAbsWavelength, restored after a reconnection
+        self.abs_wavelength_payload = None
+        # (wllo, wlhi, res, speed) of the last successful baseline: range and speed of the spectra
+        self.scan_range = None
+        # expected durations and adaptive timeouts of commands
+        self.timing = TimingModel(self.serialComParameters['baudrate'], latency_priors=Latency_Priors)
+        # durations of the stages of the commands and I/O counters
+        self.command_metrics = CommandMetrics()
         self.zero_data = 0.
         self.spectrum_data = None
         self.spectrum_data_idx = None
         self.conn = None
-        self.command_queue = Queue()
+        # queue and thread of the current connection (None when not connected)
+        self.command_queue = None
         self.command_thread = None
         self.activity_in_clbk = activity_in_clbk
         self.activity_out_clbk = activity_out_clbk
-        self.command_thread = CommandThread(self, self.command_queue)
+        self.connection_clbk = connection_clbk
 
     def __del__(self):
-        if self.command_thread.is_alive():
-            self.stop = True
-            self.command_thread.join()
+        if self.command_thread is not None:
+            self.command_thread.stop_event.set()
+            self.command_queue.put(Thread_Stop)
 
     def send(self, s):
         if self.connected:
             if self.activity_out_clbk is not None:
-                self.activity_out_clbk()
+                self.activity_out_clbk(len(s))
             Logger.debug("Serial: command sent {!r}".format(s))
             n = self.conn.write(s)
             return n
@@ -183,64 +361,228 @@ class S250Prim:
             self.conn.timeout = timeout
             c = self.conn.read(n)
             if c and self.activity_in_clbk is not None:
-                self.activity_in_clbk()
+                self.activity_in_clbk(len(c))
             Logger.debug("Serial: data received {!r}".format(c))
             return c
         else:
             raise NotConnectedError
 
-    def thread_send(self, prefix=b'', command=b'', payload=b'', n=0, clbk=None, timeout=5, progress_clbk=None):
-        command_details = prefix, command, payload, n, clbk, timeout, progress_clbk
-        self.command_queue.put(command_details)
+    def thread_send(self, prefix=b'', command=b'', payload=b'', n=0, clbk=None, timeout=None, progress_clbk=None):
+        """ thread_send : queue a command for the command thread
+        timeout: time to wait for the answer (s) - adaptive timeout from the timing model if None"""
+        command_queue = self.command_queue
+        if command_queue is None:
+            raise NotConnectedError
+        command_details = prefix, command, payload, n, clbk, timeout, progress_clbk, monotonic()
+        command_queue.put(command_details)
+
+    def scan_points(self, command, payload=b''):
+        """ scan_points : return (number of points scanned before the answer, speed) for a command"""
+        if command == Cmd_BaseLine:
+            wllo, wlhi, res, speed = struct.unpack(">HHBBxx", payload)
+            return wlhi - wllo + 1, speed
+        if command == Cmd_GetSpectrum and self.scan_range is not None:
+            return 0, self.scan_range[3]
+        return 0, None
+
+    def travel(self, command, payload=b''):
+        """ travel : distance (nm) the grating moves for a command - the whole range if its position is unknown"""
+        if command != Cmd_SetAbsWavelength:
+            return 0
+        if self.abs_wavelength_payload is None:
+            return self.waveLengthLimits['end'] - self.waveLengthLimits['start']
+        return abs(struct.unpack(">HxxB", payload)[0] - struct.unpack(">HxxB", self.abs_wavelength_payload)[0])
+
+    def discard_input(self):
+        """ discard_input : drop the bytes received and not read yet"""
+        try:
+            self.conn.reset_input_buffer()
+        except (SerialException, OSError) as e:
+            Logger.debug("Serial: can't reset input ({!r})".format(e))
+
+    def expected_duration(self, command, payload=b'', n_data=0, prefix=Cmd_Prefix):
+        """ expected_duration : expected duration (s) of a command, from the timing model"""
+        points, speed = self.scan_points(command, payload)
+        duration = self.timing.expected(command, len(prefix + command + payload), n_data, points, speed,
+                                        self.travel(command, payload))
+        if command in (Cmd_GetAbs, Cmd_GetZeroAbs):
+            duration += self.timing.expected(Cmd_GetAbsData, 1, 3)
+        elif command == Cmd_GetSpectrum and self.scan_range is not None:
+            wllo, wlhi, res, speed = self.scan_range
+            duration += self.timing.spectrum_eta(wlhi - wllo + 1, speed)
+        return duration
+
+    def estimate_queue_time(self):
+        """ estimate_queue_time : expected time (s) to process the commands waiting in the queue"""
+        command_queue = self.command_queue
+        if command_queue is None:
+            return 0.
+        with command_queue.mutex:
+            pending = list(command_queue.queue)
+        total = 0.
+        for cmd_details in pending:
+            if cmd_details is Thread_Stop or callable(cmd_details):
+                continue
+            prefix, command, payload, n_data = cmd_details[:4]
+            total += self.expected_duration(command, payload, n_data, prefix)
+        return total
+
+    def metrics(self):
+        """ metrics : snapshot of the metrics of each command (see lib_spectro.metrics.CommandMetrics.snapshot)
+        stages: queue, send, think (until the first byte of the answer), receive, decode, callback, total
+        counters: commands, bytes_out, bytes_in, timeouts (nothing received), short_reads (incomplete answer),
+        transport_errors - 'spectrum_point' holds the time waiting for each point of the spectra"""
+        return self.command_metrics.snapshot()
+
+    def spectrum_eta(self, n_points):
+        """ spectrum_eta : expected time (s) to receive n_points more points of the current spectrum"""
+        speed = self.scan_range[3] if self.scan_range is not None else None
+        return self.timing.spectrum_eta(n_points, speed)
+
+    def run_in_thread(self, func):
+        """ run_in_thread : call func() from the command thread, in order with the queued commands
+        (e.g. to synchronize several spectrometers)"""
+        command_queue = self.command_queue
+        if command_queue is None:
+            raise NotConnectedError
+        command_queue.put(func)
+
+    def open_port(self, port):
+        """ open_port : open and return the serial connection (None if permission is not granted yet)"""
+        if platform in ['windows', 'linux']:
+            return serial.Serial(port, baudrate=self.serialComParameters['baudrate'],
+                                 parity=self.serialComParameters['parity'],
+                                 stopbits=self.serialComParameters['stopbits'])
+        elif platform == 'android':
+            device = usb.get_usb_device(port)
+            if not device:
+                raise SerialException(
+                    "No device {}".format(port)
+                )
+            if not usb.has_usb_permission(device):
+                usb.request_usb_permission(device)
+                return None
+            return serial4a.get_serial_port(
+                port,
+                self.serialComParameters['baudrate'],
+                8,
+                self.serialComParameters['parity'],
+                self.serialComParameters['stopbits'],
+                timeout=1
+            )
 
     def connect(self, port):
         try:
-            if platform in ['windows', 'linux']:
-                self.conn = serial.Serial(port, baudrate=self.serialComParameters['baudrate'],
-                                          parity=self.serialComParameters['parity'],
-                                          stopbits=self.serialComParameters['stopbits'])
-            elif platform == 'android':
-                device = usb.get_usb_device(port)
-                if not device:
-                    raise SerialException(
-                        "No device {}".format(port)
-                    )
-                if not usb.has_usb_permission(device):
-                    usb.request_usb_permission(device)
-                    return False
-                self.conn = serial4a.get_serial_port(
-                    port,
-                    self.serialComParameters['baudrate'],
-                    8,
-                    self.serialComParameters['parity'],
-                    self.serialComParameters['stopbits'],
-                    timeout=1
-                )
+            self.conn = self.open_port(port)
+            if self.conn is None:
+                return False
+            self.port = port
+            # start_device (Cmd_Init) resets the wavelength and the baseline
+            self.abs_wavelength_payload = None
+            self.scan_range = None
             self.connected = True
+            self.command_queue = Queue()
+            self.command_thread = CommandThread(self, self.command_queue)
             self.command_thread.start()
             return True
         except SerialException:
-            self.command_thread.stop = True
-            self.command_thread.join()
             self.connected = False
             return False
 
     def disconnect(self):
+        """ disconnect : stop the command thread and close the port
+        pending commands are not sent: their callback is called with None
+        new commands are refused first (NotConnectedError): a callback of a failed command may queue another one"""
+        self.connected = False
+        self.stop_command_thread()
         try:
-            self.command_thread.stop = True
-            self.command_thread.join()
-            self.conn.close()
+            if self.conn is not None:
+                self.conn.close()
         except SerialException:
             pass
-        del self.conn
         self.conn = None
         self.connected = False
 
-    def start_device(self, clbk=None):
+    def reconnect(self, stop_event):
+        """ reconnect : reopen the port after a transport failure - called from the command thread
+        retries with increasing delays, then checks the spectrometer with Cmd_Init and restores the wavelength
+        return True if the connection is restored, False otherwise (the driver is then not connected)"""
+        if not self.auto_reconnect or self.port is None:
+            self.connected = False
+            return False
+        self._connection_changed('lost')
+        for delay in self.reconnect_delays:
+            # stop_event is set on disconnect(): give up immediately
+            if stop_event.wait(delay) or not self.connected:
+                return False
+            Logger.info("S250: reconnecting to {:s}".format(self.port))
+            try:
+                if self.conn is not None:
+                    self.conn.close()
+            except (SerialException, OSError):
+                pass
+            conn = None
+            try:
+                conn = self.conn = self.open_port(self.port)
+                if conn is None:
+                    continue
+                self.send(Cmd_Init)
+                if self.receive(1, self.reconnect_init_timeout) != Ans_Init_Ok:
+                    continue
+                # the baseline is lost with Cmd_Init (see Idempotent_Commands), the wavelength is restored
+                self.scan_range = None
+                if self.abs_wavelength_payload is not None:
+                    self.send(Cmd_Prefix + Cmd_SetAbsWavelength + self.abs_wavelength_payload)
+                    self.receive(1, self.reconnect_init_timeout)
+            except NotConnectedError:
+                # disconnect() while reconnecting: the port it closed may be the previous one
+                try:
+                    conn.close()
+                except (SerialException, OSError):
+                    pass
+                return False
+            except (SerialException, OSError) as e:
+                Logger.info("S250: reconnection failed ({!r})".format(e))
+                continue
+            Logger.info("S250: reconnected to {:s}".format(self.port))
+            self._connection_changed('reconnected')
+            return True
+        Logger.warning("S250: can't reconnect to {:s}".format(self.port))
+        self.connected = False
+        self._connection_changed('failed')
+        return False
+
+    def _connection_changed(self, state):
+        if self.connection_clbk is not None:
+            self.connection_clbk(state)
+
+    def stop_command_thread(self):
+        """ stop_command_thread : fail pending commands, interrupt the current one and wait for the thread"""
+        thread, command_queue = self.command_thread, self.command_queue
+        if thread is None:
+            return
+        # detached: thread_send refuses new commands while the pending ones are failed
+        self.command_thread = None
+        self.command_queue = None
+        thread.stop_event.set()
+        fail_pending_commands(command_queue)
+        command_queue.put(Thread_Stop)
+        if thread is not current_thread():
+            # wake up a read in progress instead of waiting for its timeout
+            cancel_read = getattr(self.conn, 'cancel_read', None)
+            if cancel_read is not None:
+                try:
+                    cancel_read()
+                except (SerialException, OSError):
+                    pass
+            thread.join()
+        fail_pending_commands(command_queue)
+
+    def start_device(self, clbk=None, timeout=None):
         """ start_device : start spectrometer and test if initialization of spectrometer is completed
         clbk: function called when the command is processed clbk(retval)
             retval is True is init successful, False if not and the raw data if something weird happened"""
-        self.thread_send(command=Cmd_Init, n=1, clbk=clbk)
+        self.thread_send(command=Cmd_Init, n=1, clbk=clbk, timeout=timeout)
 
     def stop_device(self, clbk=None):
         """stop_device : stop spectrometer
@@ -252,15 +594,15 @@ class S250Prim:
         this is an alias to the start_device method"""
         self.start_device(clbk=clbk)
 
-    def get_firmware_version(self, clbk=None):
+    def get_firmware_version(self, clbk=None, timeout=None):
         """ get_firmware_version : get and return Prom version
         clbk: """
-        self.thread_send(prefix=Cmd_Prefix, command=Cmd_Firmware, n=2, clbk=clbk)
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_Firmware, n=2, clbk=clbk, timeout=timeout)
 
-    def get_model_name(self, clbk=None):
+    def get_model_name(self, clbk=None, timeout=None):
         """ get_model_name : return complete model name
         clbk: """
-        self.thread_send(prefix=Cmd_Prefix, command=Cmd_GetType, n=2, clbk=clbk)
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_GetType, n=2, clbk=clbk, timeout=timeout)
 
     def perform_autotest(self, clbk=None):
         """ perform_autotest : performs AutoTest of spectrometer
@@ -270,31 +612,31 @@ class S250Prim:
     def set_abs_wavelength(self, wl, gain=255, clbk=None):
         """ set_abs_wavelength : Set value of wavelength - [wl in nm] [gain from 0 to 255]
         clbk: """
-        self.conn.flush()
-        data = struct.pack(">HxxB", wl, gain)
-        self._thread_send(prefix=Cmd_Prefix, command=Cmd_SetAbsWavelength, payload=data, n=1, clbk=clbk)
+        data = struct.pack(">HxxB", int(wl), gain)
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_SetAbsWavelength, payload=data, n=1, clbk=clbk)
 
     def get_abs_zero(self, clbk=None):
         """ get_abs_zero : get value of absorbance zero
         clbk: """
-        self.thread_send(Cmd_Prefix + Cmd_GetZeroAbs, 1, clbk)
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_GetZeroAbs, n=1, clbk=clbk)
 
     def get_abs(self, clbk=None):
         """ get_abs : get value of absorbance
         clbk: """
-        self.thread_send(Cmd_Prefix + Cmd_GetAbs, 1, clbk)
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_GetAbs, n=1, clbk=clbk)
 
     def make_spectrum_baseline(self, wllo, wlhi, speed=8, res=3, clbk=None):
         """ make_spectrum_baseline : performs baseline of spectrum
                                      [wlLo in nm] [wlHi in nm] [speed from 1 to 8] [res = 3]"""
-        data = struct.pack(">HHBBxx", wllo, wlhi, res, speed)
-        # TODO : intergrate in thread_send !
-        self.send(Cmd_Prefix + Cmd_BaseLine + data, 1, clbk)
-
-    def get_spectrum(self, clbk=None):
-        """ get_spectrum_header : Gets and returns spectrum header - no arguments"""
-        self.conn.flush()
-        self.thread_send(Cmd_Prefix + Cmd_GetSpectrum, 7, clbk)
+        data = struct.pack(">HHBBxx", int(wllo), int(wlhi), res, speed)
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_BaseLine, payload=data, n=1, clbk=clbk)
+
+    def get_spectrum(self, clbk=None, progress_clbk=None):
+        """ get_spectrum : performs a spectrum on the range of the last baseline
+        clbk: function called with (wavelengths, values) when the spectrum is complete (None if it failed)
+        progress_clbk: function called from the command thread with (percent, wl, value) for each point
+            (see lib_spectro.delivery.ResultChannel to get batched data on the main thread)"""
+        self.thread_send(prefix=Cmd_Prefix, command=Cmd_GetSpectrum, n=7, clbk=clbk, progress_clbk=progress_clbk)
 
 
 def test_list_ports():
@@ -0,0 +1,139 @@
+from threading import Lock
+
+
+class LatencyEstimate:
+    """LatencyEstimate : smoothed mean and deviation of a duration (as TCP round trip time estimation)"""
+    gain = 1 / 8.
+    deviation_gain = 1 / 4.
+
+    def __init__(self, prior):
+        self.mean = prior
+        self.deviation = prior / 2.
+        self.samples = 0
+
+    def add(self, value):
+        if self.samples == 0:
+            self.mean = value
+            self.deviation = value / 2.
+        else:
+            error = value - self.mean
+            self.mean += self.gain * error
+            self.deviation += self.deviation_gain * (abs(error) - self.deviation)
+        self.samples += 1
+
+    def upper(self, k=4.):
+        """upper : duration that should not be exceeded by a healthy device"""
+        return self.mean + k * self.deviation
+
+
+class TimingModel:
+    """TimingModel : expected duration and adaptive timeout of the spectrometer commands
+
+    duration = wire time of the bytes sent and received (10 bits per byte at baudrate)
+               + device latency (time the device needs before answering)
+               + number of scanned points * time per point (baseline and spectrum)
+               + grating travel (nm) * time per nm (wavelength moves)
+    Latencies, time per point (for each speed) and time per nm start from priors and follow the measured
+    values. A move of at least min_travel nm updates the time per nm with what exceeds the latency of the
+    command, the latency learns the rest: short moves don't shorten the timeout of long ones.
+    Timeouts are mean + 4 deviations of the estimate, so they get short on a steady device and
+    stay long enough for slow scans and long moves. As the TCP retransmission timeout, the timeout of a
+    command is doubled after each timeout (a device slowing down, e.g. lamp warm-up, gets a chance to answer
+    and be measured) and back to the estimate with the next answer."""
+    # priors of the device latency for each command (s) - unknown commands use default_latency
+    default_latency = 1.
+    # time per spectrum point at speed 1 (s), time at speed s is point_time_prior / s
+    point_time_prior = 0.25
+    # time per nm of grating travel (s): about 3 s across the whole range
+    move_time_prior = 0.005
+    # shortest move (nm) updating the time per nm
+    min_travel = 20
+    # timeouts in a row doubling the timeout of a command (at most 2 ** max_backoff times the estimate)
+    max_backoff = 6
+
+    def __init__(self, baudrate=4800, bits_per_byte=10, min_timeout=0.3, max_timeout=600., latency_priors=None):
+        self.byte_time = bits_per_byte / float(baudrate)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.latency_priors = dict(latency_priors or {})
+        self._lock = Lock()
+        self._latency = {}
+        self._point_time = {}
+        self.move_time = LatencyEstimate(self.move_time_prior)
+        # command (or ('point', speed) for spectrum points) -> number of timeouts in a row
+        self._backoff = {}
+
+    def wire_time(self, n_bytes):
+        """wire_time : time needed to transfer n_bytes"""
+        return n_bytes * self.byte_time
+
+    def latency(self, command):
+        """latency : LatencyEstimate of command (created from priors when needed)"""
+        with self._lock:
+            estimate = self._latency.get(command)
+            if estimate is None:
+                estimate = LatencyEstimate(self.latency_priors.get(command, self.default_latency))
+                self._latency[command] = estimate
+            return estimate
+
+    def point_time(self, speed):
+        """point_time : LatencyEstimate of the time per point of a scan at speed"""
+        with self._lock:
+            estimate = self._point_time.get(speed)
+            if estimate is None:
+                estimate = LatencyEstimate(self.point_time_prior / max(speed or 1, 1))
+                self._point_time[speed] = estimate
+            return estimate
+
+    def expected(self, command, n_out, n_in, points=0, speed=None, travel=0):
+        """expected : expected duration (s) of a command sending n_out bytes and receiving n_in bytes
+        points: number of points the device has to scan before answering
+        travel: distance (nm) the grating moves before answering"""
+        duration = self.wire_time(n_out + n_in) + self.latency(command).mean + travel * self.move_time.mean
+        if points:
+            duration += points * self.point_time(speed).mean
+        return duration
+
+    def timeout(self, command, n_out, n_in, points=0, speed=None, travel=0):
+        """timeout : adaptive timeout (s) for a command"""
+        duration = self.wire_time(n_out + n_in) + self.latency(command).upper() + travel * self.move_time.upper()
+        if points:
+            duration += points * self.point_time(speed).upper()
+        return min(max(duration, self.min_timeout) * 2 ** self._backoff.get(command, 0), self.max_timeout)
+
+    def point_timeout(self, speed):
+        """point_timeout : timeout (s) for one point (2 bytes) of a spectrum at speed"""
+        duration = self.wire_time(2) + self.point_time(speed).upper()
+        return min(max(duration, self.min_timeout) * 2 ** self._backoff.get(('point', speed), 0), self.max_timeout)
+
+    def timed_out(self, command):
+        """timed_out : the answer of command did not come (completely) in time, double its next timeout"""
+        with self._lock:
+            self._backoff[command] = min(self._backoff.get(command, 0) + 1, self.max_backoff)
+
+    def point_timed_out(self, speed):
+        """point_timed_out : a point of a spectrum at speed did not come in time, double the point timeout"""
+        self.timed_out(('point', speed))
+
+    def record(self, command, duration, n_out, n_in, points=0, speed=None, travel=0):
+        """record : add a measured duration of a command (from send to the end of the answer)"""
+        latency = duration - self.wire_time(n_out + n_in)
+        if points:
+            latency -= points * self.point_time(speed).mean
+        estimate = self.latency(command)
+        with self._lock:
+            self._backoff.pop(command, None)
+            if travel >= self.min_travel:
+                self.move_time.add(max(latency - estimate.mean, 0.) / travel)
+            estimate.add(max(latency - travel * self.move_time.mean, 0.))
+
+    def record_point(self, speed, duration):
+        """record_point : add a measured time between two points of a spectrum at speed"""
+        estimate = self.point_time(speed)
+        with self._lock:
+            self._backoff.pop(('point', speed), None)
+            estimate.add(max(duration - self.wire_time(2), 0.))
+
+    def spectrum_eta(self, n_points, speed=None):
+        """spectrum_eta : expected time (s) to receive n_points more points of a spectrum"""
+        return n_points * (self.wire_time(2) + self.point_time(speed).mean)
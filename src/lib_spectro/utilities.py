@@ -1,5 +1,4 @@
-from decimal import Decimal
-from math import pow, isclose
+from math import floor, ceil, log10, inf
 
 def step_data(rawval, step):
     val = step * (rawval // float(step))
@@ -10,39 +9,102 @@ def step_data(rawval, step):
     return val
 
 def fexp(number):
-    (sign, digits, exponent) = Decimal(number).as_tuple()
-    return len(digits) + exponent - 1
+    """fexp : decimal exponent of number (0 for 0)"""
+    return floor(log10(abs(number))) if number else 0
 
 def fman(number):
-    return float(Decimal(number).scaleb(-fexp(number)).normalize())
-    
+    """fman : decimal mantissa of number, in [1, 10[ """
+    return number / 10.0 ** fexp(number)
+
+def nice_tick(amp, nticks):
+    """nice_tick : tick (1, 2 or 5 times a power of 10) giving about nticks intervals on amp
+    and suggested number of minor sub-intervals"""
+    raw = amp / float(nticks)
+    tickpower = 10.0 ** fexp(raw)
+    basictick = raw / tickpower
+    if basictick < 1.5:
+        return 1.0 * tickpower, 4
+    elif basictick < 2.5:
+        return 2.0 * tickpower, 4
+    elif basictick < 7.5:
+        return 5.0 * tickpower, 5
+    return 10.0 * tickpower, 4
+
 def get_bounds_and_ticks(minval, maxval, nticks):
-    # amplitude of data
+    # amplitude of data (a flat data set gets an axis around its value)
     amp = maxval - minval
-    # basic tick
-    basictick = fman(amp/float(nticks))
-    # correct basic tick to 1,2,5 as mantissa
-    tickpower = pow(10.0,fexp(amp/float(nticks)))
-    if basictick < 1.5:
-        tick = 1.0*tickpower
-        suggested_minor_tick = 4
-    elif basictick >= 1.5 and basictick < 2.5:
-        tick = 2.0*tickpower
-        suggested_minor_tick = 4
-    elif basictick >= 2.5 and basictick < 7.5:
-        tick = 5.0*tickpower
-        suggested_minor_tick = 5
-    elif basictick >= 7.5:
-        tick = 10.0*tickpower
-        suggested_minor_tick = 4
-    # calculate good (rounded) min and max
-    goodmin = tick * (minval // tick)
-    if not isclose(maxval % tick,0.0):
-        goodmax = tick * (maxval // tick +1)
-    else:
-        goodmax = tick * (maxval // tick)
+    if amp <= 0:
+        amp = abs(minval) or 1.0
+        minval, maxval = minval - amp / 2., maxval + amp / 2.
+    tick, suggested_minor_tick = nice_tick(amp, nticks)
+    # calculate good (rounded) min and max, bounds a rounding error away from a tick are on it
+    goodmin = tick * floor(minval / tick + 1e-9)
+    goodmax = tick * ceil(maxval / tick - 1e-9)
+    # drop the float noise of the products (0.7000000000000001)
+    digits = max(0, -fexp(tick)) + 1
+    goodmin, goodmax = round(goodmin, digits), round(goodmax, digits)
     return goodmin, goodmax, tick, suggested_minor_tick
-    
+
+
+class AutoScale:
+    """AutoScale : nice bounds and ticks of an axis following the data appended to a plot
+
+    Running min/max are updated with each new slice of values, so the whole data set is never scanned again.
+    Bounds only change when the data goes out of them, and then get headroom (a fraction of the data
+    range) so that an axis following a growing curve changes a few times instead of on every point.
+    With a graph, the axis limits and ticks of the graph are set directly."""
+
+    def __init__(self, graph=None, axis='y', nticks=8, headroom=0.1, fixed_min=None, fixed_max=None):
+        """graph: Graph to drive (xmin/xmax/x_ticks_major/x_ticks_minor for axis 'x', the y ones for 'y')
+        fixed_min, fixed_max: bound that does not follow data (e.g. 0 for a time axis)"""
+        self.graph = graph
+        self.axis = axis
+        self.nticks = nticks
+        self.headroom = headroom
+        self.fixed_min = fixed_min
+        self.fixed_max = fixed_max
+        self.reset()
+
+    def reset(self):
+        """reset : forget the data (new acquisition), the next values set the bounds"""
+        self.datamin = inf
+        self.datamax = -inf
+        self.bounds = None
+
+    def add(self, values):
+        """add : take new values into account, return True when bounds changed"""
+        if not len(values):
+            return False
+        self.datamin = min(self.datamin, min(values))
+        self.datamax = max(self.datamax, max(values))
+        if self.bounds is not None and self.bounds[0] <= self.datamin and self.datamax <= self.bounds[1]:
+            return False
+        margin = self.headroom * (self.datamax - self.datamin)
+        lo, hi = self.datamin - margin, self.datamax + margin
+        if self.bounds is not None:
+            # grow only on the side the data went out
+            if self.datamin >= self.bounds[0]:
+                lo = self.bounds[0]
+            if self.datamax <= self.bounds[1]:
+                hi = self.bounds[1]
+        if self.fixed_min is not None:
+            lo = self.fixed_min
+        if self.fixed_max is not None:
+            hi = self.fixed_max
+        self.bounds = get_bounds_and_ticks(lo, hi, self.nticks)
+        if self.graph is not None:
+            self.apply(self.graph)
+        return True
+
+    def apply(self, graph):
+        """apply : set the axis limits and ticks of graph"""
+        vmin, vmax, tick, minor = self.bounds
+        axis = self.axis
+        setattr(graph, axis + 'min', vmin)
+        setattr(graph, axis + 'max', vmax)
+        setattr(graph, axis + '_ticks_major', tick)
+        setattr(graph, axis + '_ticks_minor', minor)
+
 if __name__ == "__main__":
     import random
     minval = -37
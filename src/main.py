@@ -1,4 +1,16 @@
+import csv
+import os
+from datetime import datetime
 from lib_spectro.s250Prim_async import S250Prim
+from lib_spectro.activity import ActivityMonitor
+from lib_spectro.device_manager import DeviceManager
+from lib_spectro.discovery import DeviceDiscovery
+from lib_spectro.baseline import BaselineLibrary
+from lib_spectro.catalog import AcquisitionCatalog
+from lib_spectro.render_profile import FrameProfiler, PerformanceOverlay
+from lib_spectro.prometheus import MetricsServer, driver_families
+from lib_spectro.control_api import ControlServer
+from lib_spectro import delivery
 
 __version__ = "2.0"
 from kivy.utils import platform
@@ -12,7 +24,9 @@ if platform in ['win', 'linux']:
 
 from kivy.app import App
 from kivy.logger import Logger, LOG_LEVELS
-from kivy.clock import Clock, mainthread
+from kivy.clock import Clock
+from kivy.core.window import Window
+import graph
 from device_screen import DeviceScreen
 from spectrum_screen import SpectrumScreen
 from absorbance_screen import AbsorbanceScreen
@@ -44,12 +58,21 @@ class SpectroApp(App):
     title = "Spectro" + " v" + __version__
     ports_update_event = None
     spectro = Spectrometer()
+    devices = DeviceManager()
+    baselines = BaselineLibrary()
     serial_port = None
     devicescreen = None
     spectrumscreen = None
     absorbancescreen = None
     kineticsscreen = None
     popup_operation = None
+    activity = None
+    discovery = None
+    catalog = None
+    profiler = None
+    performance_overlay = None
+    metrics_server = None
+    control_server = None
 
     # ---- popups helpers
     def show_message(self, title, message, timeout=2.):
@@ -58,10 +81,108 @@ class SpectroApp(App):
         popup.set_message(title, message)
         popup.close_after(timeout)
 
+    # ---- acquisitions storage
+    def record_acquisition(self, mode, wl_lo, wl_hi, header, rows, label=''):
+        """record_acquisition : save rows in a csv file of user_data_dir/acquisitions and index it in the catalog
+        return the path of the file or None if it could not be written"""
+        now = datetime.now()
+        directory = os.path.join(self.user_data_dir, 'acquisitions')
+        path = os.path.join(directory, "{:s}_{:s}_{:03d}.csv".format(mode, now.strftime("%Y%m%d_%H%M%S"),
+                                                                    now.microsecond // 1000))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+        except OSError as e:
+            Logger.warning("SpectroApp: can't save acquisition ({!r})".format(e))
+            return None
+        device_info = self.devicescreen.devices_found.get(self.serial_port) if self.devicescreen else None
+        self.catalog.add(mode, path, wl_lo, wl_hi, label=label,
+                         model=device_info.model if device_info else None,
+                         firmware=device_info.firmware if device_info else None,
+                         instrument=self.spectro.port, timestamp=now.timestamp())
+        return path
+
+    # ---- render times
+    def toggle_performance_overlay(self):
+        """show the frame times of the graphs over the window (F12 or double tap on the connection label),
+        the probes are removed when it is hidden"""
+        if self.performance_overlay is None:
+            if self.profiler is None:
+                self.profiler = FrameProfiler(maxfps=int(Config.get("graphics", "maxfps")) or 60)
+            self.profiler.reset()
+            self.profiler.enable()
+            graph.set_render_probe(self.profiler)
+            delivery.set_probe(self.profiler)
+            self.performance_overlay = PerformanceOverlay(self.profiler)
+            Window.add_widget(self.performance_overlay)
+        else:
+            graph.set_render_probe(None)
+            delivery.set_probe(None)
+            self.profiler.disable()
+            self.performance_overlay.stop()
+            Window.remove_widget(self.performance_overlay)
+            self.performance_overlay = None
+
+    def _on_keyboard(self, window, key, *args):
+        if key == 293:  # F12
+            self.toggle_performance_overlay()
+            return True
+        return False
+
+    # ---- monitoring
+    def build_config(self, config):
+        # metrics_port: port of the Prometheus endpoint on 127.0.0.1, 0 to disable it
+        config.setdefaults('monitoring', {'metrics_port': 0})
+        # api_port: port of the control API (LIMS) on 127.0.0.1, 0 to disable it
+        config.setdefaults('control', {'api_port': 0})
+
+    def drivers(self):
+        """drivers : {port: driver} of the connected spectrometers"""
+        drivers = dict(self.devices.devices)
+        if self.spectro.backend.port is not None:
+            drivers[self.spectro.backend.port] = self.spectro.backend
+        return drivers
+
+    def driver(self, port=None):
+        """driver : driver of the spectrometer on port, the one of the device screen if port is None"""
+        if port is None:
+            return self.spectro.backend
+        return self.drivers().get(port)
+
+    def collect_metrics(self):
+        """collect_metrics : metric families of the instruments and of the UI (called from the metrics server
+        thread: only reads, the driver metrics are copied without lock)"""
+        families = driver_families(self.drivers())
+        kinetics = self.kineticsscreen.ids['box_kinetics'].kinetics if self.kineticsscreen else None
+        rates = []
+        if kinetics is not None:
+            rates = [('', {'wavelength': channel.wavelength}, channel.rate()) for channel in kinetics.channels]
+        families.append(('spectro_kinetics_running', 'gauge', "1 while a kinetics runs",
+                         [('', {}, 1 if kinetics is not None and kinetics.running else 0)]))
+        families.append(('spectro_kinetics_rate', 'gauge', "achieved samples/s of each kinetics channel", rates))
+        families.append(('spectro_ui_fps', 'gauge', "frames per second of the UI", [('', {}, Clock.get_fps())]))
+        families.append(('spectro_ui_frame_seconds', 'gauge', "duration of the last UI frame",
+                         [('', {}, Clock.frametime)]))
+        if self.profiler is not None and self.profiler.enabled:
+            report = self.profiler.report()
+            families.append(('spectro_ui_frame_mean_seconds', 'gauge', "mean UI frame time (render profiler)",
+                             [('', {}, report['frame_mean'] / 1000.)]))
+            families.append(('spectro_ui_dropped_frames_total', 'counter', "frames dropped (render profiler)",
+                             [('', {}, report['dropped'])]))
+        return families
+
     # ---- Start, stop, pause & resume
     def on_start(self):
-        self.spectro.activity_out_clbk = self.outcoming_data
-        self.spectro.activity_in_clbk = self.incoming_data
+        self.activity = ActivityMonitor(led_in=self.root.ids['led_in'], led_out=self.root.ids['led_out'])
+        self.spectro.backend.activity_out_clbk = self.activity.data_out
+        self.spectro.backend.activity_in_clbk = self.activity.data_in
+        self.devices.activity_out_clbk = self.activity.data_out
+        self.devices.activity_in_clbk = self.activity.data_in
+        self.discovery = DeviceDiscovery(os.path.join(self.user_data_dir, 'devices.json'))
+        self.catalog = AcquisitionCatalog(os.path.join(self.user_data_dir, 'catalog.sqlite'))
         wid = self.root.ids["screen_manager"]
         self.devicescreen = DeviceScreen(name="device", main_app=self)
         self.spectrumscreen = SpectrumScreen(name="spectrum", main_app=self)
@@ -71,6 +192,18 @@ class SpectroApp(App):
         wid.add_widget(self.spectrumscreen)
         wid.add_widget(self.absorbancescreen)
         wid.add_widget(self.kineticsscreen)
+        self.spectro.backend.connection_clbk = self.devicescreen.connection_changed
+        Window.bind(on_keyboard=self._on_keyboard)
+        port = self.config.getint('monitoring', 'metrics_port')
+        if port:
+            self.metrics_server = MetricsServer(self.collect_metrics, port)
+            if not self.metrics_server.start():
+                self.metrics_server = None
+        port = self.config.getint('control', 'api_port')
+        if port:
+            self.control_server = ControlServer(self.driver, self.drivers, self.devices, port)
+            if not self.control_server.start():
+                self.control_server = None
 
     def on_pause(self):
         return True
@@ -79,16 +212,12 @@ class SpectroApp(App):
         pass
 
     def on_stop(self):
-        pass
-
-    # ---- led activity
-    @mainthread
-    def incoming_data(self):
-        self.root.ids['led_in'].state = "on"
-
-    @mainthread
-    def outcoming_data(self):
-        self.root.ids['led_out'].state = "on"
+        if self.control_server is not None:
+            self.control_server.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.devices.disconnect_all()
+        self.catalog.close()
 
 
 myapp = SpectroApp()
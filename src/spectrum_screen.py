@@ -1,10 +1,15 @@
+from functools import partial
 from kivy.base import Builder
 from kivy.uix.screenmanager import Screen
 from kivy.uix.popup import Popup
 from kivy.uix.boxlayout import BoxLayout
 from kivy.clock import mainthread
-from graph import SmoothLinePlot
+from kivy.app import App
+from graph import MeshLinePlot, MultiSeriesPlot
 from kivy.properties import ObjectProperty, ListProperty, NumericProperty
+from lib_spectro.delivery import ResultChannel
+from lib_spectro.peaks import PeakTracker
+from lib_spectro.utilities import AutoScale
 from popups import *
 
 
@@ -59,23 +64,135 @@ class SpectrumScreen(Screen):
 
 
 class BoxSpectrum(BoxLayout):
+    pop_wl = ObjectProperty(None, allownone=True)
+    # plot of the current spectrum
+    plot = ObjectProperty(None, allownone=True)
+    # previous spectra of the session, drawn under the current one
+    history = ObjectProperty(None, allownone=True)
+    # last complete spectrum (wavelengths, values)
+    spectrum = ObjectProperty(None, allownone=True)
+    spectro = ObjectProperty(None, allownone=True)
+    main_app = ObjectProperty(None, allownone=True)
+    # baseline used by the current spectrum (lib_spectro.baseline.BaselineEntry)
+    baseline = ObjectProperty(None, allownone=True)
+    # peaks of the current spectrum, updated while it is scanned (lib_spectro.peaks.PeakTracker)
+    peaks = ObjectProperty(None, allownone=True)
+    # absorbance axis following the points of the current spectrum
+    autoscale = ObjectProperty(None, allownone=True)
 
     def set_wl(self):
         self.pop_wl = PopupWavelengthSpectrum(start=330, end=900)
         self.pop_wl.open()
 
+    def get_wl_range(self):
+        """get_wl_range : return selected wavelength bounds (start, end)"""
+        if self.pop_wl is None:
+            return 330, 900
+        return self.pop_wl.start, self.pop_wl.end
+
     def perform_blank(self, main_app):
-        print(self.pop_wl.start, self.pop_wl.end)
+        """baseline on the selected range, unless the last baseline of the instrument covers it"""
+        if not main_app.spectro.connected:
+            main_app.show_message("Mesure du blanc", "Spectromètre non connecté")
+            return
+        spectro = main_app.spectro
+        start, end = self.get_wl_range()
+        if main_app.baselines.find(spectro.port, start, end) is not None:
+            main_app.show_message("Mesure du blanc", "Ligne de base réutilisée")
+            return
+        self.main_app = main_app
+        self.baseline = None
         main_app.popup_operation = PopupOperation()
         main_app.popup_operation.open()
         main_app.popup_operation.update("Mesure du blanc", "En cours...")
-        main_app.popup_operation.close_after(5)
+        spectro.make_spectrum_baseline(start, end, clbk=partial(self.baseline_done, spectro.port, start, end))
+        # scan of the blank: residual subtracted from the spectra
+        spectro.get_spectrum(clbk=self.baseline_residual_done)
+
+    @mainthread
+    def baseline_done(self, instrument, start, end, ret):
+        if ret:
+            self.baseline = self.main_app.baselines.add(instrument, start, end)
+        else:
+            self.main_app.show_message("Mesure du blanc", "Erreur")
+
+    @mainthread
+    def baseline_residual_done(self, result):
+        if result is not None and self.baseline is not None:
+            self.baseline.set_residual(*result)
+        self.main_app.popup_operation.dismiss()
 
     def perform_spectrum(self, main_app):
-        main_app.popup_operation = PopupOperation()
-        main_app.popup_operation.open()
-        main_app.popup_operation.update("Mesure du spectre", "En cours...")
-        main_app.popup_operation.close_after(5)
+        """start a spectrum and draw the curve while the points arrive"""
+        if not main_app.spectro.connected:
+            main_app.show_message("Spectre", "Spectromètre non connecté")
+            return
+        graph = self.ids['graph_widget']
+        if self.plot is None:
+            self.history = MultiSeriesPlot(color=[0.6, 0.6, 0.6, 0.6])
+            graph.add_plot(self.history)
+            # the y axis follows the points during the scan: vertices stay in data coordinates, a new
+            # scale only updates the canvas transform (as the history, whose axes are shader uniforms)
+            self.plot = MeshLinePlot(color=[0.22, 0.79, 1, 1], data_transform=True)
+            graph.add_plot(self.plot)
+        graph.xmin, graph.xmax = self.get_wl_range()
+        if self.spectrum is not None:
+            self.history.add_series(zip(*self.spectrum), visible=self.ids['history_btn'].state == 'down')
+        del self.plot.points[:]
+        self.spectrum = None
+        self.spectro = main_app.spectro
+        self.baseline = main_app.baselines.find(main_app.spectro.port, *self.get_wl_range())
+        self.peaks = PeakTracker()
+        if self.autoscale is None:
+            self.autoscale = AutoScale(graph, 'y')
+        self.autoscale.reset()
+        self.ids['boxspectrum_title_lbl'].text = "Mesure de Spectre : en cours..."
+        channel = ResultChannel(on_data=self.spectrum_data, on_progress=self.spectrum_progress,
+                                on_done=self.spectrum_done)
+        main_app.spectro.get_spectrum(clbk=channel.done, progress_clbk=channel)
+
+    def show_history(self, visible):
+        if self.history is not None:
+            for sid in self.history.series():
+                self.history.set_visible(sid, visible)
+
+    def spectrum_data(self, start, wl, values):
+        """new slice of points (main thread) - appending only computes the vertices of the new points"""
+        if self.baseline is not None:
+            wl, values = self.baseline.correct(wl, values, *self.get_wl_range())
+        self.plot.points.extend(zip(wl, values))
+        self.autoscale.add(values)
+        self.peaks.feed(wl, values)
+
+    def cursor_changed(self, cursor):
+        """readout of the point under the graph crosshair"""
+        self.ids['boxspectrum_coordinates_lbl'].text = "" if cursor is None else "{:.1f} nm : A = {:.4f}".format(
+            *cursor[2])
+
+    def lambda_max_text(self):
+        wl = self.peaks.lambda_max() if self.peaks is not None else None
+        return "" if wl is None else " - λmax {:.1f} nm".format(wl)
+
+    def spectrum_progress(self, percent):
+        scan_range = self.spectro.scan_range
+        start, end = scan_range[:2] if scan_range is not None else self.get_wl_range()
+        eta = self.spectro.spectrum_eta((end - start + 1) * (100 - percent) / 100.)
+        self.ids['boxspectrum_title_lbl'].text = "Mesure de Spectre : {:d} % (reste {:.0f} s){:s}".format(
+            percent, eta, self.lambda_max_text())
+
+    def spectrum_done(self, result):
+        if result is None:
+            self.ids['boxspectrum_title_lbl'].text = "Mesure de Spectre : erreur"
+        else:
+            if self.baseline is not None:
+                result = self.baseline.correct(*result, *self.get_wl_range())
+            self.spectrum = result
+            self.peaks.finish()
+            self.ids['boxspectrum_title_lbl'].text = "Mesure de Spectre" + self.lambda_max_text()
+            wl, values = result
+            if len(wl):
+                App.get_running_app().record_acquisition('spectrum', wl[0], wl[-1], ("wavelength", "absorbance"),
+                                                         zip(wl, values))
 
 
 
@@ -108,6 +225,11 @@ Builder.load_string("""
         Button:
             text: "Mesure"
             on_release: root.perform_spectrum(app)
+        ToggleButton:
+            id: history_btn
+            text: "Superposer"
+            state: 'down'
+            on_state: root.show_history(self.state == 'down')
         Spinner:
             id: spectrum_export_spinner
             text: 'Exporter'
@@ -119,6 +241,8 @@ Builder.load_string("""
         height: dp(30)
     Graph:
         id: graph_widget
+        show_cursor: True
+        on_cursor: root.cursor_changed(self.cursor)
         xlabel: "longueur d\'onde (nm)"
         ylabel: "Absorbance"
         x_ticks_minor: 5
@@ -0,0 +1,124 @@
+import struct
+from threading import Condition, Timer
+from serial import SerialException
+from lib_spectro import s250Prim_async as s250
+
+
+class FakeS250:
+    """FakeS250 : serial port of a simulated S250/Prim spectrometer (same interface as serial.Serial)
+
+    Answers are available as soon as the command is written, after latency seconds (move_time per nm for a
+    wavelength move). Answers of a command can be delayed past the timeout of the driver with late."""
+
+    def __init__(self, latency=0., move_time=0., absorbance=0.5, init_ok=True):
+        self.latency = latency
+        self.move_time = move_time
+        self.absorbance = absorbance
+        self.init_ok = init_ok
+        self.timeout = None
+        self.is_open = True
+        self.written = []
+        self.wavelength = 500
+        self.scan_range = None
+        # command -> extra delay (s) of its answer
+        self.late = {}
+        # commands whose next write fails as if the cable was unplugged
+        self.fail = set()
+        self._input = bytearray()
+        self._cond = Condition()
+        self._cancel = False
+
+    # ---- serial.Serial interface
+    def write(self, data):
+        if not self.is_open:
+            raise SerialException("port closed")
+        self.written.append(bytes(data))
+        if data[1:2] in self.fail:
+            self.fail.discard(data[1:2])
+            raise SerialException("device disconnected")
+        answer, delay = self._answer(bytes(data))
+        if delay:
+            Timer(delay, self._receive, args=(answer,)).start()
+        else:
+            self._receive(answer)
+        return len(data)
+
+    def _receive(self, answer):
+        with self._cond:
+            self._input += answer
+            self._cond.notify_all()
+
+    def read(self, n):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._input) >= n or self._cancel or not self.is_open, self.timeout)
+            self._cancel = False
+            if not self.is_open:
+                raise SerialException("port closed")
+            data = bytes(self._input[:n])
+            del self._input[:n]
+            return data
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._input.clear()
+
+    @property
+    def in_waiting(self):
+        return len(self._input)
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancel = True
+            self._cond.notify_all()
+
+    def open(self):
+        """reopened by the driver: the device restarts without baseline"""
+        self.is_open = True
+        self.scan_range = None
+        self.reset_input_buffer()
+        return self
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    # ---- simulated device
+    def _answer(self, data):
+        if data == s250.Cmd_Init:
+            return (s250.Ans_Init_Ok if self.init_ok else s250.Ans_Init_Nok), self.latency
+        if data == s250.Cmd_GetAbsData:
+            return struct.pack(">Bh", 0, int(self.absorbance * 10000)), self.latency
+        command, payload = data[1:2], data[2:]
+        delay = self.latency + self.late.get(command, 0.)
+        if command == s250.Cmd_Firmware:
+            return b'\x00\x12', delay
+        if command == s250.Cmd_GetType:
+            return b'T\x00', delay
+        if command == s250.Cmd_SetAbsWavelength:
+            wavelength = struct.unpack(">HxxB", payload)[0]
+            delay += self.move_time * abs(wavelength - self.wavelength)
+            self.wavelength = wavelength
+            return s250.Ans_SetAbsWavelength_Ok, delay
+        if command in (s250.Cmd_GetAbs, s250.Cmd_GetZeroAbs):
+            return s250.Ans_GetAbs_Ok, delay
+        if command == s250.Cmd_BaseLine:
+            self.scan_range = struct.unpack(">HHBBxx", payload)
+            return s250.Ans_Baseline_Ok, delay
+        if command == s250.Cmd_GetSpectrum:
+            wllo, wlhi = self.scan_range[:2]
+            points = b''.join(struct.pack(">h", wl) for wl in range(wllo, wlhi + 1))
+            return struct.pack(">xxHHx", wllo, wlhi - wllo + 1) + points, delay
+        return b'', delay
+
+
+def fake_driver(monkeypatch, device=None, **kwargs):
+    """driver connected to a FakeS250 (returned with it)"""
+    device = device if device is not None else FakeS250(**kwargs)
+    monkeypatch.setattr(s250.S250Prim, 'open_port', lambda self, port: device.open())
+    driver = s250.S250Prim()
+    assert driver.connect('/dev/fake')
+    return driver, device
@@ -0,0 +1,48 @@
+import numpy as np
+from lib_spectro.absorbance import AbsorbanceBatch
+
+
+class Spectro:
+    """driver answering at once, absorbance = wavelength / 1000, settings of the wavelengths in fail fail"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.wavelength = None
+
+    def set_abs_wavelength(self, wavelength, clbk=None):
+        if wavelength in self.fail:
+            self.fail.discard(wavelength)
+            clbk(False)
+        else:
+            self.wavelength = wavelength
+            clbk(True)
+
+    def get_abs(self, clbk=None):
+        clbk(self.wavelength / 1000.)
+
+
+def test_samples():
+    results = []
+    batch = AbsorbanceBatch(Spectro(), [500, 600], result_clbk=lambda *args: results.append(args))
+    batch.measure_blank()
+    batch.measure_sample("a")
+    batch.measure_sample("b")
+    assert np.allclose(batch.blanks, [0.5, 0.6])
+    assert np.allclose(batch.absorbances, 0.)
+    assert len(results) == 4
+
+
+def test_reading_after_failed_setting_is_discarded():
+    results = []
+    spectro = Spectro()
+    batch = AbsorbanceBatch(spectro, [500, 600], result_clbk=lambda *args: results.append(args))
+    batch.measure_sample("a", concentration=1.)
+    spectro.fail = {500}
+    # descending order: 600 nm then 500 nm, where the grating stays at 600 nm
+    batch.measure_sample("b", concentration=2.)
+    assert results[2:] == [(1, 1, 0.6), (1, 0, None)]
+    assert np.isnan(batch.absorbances[1, 0])
+    assert batch.calibration[0].n == 1
+    # the setting is sent again for the next sample
+    batch.measure_sample("c")
+    assert results[4] == (2, 0, 0.5)
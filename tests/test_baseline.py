@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from lib_spectro.baseline import BaselineEntry, BaselineLibrary
+
+
+def test_find_reuses_a_baseline_covering_the_range():
+    library = BaselineLibrary()
+    entry = library.add('/dev/ttyUSB0', 300, 800, timestamp=1000.)
+    assert library.find('/dev/ttyUSB0', 400, 600, now=1010.) is entry
+    assert library.find('/dev/ttyUSB0', 300, 800, now=1010.) is entry
+    # outside the range, other settings or other instrument
+    assert library.find('/dev/ttyUSB0', 250, 600, now=1010.) is None
+    assert library.find('/dev/ttyUSB0', 400, 900, now=1010.) is None
+    assert library.find('/dev/ttyUSB0', 400, 600, speed=4, now=1010.) is None
+    assert library.find('/dev/ttyUSB0', 400, 600, res=1, now=1010.) is None
+    assert library.find('/dev/ttyUSB1', 400, 600, now=1010.) is None
+
+
+def test_only_the_last_baseline_is_used():
+    # the spectrometer scans the range of its last hardware baseline
+    library = BaselineLibrary()
+    library.add('/dev/ttyUSB0', 300, 800, timestamp=1000.)
+    last = library.add('/dev/ttyUSB0', 500, 600, timestamp=1100.)
+    assert library.find('/dev/ttyUSB0', 400, 700, now=1110.) is None
+    assert library.find('/dev/ttyUSB0', 520, 580, now=1110.) is last
+    assert [e.wllo for e in library.history('/dev/ttyUSB0')] == [300, 500]
+
+
+def test_expired_baselines_are_not_reused():
+    library = BaselineLibrary(max_age=60.)
+    entry = library.add('/dev/ttyUSB0', 300, 800, timestamp=1000.)
+    assert library.find('/dev/ttyUSB0', 400, 600, now=1060.) is entry
+    assert library.find('/dev/ttyUSB0', 400, 600, now=1060.5) is None
+    library.max_age = None
+    assert library.find('/dev/ttyUSB0', 400, 600, now=1e9) is entry
+
+
+def test_invalidate():
+    library = BaselineLibrary()
+    library.add('/dev/ttyUSB0', 300, 800, timestamp=1000.)
+    other = library.add('/dev/ttyUSB1', 300, 800, timestamp=1000.)
+    library.invalidate('/dev/ttyUSB0')
+    library.invalidate('/dev/ttyUSB2')
+    assert library.find('/dev/ttyUSB0', 400, 600, now=1010.) is None
+    assert library.find('/dev/ttyUSB1', 400, 600, now=1010.) is other
+    # history is kept
+    assert len(library.history()) == 2
+
+
+def test_history_is_bounded():
+    library = BaselineLibrary(max_entries=3)
+    for i in range(5):
+        library.add('/dev/ttyUSB0', 300 + i, 800, timestamp=1000. + i)
+    assert [e.wllo for e in library.history()] == [302, 303, 304]
+
+
+def test_residual_correction():
+    # blank scanned every 2 nm, spectra every nm: the residual is interpolated
+    entry = BaselineEntry('/dev/ttyUSB0', 300, 320, 8, 3, 1000., np.arange(300., 321., 2.),
+                          0.001 * np.arange(11))
+    wavelengths = np.arange(300., 321.)
+    values = np.vstack((np.full(21, 0.5), np.linspace(0., 1., 21)))
+    corrected_wl, corrected = entry.correct(wavelengths, values, 305, 315)
+    assert np.array_equal(corrected_wl, np.arange(305., 316.))
+    residual = 0.0005 * (corrected_wl - 300.)
+    assert corrected.shape == (2, 11)
+    assert corrected[0] == pytest.approx(0.5 - residual)
+    assert corrected[1] == pytest.approx(values[1, 5:16] - residual)
+    # 1D spectrum, whole range
+    corrected_wl, corrected = entry.correct(wavelengths, values[0])
+    assert corrected == pytest.approx(0.5 - 0.0005 * (wavelengths - 300.))
+
+
+def test_no_residual_scan_leaves_values_unchanged():
+    entry = BaselineEntry('/dev/ttyUSB0', 300, 320, 8, 3, 1000.)
+    wavelengths, values = entry.correct([300., 301., 302.], [0.1, 0.2, 0.3], wllo=301)
+    assert np.array_equal(wavelengths, [301., 302.]) and np.array_equal(values, [0.2, 0.3])
@@ -0,0 +1,33 @@
+from lib_spectro.catalog import AcquisitionCatalog
+
+
+def test_add_returns_the_id():
+    catalog = AcquisitionCatalog()
+    first = catalog.add('spectrum', 'a.csv', 400, 600, label="X")
+    second = catalog.add('absorbance', 'b.csv', 500, 500)
+    assert first is not None and second != first
+    assert [a.path for a in catalog.query(mode='spectrum')] == ['a.csv']
+    assert catalog.query(mode='absorbance')[0].id == second
+
+
+def test_add_many_returns_the_last_id():
+    catalog = AcquisitionCatalog()
+    records = [(t, None, None, None, 'kinetics', 500, 500, '', '{:d}.csv'.format(t)) for t in range(3)]
+    last = catalog.add_many(records)
+    assert catalog.query(limit=1)[0].id == last
+    assert catalog.count == 3
+    assert catalog.add_many([]) is None
+
+
+def test_statistics_refreshed_after_growing_by_a_quarter():
+    catalog = AcquisitionCatalog()
+    # small catalogs are analyzed again every 64 acquisitions (a quarter of 256)
+    records = [(t, None, None, None, 'spectrum', 400, 600, '', 'f') for t in range(320)]
+    catalog.add_many(records)
+    assert catalog._analyzed_count == 0
+    catalog.add('spectrum', 'g')
+    assert catalog._analyzed_count == 321
+    catalog.add_many(records[:80])
+    assert catalog._analyzed_count == 321
+    catalog.add('spectrum', 'h')
+    assert catalog._analyzed_count == 402
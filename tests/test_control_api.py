@@ -0,0 +1,48 @@
+import http.client
+import json
+import pytest
+from lib_spectro.control_api import ControlServer
+
+
+@pytest.fixture
+def server():
+    server = ControlServer(lambda port: None, dict, port=0)
+    assert server.start()
+    yield server
+    server.stop()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_json_request(server):
+    status, job = request(server, 'POST', '/jobs', json.dumps({'kind': 'spectrum', 'start': 400, 'end': 500}),
+                          {'Content-Type': 'application/json; charset=utf-8'})
+    assert status == 202
+    assert request(server, 'GET', '/status')[0] == 200
+    assert request(server, 'GET', '/status', headers={'Host': 'localhost:{:d}'.format(server.port)})[0] == 200
+
+
+def test_other_host_is_refused(server):
+    # page of another site resolved to the loopback (DNS rebinding)
+    status, answer = request(server, 'GET', '/status', headers={'Host': 'example.com:{:d}'.format(server.port)})
+    assert status == 403
+    status, answer = request(server, 'POST', '/jobs', json.dumps({'kind': 'spectrum', 'start': 400, 'end': 500}),
+                             {'Host': 'example.com', 'Content-Type': 'application/json'})
+    assert status == 403
+    assert not server.jobs
+
+
+def test_simple_post_is_refused(server):
+    # a page can send text/plain to any origin without preflight
+    for headers in ({'Content-Type': 'text/plain'}, {}):
+        status, answer = request(server, 'POST', '/devices/connect', json.dumps({'port': '/dev/ttyUSB0'}), headers)
+        assert status == 415
+    status, answer = request(server, 'POST', '/jobs', json.dumps({'kind': 'spectrum', 'start': 400, 'end': 500}),
+                             {'Content-Type': 'text/plain'})
+    assert status == 415
+    assert not server.jobs
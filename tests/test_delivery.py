@@ -0,0 +1,79 @@
+from threading import Thread
+from time import monotonic
+from lib_spectro.delivery import ResultChannel
+
+
+class Received:
+    def __init__(self):
+        self.data = []
+        self.progress = []
+        self.done = []
+
+    def channel(self, **kwargs):
+        return ResultChannel(on_data=lambda start, wl, values: self.data.append((start, list(wl), list(values))),
+                             on_progress=self.progress.append, on_done=self.done.append, **kwargs)
+
+
+def deliver(channel):
+    """what the main thread does on the next frame"""
+    channel._deliver(0)
+
+
+def test_points_are_delivered_in_slices_with_latest_progress():
+    received = Received()
+    channel = received.channel()
+    for i in range(3):
+        channel((10 * (i + 1), 400. + i, 0.1 * i))
+    deliver(channel)
+    channel((40, 403., 0.3))
+    channel.done('ok')
+    deliver(channel)
+    assert received.data == [(0, [400., 401., 402.], [0., 0.1, 0.2]), (3, [403.], [0.3])]
+    # intermediate progress values are dropped
+    assert received.progress == [30, 40]
+    assert received.done == ['ok']
+
+
+def test_nothing_is_delivered_twice():
+    received = Received()
+    channel = received.channel()
+    channel((50, 400., 1.))
+    deliver(channel)
+    deliver(channel)
+    assert len(received.data) == 1 and received.progress == [50] and received.done == []
+
+
+def test_backpressure_holds_the_command_thread_until_delivery():
+    received = Received()
+    channel = received.channel(max_pending=2, backpressure_timeout=5.)
+    channel((1, 400., 0.))
+    channel((2, 401., 0.))
+    elapsed = []
+
+    def command_thread():
+        start = monotonic()
+        channel((3, 402., 0.))
+        elapsed.append(monotonic() - start)
+
+    thread = Thread(target=command_thread)
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    deliver(channel)
+    thread.join(1.)
+    assert not thread.is_alive() and elapsed[0] < 5.
+    deliver(channel)
+    assert [values for _, _, values in received.data] == [[0., 0.], [0.]]
+
+
+def test_backpressure_gives_up_after_timeout():
+    # main thread stalled: the point is kept anyway after backpressure_timeout
+    received = Received()
+    channel = received.channel(max_pending=1, backpressure_timeout=0.1)
+    channel((50, 400., 0.))
+    start = monotonic()
+    channel((100, 401., 1.))
+    assert 0.09 <= monotonic() - start < 1.
+    deliver(channel)
+    assert received.data == [(0, [400., 401.], [0., 1.])]
+    assert received.progress == [100]
@@ -0,0 +1,97 @@
+import json
+import http.client
+from queue import Queue
+from lib_spectro import s250Prim_async as s250
+from lib_spectro.control_api import ControlServer
+from lib_spectro.device_manager import DeviceManager
+from fake_serial import FakeS250
+
+
+def fake_ports(monkeypatch, **devices):
+    monkeypatch.setattr(s250.S250Prim, 'open_port', lambda self, port: devices.get(port))
+
+
+def test_connect_starts_the_device(monkeypatch):
+    device = FakeS250()
+    fake_ports(monkeypatch, a=device)
+    manager = DeviceManager()
+    results = Queue()
+    driver = manager.connect('a', clbk=lambda port, ready: results.put((port, ready)))
+    assert driver is not None
+    assert results.get(timeout=5) == ('a', True)
+    assert device.written[0] == s250.Cmd_Init
+    assert manager['a'] is driver
+    manager.disconnect_all()
+
+
+def test_device_failing_to_start_is_disconnected(monkeypatch):
+    fake_ports(monkeypatch, a=FakeS250(init_ok=False))
+    manager = DeviceManager()
+    results = Queue()
+    driver = manager.connect('a', clbk=lambda port, ready: results.put((port, ready)))
+    assert results.get(timeout=5) == ('a', False)
+    assert 'a' not in manager
+    assert not driver.connected
+
+
+def test_port_that_cant_be_opened(monkeypatch):
+    fake_ports(monkeypatch)
+    assert DeviceManager().connect('a') is None
+
+
+def test_synchronized_acquisition(monkeypatch):
+    fake_ports(monkeypatch, a=FakeS250(absorbance=0.1), b=FakeS250(absorbance=0.2))
+    manager = DeviceManager()
+    ready = Queue()
+    for port in ('a', 'b'):
+        manager.connect(port, clbk=lambda port, ok: ready.put(ok))
+    assert ready.get(timeout=5) and ready.get(timeout=5)
+    results = Queue()
+    manager.acquire('get_abs', synchronized=True, clbk=lambda port, value: results.put((port, value)))
+    assert sorted([results.get(timeout=5), results.get(timeout=5)]) == [('a', 0.1), ('b', 0.2)]
+    assert sorted(record.port for record in manager.timeline) == ['a', 'b']
+    manager.disconnect_all()
+
+
+def test_timeline_is_bounded(monkeypatch):
+    manager = DeviceManager()
+    monkeypatch.setattr(manager, 'max_timeline', 100)
+    for i in range(1000):
+        manager._record('a', 'get_abs', None, i)
+    assert len(manager.timeline) <= 100
+    assert len(manager._timeline_times) == len(manager.timeline)
+    # the newest records are kept, in order
+    values = [record.value for record in manager.timeline]
+    assert values == list(range(1000 - len(values), 1000))
+    assert manager.timeline_between(manager.timeline[-1].timestamp)[-1].value == 999
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    connection.request(method, path, body=None if body is None else json.dumps(body),
+                       headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_control_api_connects_devices_and_reads_them_together(monkeypatch):
+    fake_ports(monkeypatch, a=FakeS250(absorbance=0.1), b=FakeS250(absorbance=0.2))
+    manager = DeviceManager()
+    server = ControlServer(lambda port: manager.devices.get(port), lambda: dict(manager.devices), manager, port=0)
+    assert server.start()
+    try:
+        assert request(server, 'POST', '/devices/connect', {'port': 'a'}) == (200, {'port': 'a', 'ready': True})
+        assert request(server, 'POST', '/devices/connect', {'port': 'b'}) == (200, {'port': 'b', 'ready': True})
+        status, job = request(server, 'POST', '/jobs', {'kind': 'absorbance', 'wavelengths': [450, 550],
+                                                        'ports': ['a', 'b']})
+        assert status == 202
+        connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+        connection.request('GET', '/jobs/{:d}/events'.format(job['id']))
+        end = json.loads(connection.getresponse().read().splitlines()[-1])
+        assert end['event'] == 'done'
+        assert end['result']['absorbances'] == {'a': [0.1, 0.1], 'b': [0.2, 0.2]}
+        assert request(server, 'POST', '/devices/disconnect', {'port': 'a'})[0] == 200
+        assert 'a' not in manager
+    finally:
+        server.stop()
+        manager.disconnect_all()
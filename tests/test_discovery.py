@@ -0,0 +1,49 @@
+from queue import Queue
+from threading import Event
+from lib_spectro import discovery
+from lib_spectro.discovery import DeviceDiscovery
+from lib_spectro.ports_watcher import PortInfo
+
+
+def port_info(port, serial_number=None):
+    return PortInfo(port, '', '', None, None, serial_number, '')
+
+
+def test_excluded_ports_are_not_probed(monkeypatch):
+    probed = []
+
+    def probe(port, timeout):
+        probed.append(port)
+        return 'Secomam S250 I+/E+', b'T\x00', 18
+    monkeypatch.setattr(discovery, 'probe_port', probe)
+    results = Queue()
+    finder = DeviceDiscovery()
+    finder.discover({'a': port_info('a'), 'b': port_info('b')}, results.put, exclude={'a'})
+    assert list(results.get(timeout=5)) == ['b']
+    assert probed == ['b']
+
+
+def test_one_discovery_at_a_time(monkeypatch):
+    release = Event()
+    running, probed = [], []
+
+    def probe(port, timeout):
+        running.append(port)
+        assert len(running) == 1
+        release.wait(5)
+        probed.append(port)
+        running.remove(port)
+        return None
+    monkeypatch.setattr(discovery, 'probe_port', probe)
+    results = Queue()
+    finder = DeviceDiscovery()
+    assert finder.discover({'a': port_info('a')}, results.put)
+    # requested while the first one runs: only the last one is kept
+    assert not finder.discover({'b': port_info('b')}, results.put)
+    assert not finder.discover({'c': port_info('c')}, results.put)
+    assert finder.busy
+    release.set()
+    results.get(timeout=5)
+    results.get(timeout=5)
+    assert probed == ['a', 'c']
+    assert results.empty()
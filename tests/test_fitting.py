@@ -0,0 +1,61 @@
+from math import exp, sqrt
+import numpy as np
+import pytest
+from lib_spectro.fitting import KineticsFit, OnlineLinearFit, t_quantile
+
+# two-sided 95 % and 99 % critical values of Student's t (statistical tables, 3 decimals)
+T_TABLE = [(0.975, 1, 12.706), (0.975, 2, 4.303), (0.975, 3, 3.182), (0.975, 4, 2.776), (0.975, 5, 2.571),
+           (0.975, 10, 2.228), (0.975, 30, 2.042), (0.995, 1, 63.657), (0.995, 2, 9.925), (0.995, 10, 3.169),
+           (0.995, 30, 2.750), (0.95, 5, 2.015), (0.95, 20, 1.725)]
+
+
+@pytest.mark.parametrize('p, dof, expected', T_TABLE)
+def test_t_quantile_matches_tables(p, dof, expected):
+    # exact for 1 and 2 degrees of freedom, the expansion is within 0.2 % above
+    tolerance = 5e-4 if dof <= 2 else 2e-3 * expected
+    assert t_quantile(p, dof) == pytest.approx(expected, abs=tolerance)
+    assert t_quantile(1. - p, dof) == pytest.approx(-t_quantile(p, dof))
+
+
+@pytest.mark.parametrize('offset', [0., 1e6, 1.7e9])
+def test_online_fit_matches_polyfit(offset):
+    # x far from 0 (e.g. timestamps in s since epoch): raw sums of x**2 would cancel out
+    rng = np.random.default_rng(3)
+    x = offset + np.sort(rng.uniform(0., 600., 50))
+    y = 0.8 - 2e-3 * (x - offset) + 1e-3 * rng.standard_normal(len(x))
+    online = OnlineLinearFit()
+    for xi, yi in zip(x, y):
+        online.add(float(xi), float(yi))
+    fit = online.fit()
+    (slope, intercept), cov = np.polyfit(x - offset, y, 1, cov='unscaled')
+    residual = np.sum((y - slope * (x - offset) - intercept) ** 2)
+    variance = residual / (len(x) - 2)
+    t = t_quantile(0.975, len(x) - 2)
+    assert fit.n == len(x)
+    assert fit.slope == pytest.approx(slope, rel=1e-6)
+    # intercept at x = 0 from the one at the offset
+    assert fit.intercept == pytest.approx(intercept - slope * offset, rel=1e-6, abs=1e-6)
+    assert fit.slope_ci == pytest.approx(t * sqrt(variance * cov[0, 0]), rel=1e-4)
+    assert fit.r2 == pytest.approx(1. - residual / np.sum((y - y.mean()) ** 2), rel=1e-6)
+
+
+def test_online_fit_needs_three_points_with_different_x():
+    fit = OnlineLinearFit()
+    for y in (1., 2., 3.):
+        fit.add(5., y)
+    assert fit.fit() is None and fit.slope() is None
+    fit.add(6., 4.)
+    assert fit.fit() is not None
+
+
+def test_kinetics_fit_finds_the_order():
+    fit = KineticsFit(a_inf=0.1)
+    t0 = 1.7e9
+    for i in range(100):
+        t = 3. * i
+        fit.add(t0 + t, 0.1 + 0.9 * exp(-4e-3 * t))
+    model, rate = fit.best()
+    assert model == 'first'
+    assert rate.k == pytest.approx(4e-3, rel=1e-6)
+    assert rate.r2 == pytest.approx(1.)
+    assert fit.rates()['initial'].n == 21
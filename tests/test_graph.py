@@ -0,0 +1,134 @@
+import pytest
+
+Window = pytest.importorskip('kivy.core.window').Window
+if Window is None:
+    pytest.skip("no window provider (graphics instructions need a GL context)", allow_module_level=True)
+from graph import MeshLinePlot, MeshStemPlot, Plot, SmoothLinePlot
+
+# plot area (x0, y0, x1, y1) in the graph
+Size = (40, 30, 840, 630)
+
+
+def transformed(plot):
+    """vertices of plot through its Translate and Scale instructions"""
+    (tx, ty), (sx, sy, _) = plot._translate.xy, plot._scale.xyz
+    vertices = list(plot._mesh.vertices)
+    return [(vertices[k] * sx + tx, vertices[k + 1] * sy + ty) for k in range(0, len(vertices), 4)]
+
+
+def projected(plot, points):
+    x_px, y_px = plot.x_px(), plot.y_px()
+    return [(x_px(x), y_px(y)) for x, y in points]
+
+
+def assert_close(a, b, tolerance=1e-3):
+    assert len(a) == len(b)
+    for (xa, ya), (xb, yb) in zip(a, b):
+        assert abs(xa - xb) < tolerance and abs(ya - yb) < tolerance
+
+
+def show(plot, xlog, xmin, xmax, ylog, ymin, ymax):
+    plot.update(xlog, xmin, xmax, ylog, ymin, ymax, Size)
+    plot.draw()
+
+
+@pytest.mark.parametrize('xlog, ylog', [(False, False), (True, False), (False, True), (True, True)])
+def test_transform_matches_projection(xlog, ylog):
+    plot = MeshLinePlot(data_transform=True)
+    plot.points = [(1 + 0.5 * i, 0.01 + (i % 7) * 0.3) for i in range(200)]
+    views = [(1, 100, 0.01, 2),
+             # pan
+             (21, 120, 0.11, 2.1),
+             # zoom in and out
+             (30, 40, 0.5, 0.6), (0.5, 1000, 0.001, 10)]
+    show(plot, xlog, *views[0][:2], ylog, *views[0][2:])
+    vertices = list(plot._mesh.vertices)
+    for xmin, xmax, ymin, ymax in views:
+        show(plot, xlog, xmin, xmax, ylog, ymin, ymax)
+        assert_close(transformed(plot), projected(plot, plot.points))
+        assert plot.transform_error() < 1e-6
+        # only the transform changed
+        assert list(plot._mesh.vertices) == vertices
+
+
+def test_appended_points():
+    plot = MeshLinePlot(data_transform=True)
+    plot.points = [(0, 0), (1, 1)]
+    show(plot, False, 0, 10, False, 0, 10)
+    plot.points.extend([(2, 4), (3, 9)])
+    show(plot, False, 0, 5, False, -1, 9)
+    assert_close(transformed(plot), projected(plot, plot.points))
+    del plot.points[1:]
+    show(plot, False, 0, 5, False, -1, 9)
+    assert_close(transformed(plot), projected(plot, [(0, 0)]))
+
+
+def test_scale_change_uploads_the_vertices():
+    plot = MeshLinePlot(data_transform=True)
+    plot.points = [(1, 1), (10, 100), (100, 10)]
+    show(plot, False, 1, 100, False, 1, 100)
+    show(plot, True, 1, 100, True, 1, 100)
+    assert list(plot._mesh.vertices)[:2] == [0, 0]
+    assert_close(transformed(plot), projected(plot, plot.points))
+
+
+def test_pixel_mode_unchanged():
+    plot = MeshLinePlot()
+    plot.points = [(1, 1), (10, 100), (100, 10)]
+    show(plot, True, 1, 100, False, 0, 100)
+    assert (plot._translate.xy, plot._scale.xyz) == ((0, 0), (1, 1, 1))
+    assert_close(transformed(plot), projected(plot, plot.points))
+
+
+def test_stems():
+    plot = MeshStemPlot(data_transform=True)
+    plot.points = [(1, 2), (3, 4)]
+    show(plot, False, 0, 5, False, -1, 5)
+    y0 = plot.y_px()(0)
+    expected = []
+    for x, y in projected(plot, plot.points):
+        expected += [(x, y0), (x, y)]
+    assert_close(transformed(plot), expected)
+
+
+def flat(points):
+    return [v for point in points for v in point]
+
+
+def test_projection_cache_follows_the_points():
+    plot = Plot()
+    plot.update(False, 0, 10, False, 0, 10, Size)
+    plot.points = [(0, 0), (1, 1)]
+    plot.flatten_points()
+    plot.points.extend([(2, 2)])
+    assert plot.flatten_points() == flat(projected(plot, plot.points))
+    # cleared and refilled longer between two draws
+    del plot.points[:]
+    plot.points.extend([(5, 5), (6, 6), (7, 7), (8, 8)])
+    assert plot.flatten_points() == flat(projected(plot, plot.points))
+    assert plot.nearest(*projected(plot, [(6, 6)])[0])[1] == 1
+    # changed in place, then appended
+    plot.points[0] = (9, 9)
+    plot.points.append((1, 2))
+    assert plot.flatten_points() == flat(projected(plot, plot.points))
+    assert plot.nearest(*projected(plot, [(9, 9)])[0])[1] == 0
+
+
+def test_smooth_line_plot_draw():
+    plot = SmoothLinePlot()
+    plot.points = [(1, 1), (2, 3)]
+    show(plot, False, 0, 10, False, 0, 10)
+    del plot.points[:]
+    plot.points.extend([(4, 4), (5, 5), (6, 6)])
+    plot.draw()
+    assert list(plot._gline.points) == pytest.approx(flat(projected(plot, plot.points)))
+
+
+def test_mesh_refilled_between_draws():
+    plot = MeshLinePlot(data_transform=True)
+    plot.points = [(1, 1), (2, 3)]
+    show(plot, False, 0, 10, False, 0, 10)
+    del plot.points[:]
+    plot.points.extend([(4, 4), (5, 5), (6, 6)])
+    plot.draw()
+    assert_close(transformed(plot), projected(plot, plot.points))
@@ -0,0 +1,75 @@
+from threading import Event
+from time import monotonic, sleep
+from lib_spectro.kinetics import MultiWavelengthKinetics
+from fake_serial import fake_driver
+
+
+class FailingSpectro:
+    """driver whose readings always fail"""
+    connected = True
+
+    def __init__(self):
+        self.reads = 0
+
+    def set_abs_wavelength(self, wavelength, clbk=None):
+        clbk(True)
+
+    def get_abs(self, clbk=None):
+        self.reads += 1
+        clbk(None)
+
+
+def test_stop_cancels_the_wait(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    done = Event()
+    kinetics = MultiWavelengthKinetics(driver, [500], interval=30., done_clbk=done.set)
+    assert kinetics.start()
+    while not len(kinetics.channels[0].buffer):
+        assert kinetics.elapsed() < 5
+        sleep(0.01)
+    # waiting 30 s for the next sample: stop ends the run now
+    kinetics.stop()
+    assert done.wait(1)
+    assert not kinetics.active
+    driver.disconnect()
+
+
+def test_no_restart_before_done(monkeypatch):
+    driver, device = fake_driver(monkeypatch, latency=0.2)
+    done = Event()
+    kinetics = MultiWavelengthKinetics(driver, [450, 550], done_clbk=done.set)
+    assert kinetics.start()
+    kinetics.stop()
+    # the first reading is still pending
+    assert not kinetics.start()
+    assert done.wait(5)
+    done.clear()
+    assert kinetics.start()
+    kinetics.stop()
+    assert done.wait(5)
+    # the sample read by the second run only
+    assert sum(len(channel.buffer) for channel in kinetics.channels) == 1
+    driver.disconnect()
+
+
+def test_late_callback_of_a_previous_run_is_ignored(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    kinetics = MultiWavelengthKinetics(driver, [500], done_clbk=lambda: None)
+    kinetics._run = 2
+    kinetics._sample(1, 0, 0.5)
+    assert not len(kinetics.channels[0].buffer)
+    assert kinetics.channels[0].errors == 0
+    driver.disconnect()
+
+
+def test_errors_stop_the_run(monkeypatch):
+    monkeypatch.setattr(MultiWavelengthKinetics, 'error_delay', 0.01)
+    spectro = FailingSpectro()
+    done = Event()
+    kinetics = MultiWavelengthKinetics(spectro, [450, 550], done_clbk=done.set)
+    start = monotonic()
+    kinetics.start()
+    assert done.wait(5)
+    assert spectro.reads == MultiWavelengthKinetics.max_errors
+    # retries wait longer after each error
+    assert monotonic() - start >= 0.01 * sum(range(1, MultiWavelengthKinetics.max_errors))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from lib_spectro.peaks import PeakTracker, find_peaks, lambda_max
+
+
+def random_spectrum(rng, n):
+    wavelengths = 400. + np.arange(n)
+    # rounded values give plateaus and equal heights
+    values = np.round(np.cumsum(rng.standard_normal(n)) * 0.05 + rng.random(n) * 0.03, 2)
+    return wavelengths, values
+
+
+def assert_same_peaks(a, b):
+    assert len(a.index) == len(b.index)
+    for field_a, field_b in zip(a, b):
+        assert np.allclose(field_a, field_b)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_tracker_finds_the_peaks_of_the_whole_spectrum(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(3, 80))
+    wavelengths, values = random_spectrum(rng, n)
+    min_prominence = float(rng.choice([0., 0.01, 0.05]))
+    expected = find_peaks(wavelengths, values, min_prominence)
+    tracker = PeakTracker(min_prominence, capacity=8)
+    start = 0
+    while start < n:
+        size = int(rng.integers(1, 12))
+        tracker.feed(wavelengths[start:start + size], values[start:start + size])
+        start += size
+        # open peaks are measured as if the scan ended here
+        assert_same_peaks(tracker.peaks(), find_peaks(wavelengths[:start], values[:start], min_prominence)) \
+            if start >= 3 else None
+    assert_same_peaks(tracker.finish(), expected)
+    assert tracker.lambda_max() == lambda_max(expected)
+
+
+def test_peak_properties():
+    wavelengths = np.arange(400., 501.)
+    values = np.exp(-0.5 * ((wavelengths - 450.3) / 5.) ** 2)
+    peaks = find_peaks(wavelengths, values)
+    assert len(peaks.index) == 1
+    assert abs(peaks.wavelength[0] - 450.3) < 0.1
+    assert abs(peaks.width[0] - 2.3548 * 5.) < 0.1
+    assert abs(peaks.centroid[0] - 450.3) < 0.1
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_tracker_on_long_spectra(seed):
+    # long rows: the nearest points are searched in the sparse tables
+    rng = np.random.default_rng(100 + seed)
+    wavelengths, values = random_spectrum(rng, 3000)
+    expected = find_peaks(wavelengths, values, 0.02)
+    tracker = PeakTracker(0.02)
+    for start in range(0, 3000, 37):
+        tracker.feed(wavelengths[start:start + 37], values[start:start + 37])
+    assert_same_peaks(tracker.finish(), expected)
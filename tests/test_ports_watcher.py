@@ -0,0 +1,22 @@
+from threading import Event
+from lib_spectro import ports_watcher
+from lib_spectro.ports_watcher import SerialPortWatcher
+
+
+def test_no_callback_after_stop(monkeypatch):
+    scanning, release = Event(), Event()
+
+    def slow_scan():
+        scanning.set()
+        release.wait(5)
+        return {'/dev/ttyUSB0': None}
+    monkeypatch.setattr(ports_watcher, 'scan_serial_ports', slow_scan)
+    calls = []
+    watcher = SerialPortWatcher(calls.append)
+    watcher.start()
+    assert scanning.wait(5)
+    watcher.stop()
+    release.set()
+    watcher.join(5)
+    assert not watcher.is_alive()
+    assert calls == []
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from lib_spectro.processing import (Pipeline, PolynomialBaseline, Resample, SavitzkyGolay, Transmittance,
+                                    savgol_filter)
+
+
+def spectrum(n=120, seed=0):
+    rng = np.random.default_rng(seed)
+    wavelengths = 400. + 2. * np.arange(n)
+    values = np.sin(wavelengths / 37.) + 0.3 * np.cos(wavelengths / 11.) + 0.01 * rng.standard_normal(n)
+    return wavelengths, values
+
+
+def local_polyfit(wavelengths, values, window, order, deriv):
+    """value (or derivative) at each point of the polynomial fitted on its window (first or last at edges)"""
+    n, half = len(values), window // 2
+    result = np.empty(n)
+    for i in range(n):
+        lo = min(max(i - half, 0), n - window)
+        poly = np.polynomial.Polynomial.fit(wavelengths[lo:lo + window], values[lo:lo + window], order)
+        result[i] = poly.deriv(deriv)(wavelengths[i]) if deriv else poly(wavelengths[i])
+    return result
+
+
+@pytest.mark.parametrize('deriv', [0, 1, 2])
+def test_savgol_matches_local_polyfit(deriv):
+    wavelengths, values = spectrum()
+    delta = wavelengths[1] - wavelengths[0]
+    result = savgol_filter(values, 11, 3, deriv, delta)
+    expected = local_polyfit(wavelengths, values, 11, 3, deriv)
+    assert np.allclose(result, expected, atol=1e-9 * 10 ** deriv)
+
+
+def chunks(wavelengths, values, sizes):
+    start = 0
+    for size in sizes:
+        yield wavelengths[start:start + size], values[..., start:start + size]
+        start += size
+    if start < len(wavelengths):
+        yield wavelengths[start:], values[..., start:]
+
+
+def streamed(step, wavelengths, values, sizes):
+    step.reset()
+    parts = [step.feed(wl, v) for wl, v in chunks(wavelengths, values, sizes)]
+    tail = step.flush()
+    if tail is not None:
+        parts.append(tail)
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts], axis=-1)
+
+
+Steps = [lambda: SavitzkyGolay(11, 3), lambda: SavitzkyGolay(7, 2, deriv=1), lambda: SavitzkyGolay(9, 3, deriv=2),
+         lambda: Resample(np.arange(395., 650., 5.)), lambda: PolynomialBaseline(2, [(400, 450), (600, 640)]),
+         lambda: Pipeline(SavitzkyGolay(11, 3), Resample(np.arange(401., 630., 3.)), Transmittance()),
+         lambda: Pipeline(PolynomialBaseline(1), SavitzkyGolay(5, 2, deriv=1))]
+
+
+@pytest.mark.parametrize('make_step', Steps)
+@pytest.mark.parametrize('sizes', [[120], [1] * 120, [3, 5, 1, 20, 7, 40], [10] * 12])
+def test_streaming_matches_batch(make_step, sizes):
+    wavelengths, values = spectrum()
+    step = make_step()
+    expected = step(wavelengths, values)
+    result = streamed(step, wavelengths, values, sizes)
+    assert np.array_equal(result[0], expected[0])
+    assert np.allclose(result[1], expected[1], equal_nan=True)
+    # the step is ready for the next scan
+    result = streamed(step, wavelengths, values, sizes[::-1])
+    assert np.allclose(result[1], expected[1], equal_nan=True)
+
+
+def test_streaming_several_spectra():
+    wavelengths, values = spectrum()
+    values = np.stack([values, 2. * values, values + 1.])
+    pipeline = Pipeline(SavitzkyGolay(11, 3), Transmittance())
+    expected = pipeline(wavelengths, values)
+    result = streamed(pipeline, wavelengths, values, [4, 17, 30, 2])
+    assert result[1].shape == values.shape
+    assert np.allclose(result[1], expected[1])
+
+
+def test_stream_callbacks():
+    wavelengths, values = spectrum()
+    pipeline = Pipeline(SavitzkyGolay(11, 3))
+    received, done = [], []
+    on_data, on_done = pipeline.stream(lambda start, wl, v: received.append((start, wl, v)), done.append)
+    for wl, v in chunks(wavelengths, values, [25] * 4):
+        on_data(0, wl.copy(), v.copy())
+    on_done('result')
+    assert done == ['result']
+    starts = np.cumsum([0] + [len(wl) for _, wl, _ in received])
+    assert [start for start, _, _ in received] == list(starts[:-1])
+    assert np.allclose(np.concatenate([v for _, _, v in received]), pipeline(wavelengths, values)[1])
+
+
+def test_scan_shorter_than_the_window():
+    wavelengths, values = spectrum(8)
+    step = SavitzkyGolay(11, 3)
+    result = streamed(step, wavelengths, values, [3, 3])
+    assert np.allclose(result[1], step(wavelengths, values)[1])
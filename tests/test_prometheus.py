@@ -0,0 +1,45 @@
+import re
+from queue import Queue
+from lib_spectro.prometheus import driver_families, format_metrics
+from fake_serial import fake_driver
+
+Sample = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+Suffixes = {'counter': ('',), 'gauge': ('',), 'histogram': ('_bucket', '_sum', '_count')}
+
+
+def parse(text):
+    """family name -> (type, [(sample name, labels, value)]) - samples must belong to the family declared
+    before them, as in the text format 0.0.4"""
+    families = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family, kind = line[7:].split(' ')
+            assert family not in families
+            families[family] = (kind, [])
+        elif not line.startswith('# HELP '):
+            name, labels, value = Sample.match(line).groups()
+            kind, samples = families[family]
+            assert name in [family + suffix for suffix in Suffixes[kind]], line
+            samples.append((name, labels, float(value)))
+    return families
+
+
+def test_driver_metrics_exposition(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    results = Queue()
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) == 0.5
+    families = parse(format_metrics(driver_families({'/dev/ttyUSB0': driver})))
+    driver.disconnect()
+    for name, (kind, samples) in families.items():
+        if kind == 'counter':
+            assert name.endswith('_total')
+    kind, samples = families['spectro_commands_total']
+    assert kind == 'counter'
+    assert ('spectro_commands_total', '{port="/dev/ttyUSB0",command="get_abs"}', 1.) in samples
+    kind, samples = families['spectro_command_stage_seconds']
+    assert kind == 'histogram'
+    assert {name for name, labels, value in samples} == {'spectro_command_stage_seconds_bucket',
+                                                        'spectro_command_stage_seconds_sum',
+                                                        'spectro_command_stage_seconds_count'}
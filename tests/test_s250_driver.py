@@ -0,0 +1,79 @@
+from queue import Queue
+from threading import Event, Thread
+from time import sleep
+import pytest
+from lib_spectro.kinetics import MultiWavelengthKinetics
+from lib_spectro.s250Prim_async import NotConnectedError
+from lib_spectro import s250Prim_async as s250
+from fake_serial import fake_driver
+
+
+def test_get_abs(monkeypatch):
+    driver, device = fake_driver(monkeypatch, absorbance=0.25)
+    results = Queue()
+    driver.set_abs_wavelength(600, clbk=results.put)
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) is True
+    assert results.get(timeout=5) == 0.25
+    driver.disconnect()
+
+
+def test_disconnect_during_kinetics(monkeypatch):
+    """failed callbacks of the pending commands queue new ones: disconnect must not drain them forever"""
+    driver, device = fake_driver(monkeypatch, latency=0.001)
+    done = Event()
+    kinetics = MultiWavelengthKinetics(driver, [450, 550, 650], done_clbk=done.set)
+    kinetics.start()
+    sleep(0.2)
+    assert sum(len(channel.buffer) for channel in kinetics.channels) > 0
+    disconnect = Thread(target=driver.disconnect, daemon=True)
+    disconnect.start()
+    disconnect.join(5)
+    assert not disconnect.is_alive()
+    assert done.wait(5)
+    assert not kinetics.running
+    assert all(channel.errors < 10 for channel in kinetics.channels)
+    with pytest.raises(NotConnectedError):
+        driver.get_abs()
+
+
+def test_reconnection_loses_the_baseline(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    monkeypatch.setattr(driver, 'reconnect_delays', (0.01,))
+    states, results = Queue(), Queue()
+    driver.connection_clbk = states.put
+    driver.make_spectrum_baseline(400, 420, clbk=results.put)
+    assert results.get(timeout=5) is True
+    assert driver.scan_range == (400, 420, 3, 8)
+    # the spectrum is not replayed after the reconnection, a reading is
+    device.fail = {b'\x35', b'\x32'}
+    driver.get_spectrum(clbk=results.put)
+    assert results.get(timeout=5) is None
+    assert driver.scan_range is None
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) == 0.5
+    assert [states.get(timeout=1) for _ in range(4)] == ['lost', 'reconnected', 'lost', 'reconnected']
+    driver.disconnect()
+
+
+def test_disconnect_during_reconnection(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    monkeypatch.setattr(driver, 'reconnect_delays', (0.01,))
+
+    def open_port(port):
+        # disconnect() from another thread while the port is reopened
+        driver.connected = False
+        return device.open()
+    monkeypatch.setattr(driver, 'open_port', open_port)
+    results = Queue()
+    thread = driver.command_thread
+    device.fail = {s250.Cmd_GetAbs}
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) is None
+    # the command thread survived, it answers (fails) the next commands
+    sleep(0.1)
+    assert thread.is_alive()
+    driver.connected = True
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) is None
+    driver.disconnect()
@@ -0,0 +1,83 @@
+from queue import Queue
+from time import sleep
+from lib_spectro import s250Prim_async as s250
+from lib_spectro.timing import TimingModel
+from fake_serial import fake_driver
+
+
+def test_short_moves_dont_shorten_the_timeout_of_long_ones():
+    timing = TimingModel(latency_priors=s250.Latency_Priors)
+    latency, move_time = 0.1, 0.004
+    for _ in range(50):
+        timing.record(s250.Cmd_SetAbsWavelength, latency + 5 * move_time, 6, 1, travel=5)
+    assert timing.timeout(s250.Cmd_SetAbsWavelength, 6, 1, travel=500) > latency + 500 * move_time
+    for travel in (300, 50, 200, 100, 400):
+        timing.record(s250.Cmd_SetAbsWavelength, latency + travel * move_time, 6, 1, travel=travel)
+    for _ in range(50):
+        timing.record(s250.Cmd_SetAbsWavelength, latency + 5 * move_time, 6, 1, travel=5)
+    assert timing.timeout(s250.Cmd_SetAbsWavelength, 6, 1, travel=570) > latency + 570 * move_time
+    expected = timing.expected(s250.Cmd_SetAbsWavelength, 6, 1, travel=500)
+    assert abs(expected - (latency + 500 * move_time)) < 0.5
+
+
+def test_travel_of_a_move(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    payload = lambda wl: s250.struct.pack(">HxxB", wl, 255)
+    assert driver.travel(s250.Cmd_SetAbsWavelength, payload(400)) == 570
+    results = Queue()
+    driver.set_abs_wavelength(400, clbk=results.put)
+    assert results.get(timeout=5)
+    assert driver.travel(s250.Cmd_SetAbsWavelength, payload(650)) == 250
+    assert driver.travel(s250.Cmd_GetAbs) == 0
+    driver.disconnect()
+
+
+def test_late_answer_is_not_read_by_the_next_command(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    device.late[s250.Cmd_Firmware] = 0.2
+    results = Queue()
+    driver.get_firmware_version(clbk=results.put, timeout=0.05)
+    assert results.get(timeout=5) is None
+    sleep(0.3)
+    driver.get_model_name(clbk=results.put)
+    assert results.get(timeout=5) == ("Secomam S250 I+/E+", b'T\x00')
+    driver.disconnect()
+
+
+def test_timeout_doubles_after_a_timeout():
+    timing = TimingModel(latency_priors=s250.Latency_Priors)
+    for _ in range(50):
+        timing.record(s250.Cmd_GetAbs, 0.05, 2, 3)
+    converged = timing.timeout(s250.Cmd_GetAbs, 2, 3)
+    timing.timed_out(s250.Cmd_GetAbs)
+    assert timing.timeout(s250.Cmd_GetAbs, 2, 3) == 2 * converged
+    timing.timed_out(s250.Cmd_GetAbs)
+    assert timing.timeout(s250.Cmd_GetAbs, 2, 3) == 4 * converged
+    for _ in range(20):
+        timing.timed_out(s250.Cmd_GetAbs)
+    assert timing.timeout(s250.Cmd_GetAbs, 2, 3) <= 2 ** timing.max_backoff * converged
+    # other commands keep their timeout
+    assert timing.timeout(s250.Cmd_Firmware, 2, 2) < timing.max_timeout
+    timing.record(s250.Cmd_GetAbs, 0.05, 2, 3)
+    assert timing.timeout(s250.Cmd_GetAbs, 2, 3) <= converged * 1.5
+    point = timing.point_timeout(1)
+    timing.point_timed_out(1)
+    assert timing.point_timeout(1) == 2 * point
+    timing.record_point(1, 0.25)
+    assert timing.point_timeout(1) < 2 * point
+
+
+def test_slowed_down_device_is_waited_for(monkeypatch):
+    driver, device = fake_driver(monkeypatch)
+    results = Queue()
+    for _ in range(20):
+        driver.get_abs(clbk=results.put)
+        assert results.get(timeout=5) == 0.5
+    # e.g. lamp warm-up: answers now come after the converged timeout
+    device.late[s250.Cmd_GetAbs] = 0.5
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) is None
+    sleep(0.5)
+    driver.get_abs(clbk=results.put)
+    assert results.get(timeout=5) == 0.5
+    driver.disconnect()
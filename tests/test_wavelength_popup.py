@@ -0,0 +1,44 @@
+import pytest
+
+Window = pytest.importorskip('kivy.core.window').Window
+if Window is None:
+    pytest.skip("no window provider", allow_module_level=True)
+from kivy.factory import Factory
+from kivy.lang import Builder
+from kinetics_screen import PopupWavelengthKinetics
+
+if 'SpecButton' not in Factory.classes:
+    # defined in spectro.kv, loaded by the application
+    Builder.load_string("<SpecButton@Button>:\n")
+
+
+def popup(selected):
+    p = PopupWavelengthKinetics(wavelength=500, wavelengths=[500], ok_clbk=selected.append)
+    p.when_opened()
+    return p
+
+
+def test_cancel_keeps_the_wavelengths():
+    selected = []
+    p = popup(selected)
+    p.on_clear()
+    p.on_cancel()
+    assert selected == []
+
+
+def test_ok_gives_the_wavelengths():
+    selected = []
+    p = popup(selected)
+    p.ids['wl_sldr'].value = 600
+    p.on_add()
+    p.on_ok()
+    assert selected == [[500, 600]]
+
+
+def test_ok_never_gives_an_empty_list():
+    selected = []
+    p = popup(selected)
+    p.on_clear()
+    p.ids['wl_sldr'].value = 420
+    p.on_ok()
+    assert selected == [[420]]